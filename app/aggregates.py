@@ -0,0 +1,155 @@
+import itertools
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import Integer, cast, func
+from sqlmodel import Session, select
+from .models import SensorAggregateBucket, SensorData
+from .queries import SENSOR_DATA_COLUMNS, ReadingFilter, sensor_data_filters
+from . import archive, rollups, segments
+
+# Supported bucket widths in seconds
+BUCKETS = {
+    "1m": 60,
+    "5m": 5 * 60,
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+
+# Refuse ranges that would produce more buckets than a chart can use
+MAX_BUCKETS = 5000
+
+def align_range(start: datetime, end: datetime, bucket: str) -> Tuple[datetime, datetime]:
+    """Widen [start, end) to whole buckets so every bucket covers its full width"""
+    width = timedelta(seconds=BUCKETS[bucket])
+    aligned_start = rollups.EPOCH + (start - rollups.EPOCH) // width * width
+    aligned_end = rollups.EPOCH + -(-(end - rollups.EPOCH) // width) * width
+    return aligned_start, max(aligned_end, aligned_start + width)
+
+def bucket_count(start: datetime, end: datetime, bucket: str) -> int:
+    width = timedelta(seconds=BUCKETS[bucket])
+    return -(-(end - start) // width)
+
+def aggregate_sensor_data(
+    session: Session,
+    start: datetime,
+    end: datetime,
+    bucket: str,
+    device_id: Optional[str] = None,
+) -> Tuple[str, List[SensorAggregateBucket]]:
+    """min/max/avg per bucket over [start, end); returns (source, buckets).
+
+    Uses the coarsest rollup that tiles the bucket width, so the cost depends
+    on the number of buckets rather than the number of raw readings. Falls
+    back to GROUP BY over sensordata, or a pass over the segment files in
+    segment mode, while the rollups are catching up; archived chunks in the
+    range (app/archive.py) are decoded and passed over as well.
+    start and end must already be aligned with align_range().
+    """
+    rollup = rollups.rollup_for(BUCKETS[bucket])
+    if rollup and rollups.is_current(session):
+        name, model = rollup
+        return f"rollup_{name}", _from_rollup(session, model, start, end, bucket, device_id)
+    reading_filter = ReadingFilter(device_id=device_id, start=start, end=end)
+    archived = archive.newest(session, reading_filter) is not None
+    if not (segments.ENABLED or archived):
+        return "raw", _from_raw(session, start, end, bucket, device_id)
+    if segments.ENABLED:
+        rows = segments.read_rows(session, reading_filter)
+    else:
+        rows = session.execute(select(*SENSOR_DATA_COLUMNS).where(*sensor_data_filters(*reading_filter)))
+    if archived:
+        rows = itertools.chain(rows, archive.read_rows(session, reading_filter))
+    return "raw", _from_rows(rows, bucket)
+
+def _from_raw(session, start, end, bucket, device_id):
+    seconds = BUCKETS[bucket]
+    epoch = cast(func.strftime("%s", SensorData.created_at), Integer)
+    bucket_start = ((epoch // seconds) * seconds).label("bucket_start")
+
+    stmt = (
+        select(
+            bucket_start,
+            func.count().label("count"),
+            func.min(SensorData.temperature), func.max(SensorData.temperature), func.avg(SensorData.temperature),
+            func.min(SensorData.humidity), func.max(SensorData.humidity), func.avg(SensorData.humidity),
+            func.min(SensorData.lux), func.max(SensorData.lux), func.avg(SensorData.lux),
+            func.avg(cast(SensorData.pump_active, Integer)),
+        )
+        .where(SensorData.created_at >= start)
+        .where(SensorData.created_at < end)
+        .group_by(bucket_start)
+        .order_by(bucket_start)
+    )
+    if device_id:
+        stmt = stmt.where(SensorData.device_id == device_id)
+
+    return [_bucket(row) for row in session.exec(stmt)]
+
+def _from_rows(rows, bucket):
+    seconds = BUCKETS[bucket]
+    # bucket_start -> [count, pump_on, then min, max, sum for temperature, humidity and lux]
+    groups = {}
+    for temperature, humidity, lux, pump_active, *_, created_at in rows:
+        ts = rollups.epoch_seconds(created_at)
+        key = ts - ts % seconds
+        agg = groups.get(key)
+        if agg is None:
+            groups[key] = [1, int(pump_active), temperature, temperature, temperature,
+                           humidity, humidity, humidity, lux, lux, lux]
+            continue
+        agg[0] += 1
+        agg[1] += pump_active
+        for offset, value in ((2, temperature), (5, humidity), (8, lux)):
+            agg[offset] = min(agg[offset], value)
+            agg[offset + 1] = max(agg[offset + 1], value)
+            agg[offset + 2] += value
+    return [
+        _bucket((
+            key, count,
+            t_min, t_max, t_sum / count,
+            h_min, h_max, h_sum / count,
+            l_min, l_max, l_sum / count,
+            pump_on / count,
+        ))
+        for key, (count, pump_on, t_min, t_max, t_sum, h_min, h_max, h_sum, l_min, l_max, l_sum) in sorted(groups.items())
+    ]
+
+def _from_rollup(session, model, start, end, bucket, device_id):
+    seconds = BUCKETS[bucket]
+    bucket_start = ((model.bucket_start // seconds) * seconds).label("bucket_start")
+    count = func.sum(model.count)
+
+    stmt = (
+        select(
+            bucket_start,
+            count,
+            func.min(model.temperature_min), func.max(model.temperature_max), func.sum(model.temperature_sum) / count,
+            func.min(model.humidity_min), func.max(model.humidity_max), func.sum(model.humidity_sum) / count,
+            func.min(model.lux_min), func.max(model.lux_max), func.sum(model.lux_sum) / count,
+            func.sum(model.pump_on) * 1.0 / count,
+        )
+        .where(model.bucket_start >= rollups.epoch_seconds(start))
+        .where(model.bucket_start < rollups.epoch_seconds(end))
+        .group_by(bucket_start)
+        .order_by(bucket_start)
+    )
+    if device_id:
+        stmt = stmt.where(model.device_id == device_id)
+
+    return [_bucket(row) for row in session.exec(stmt)]
+
+def _bucket(row) -> SensorAggregateBucket:
+    (bucket_start, count,
+     t_min, t_max, t_avg,
+     h_min, h_max, h_avg,
+     l_min, l_max, l_avg,
+     pump) = row
+    return SensorAggregateBucket(
+        bucket_start=datetime.utcfromtimestamp(bucket_start),
+        count=count,
+        temperature_min=t_min, temperature_max=t_max, temperature_avg=t_avg,
+        humidity_min=h_min, humidity_max=h_max, humidity_avg=h_avg,
+        lux_min=l_min, lux_max=l_max, lux_avg=l_avg,
+        pump_duty_cycle=pump,
+    )
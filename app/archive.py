@@ -0,0 +1,371 @@
+"""Compressed chunks for old readings (PI_SENSOR_ARCHIVE_AGE).
+
+Readings stay where ingest puts them, in sensordata or the segment files,
+until they are older than PI_SENSOR_ARCHIVE_AGE. compact() then moves them
+into reading_chunk rows: up to CHUNK_RECORDS readings of one device,
+firmware version and sensor type within one PI_SENSOR_ARCHIVE_BLOCK_S time
+block, stored column by column with the encodings of app/columnar.py.
+Readings arrive at a steady rate and change slowly, so a chunk takes a
+small fraction of the space the same readings take in sensordata.
+
+The list, lookup, export and aggregate reads merge the chunks with the live
+store by (created_at, id), so the API doesn't change when readings move. A
+chunk is decoded when a read reaches it, and each process keeps the last
+MAX_DECODED chunks it decoded.
+
+Chunks are encoded before the write transaction, which checks that the
+readings are still there as they were read before it inserts the chunks
+and deletes them; if not, the batch is read again. Archived readings can't
+be edited or deleted one at a time, a resent reading is no longer
+recognised as a duplicate once the one it repeats is archived, and retention
+drops whole chunks once their newest reading has expired.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from functools import partial
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from sqlalchemy import Result, Row, delete, func, insert, not_, or_, select
+from sqlmodel import Session
+from .columnar import decode_chunk, encode_chunk
+from .config import settings
+from .models import ReadingChunk, ReadingSegment, SensorData
+from .queries import (
+    DEFAULT_PAGE_SIZE, SENSOR_DATA_COLUMNS, SENSOR_DATA_FIELDS, ReadingFilter,
+    decode_cursor, encode_cursor, list_sensor_data_page, sensor_data_filters,
+)
+from .segments import from_micros, micros
+from . import segments
+
+logger = logging.getLogger(__name__)
+
+# Readings per chunk at most; a day of one reading a minute fits in one
+CHUNK_RECORDS = 4096
+BLOCK_US = max(1, settings.archive_block_s) * 1_000_000
+# sensordata readings read per compaction step
+BATCH_RECORDS = 4 * CHUNK_RECORDS
+# Ids per IN list when checking and deleting a batch
+ID_BATCH = 500
+# Steps in a row that may find their readings changed before compact() gives up for this run
+MAX_ATTEMPTS = 3
+# Decoded chunks kept per process
+MAX_DECODED = 8
+# Chunks written per run of the background task, which goes again at once while readings are left
+CHUNKS_PER_RUN = 16
+
+CHUNK_COLUMNS = (
+    ReadingChunk.id, ReadingChunk.device_id, ReadingChunk.firmware_version, ReadingChunk.sensor_type,
+    ReadingChunk.count, ReadingChunk.first_id, ReadingChunk.last_id,
+    ReadingChunk.first_created_at, ReadingChunk.last_created_at,
+)
+
+_NEWEST_FIRST = itemgetter(9, 8)
+
+# ------------------ Reading ------------------
+_decoded: "OrderedDict[int, List[list]]" = OrderedDict()
+_decoded_lock = threading.Lock()
+
+def _columns(session: Session, chunk_id: int) -> Optional[List[list]]:
+    """A chunk's columns in app/columnar.py's COLUMNS order; None if it was dropped meanwhile"""
+    columns = _decoded.get(chunk_id)
+    if columns is not None:
+        try:
+            _decoded.move_to_end(chunk_id)
+        except KeyError:
+            pass
+        return columns
+    data = session.connection().execute(select(ReadingChunk.data).where(ReadingChunk.id == chunk_id)).scalar()
+    if data is None:
+        return None
+    columns = decode_chunk(data)
+    with _decoded_lock:
+        _decoded[chunk_id] = columns
+        while len(_decoded) > MAX_DECODED:
+            _decoded.popitem(last=False)
+    return columns
+
+def _row(chunk: Row, columns: List[list], position: int) -> tuple:
+    """A reading as a row tuple in SENSOR_DATA_FIELDS order"""
+    ids, created, timestamps, temperatures, humidities, luxes, pumps = columns
+    return (
+        temperatures[position], humidities[position], luxes[position], pumps[position], timestamps[position],
+        chunk.device_id, chunk.firmware_version, chunk.sensor_type, ids[position], from_micros(created[position]),
+    )
+
+def _walk(session: Session, chunk: Row, low: Optional[Tuple[int, int]], high: Optional[Tuple[int, int]],
+          pump_active: Optional[bool], descending: bool) -> Iterator[Tuple[int, int, tuple]]:
+    """(created_at, id, row) for a chunk's matching readings with low <= (created_at, id) < high"""
+    columns = _columns(session, chunk.id)
+    if columns is None:
+        return
+    ids, created, pumps = columns[0], columns[1], columns[6]
+    positions = range(len(ids))
+    key = lambda position: (created[position], ids[position])
+    lo = bisect_left(positions, low, key=key) if low else 0
+    hi = bisect_left(positions, high, key=key) if high else len(ids)
+    for position in (range(hi - 1, lo - 1, -1) if descending else range(lo, hi)):
+        if pump_active is not None and pumps[position] != pump_active:
+            continue
+        yield created[position], ids[position], _row(chunk, columns, position)
+
+def _conditions(reading_filter: ReadingFilter) -> list:
+    conditions = []
+    if reading_filter.device_id:
+        conditions.append(ReadingChunk.device_id == reading_filter.device_id)
+    if reading_filter.start:
+        conditions.append(ReadingChunk.last_created_at >= micros(reading_filter.start))
+    if reading_filter.end:
+        conditions.append(ReadingChunk.first_created_at < micros(reading_filter.end))
+    if reading_filter.firmware_version:
+        conditions.append(ReadingChunk.firmware_version == reading_filter.firmware_version)
+    if reading_filter.sensor_type:
+        conditions.append(ReadingChunk.sensor_type == reading_filter.sensor_type)
+    return conditions
+
+def _chunks(session: Session, reading_filter: ReadingFilter, descending: bool = False,
+            before: Optional[Tuple[int, int]] = None) -> Result:
+    """Chunks that can hold readings matching the filter, in segments.merge's bound order"""
+    stmt = select(*CHUNK_COLUMNS).where(*_conditions(reading_filter))
+    if descending:
+        stmt = stmt.order_by(ReadingChunk.last_created_at.desc(), ReadingChunk.last_id.desc())
+    else:
+        stmt = stmt.order_by(ReadingChunk.first_created_at, ReadingChunk.first_id)
+    if before:
+        stmt = stmt.where(ReadingChunk.first_created_at <= before[0])
+    # Through Core, so chunks are only fetched as the merge reaches them
+    return session.connection().execute(stmt)
+
+def read_rows(session: Session, reading_filter: ReadingFilter, descending: bool = False,
+              before: Optional[Tuple[int, int]] = None) -> Iterator[tuple]:
+    """Archived readings matching the filter as row tuples, oldest first or newest first.
+
+    before is a (created_at microseconds, id) key that every row sorts below.
+    Chunks are read and decoded as the rows are consumed, so keep the session
+    open until then.
+    """
+    low = (micros(reading_filter.start), 0) if reading_filter.start else None
+    high = (micros(reading_filter.end), 0) if reading_filter.end else None
+    if before and (high is None or before < high):
+        high = before
+    sources = (
+        (
+            (chunk.last_created_at, chunk.last_id) if descending else (chunk.first_created_at, chunk.first_id),
+            partial(_walk, session, chunk, low, high, reading_filter.pump_active, descending),
+        )
+        for chunk in _chunks(session, reading_filter, descending, before)
+    )
+    return segments.merge(sources, descending)
+
+def newest(session: Session, reading_filter: ReadingFilter = ReadingFilter()) -> Optional[int]:
+    """created_at in microseconds of the newest archived reading the filter may match; None if there is none"""
+    return session.execute(select(func.max(ReadingChunk.last_created_at)).where(*_conditions(reading_filter))).scalar()
+
+def list_page(
+    session: Session,
+    reading_filter: ReadingFilter,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Tuple[List[tuple], Optional[str]]:
+    """One page of readings from the live store and the archive, newest first, with the live store's cursors"""
+    if segments.ENABLED:
+        rows, _ = segments.list_page(session, reading_filter, limit + 1, cursor)
+    else:
+        rows, _ = list_sensor_data_page(session, sensor_data_filters(*reading_filter), limit + 1, cursor)
+    archived = newest(session, reading_filter)
+    # A full page newer than anything archived is the whole answer
+    if archived is not None and (len(rows) <= limit or micros(rows[-1][9]) <= archived):
+        before = None
+        if cursor:
+            created_at, row_id = decode_cursor(cursor)
+            before = (micros(created_at), row_id)
+        older = itertools.islice(read_rows(session, reading_filter, True, before), limit + 1)
+        rows = list(itertools.islice(heapq.merge(rows, older, key=_NEWEST_FIRST, reverse=True), limit + 1))
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][9], rows[-1][8])
+
+def get_reading(session: Session, sensor_id: int) -> Optional[SensorData]:
+    candidates = session.execute(
+        select(*CHUNK_COLUMNS)
+        .where(ReadingChunk.last_id >= sensor_id)
+        .where(ReadingChunk.first_id <= sensor_id)
+    ).all()
+    for chunk in candidates:
+        columns = _columns(session, chunk.id)
+        # Chunks are in created_at order, which ids only roughly follow
+        if columns is not None and sensor_id in columns[0]:
+            row = _row(chunk, columns, columns[0].index(sensor_id))
+            return SensorData.model_construct(**dict(zip(SENSOR_DATA_FIELDS, row)))
+    return None
+
+def rows_after(session: Session, after: int, limit: int) -> List[Dict[str, Any]]:
+    """Up to limit archived readings with an id above after, in id order, as mappings like sensordata rows"""
+    rows = []
+    for chunk in session.execute(select(*CHUNK_COLUMNS).where(ReadingChunk.last_id > after)).all():
+        columns = _columns(session, chunk.id)
+        if columns is not None:
+            rows.extend(_row(chunk, columns, position) for position, row_id in enumerate(columns[0]) if row_id > after)
+    rows.sort(key=itemgetter(8))
+    return [dict(zip(SENSOR_DATA_FIELDS, row)) for row in rows[:limit]]
+
+def max_id(session: Session) -> Optional[int]:
+    return session.execute(select(func.max(ReadingChunk.last_id))).scalar()
+
+# ------------------ Compaction ------------------
+@dataclass
+class CompactReport:
+    readings: int = 0
+    chunks: int = 0
+    chunk_bytes: int = 0
+    more: bool = False
+    duration_s: float = 0.0
+
+def _groups(rows: Sequence[tuple]) -> Iterator[List[tuple]]:
+    """Row tuples sorted by (created_at, id), split into chunks of one device, tag and block"""
+    groups: Dict[tuple, List[tuple]] = {}
+    for row in rows:
+        groups.setdefault((row[5], row[6], row[7], micros(row[9]) // BLOCK_US), []).append(row)
+    for group in groups.values():
+        for start in range(0, len(group), CHUNK_RECORDS):
+            yield group[start:start + CHUNK_RECORDS]
+
+def _encode(rows: List[tuple]) -> Dict[str, Any]:
+    """A reading_chunk row for rows of one chunk"""
+    ids = [row[8] for row in rows]
+    created = [micros(row[9]) for row in rows]
+    temperatures, humidities, luxes, pumps, timestamps = ([row[field] for row in rows] for field in range(5))
+    first = rows[0]
+    return dict(
+        device_id=first[5], firmware_version=first[6], sensor_type=first[7], count=len(rows),
+        first_id=min(ids), last_id=max(ids), first_created_at=created[0], last_created_at=created[-1],
+        data=encode_chunk([ids, created, timestamps, temperatures, humidities, luxes, pumps]),
+    )
+
+def _device(device_id: Optional[str]):
+    return SensorData.device_id.is_(None) if device_id is None else SensorData.device_id == device_id
+
+def _compact_sqlite(session_factory: Callable, read_session_factory: Callable, cutoff: int) -> Optional[List[Dict[str, Any]]]:
+    """Archive the oldest device block's readings from sensordata; [] if they changed meanwhile, None if none are left"""
+    with read_session_factory() as session:
+        oldest = session.execute(
+            select(SensorData.device_id, SensorData.created_at)
+            .where(SensorData.created_at < from_micros(cutoff))
+            .order_by(SensorData.created_at)
+            .limit(1)
+        ).first()
+        if oldest is None:
+            return None
+        block = micros(oldest.created_at) // BLOCK_US * BLOCK_US
+        rows = [tuple(row) for row in session.execute(
+            select(*SENSOR_DATA_COLUMNS)
+            .where(_device(oldest.device_id))
+            .where(SensorData.created_at >= from_micros(block))
+            .where(SensorData.created_at < from_micros(block + BLOCK_US))
+            .order_by(SensorData.created_at, SensorData.id)
+            .limit(BATCH_RECORDS)
+        )]
+    if not rows:
+        return None
+    chunks = [_encode(group) for group in _groups(rows)]
+    ids = [row[8] for row in rows]
+    batches = [ids[start:start + ID_BATCH] for start in range(0, len(ids), ID_BATCH)]
+    with session_factory() as session:
+        current = set()
+        for batch in batches:
+            current.update(tuple(row) for row in session.execute(select(*SENSOR_DATA_COLUMNS).where(SensorData.id.in_(batch))))
+        if current != set(rows):
+            # Edited or deleted since they were read
+            return []
+        for batch in batches:
+            session.execute(delete(SensorData).where(SensorData.id.in_(batch)).execution_options(synchronize_session=False))
+        session.execute(insert(ReadingChunk), chunks)
+        session.commit()
+    return chunks
+
+def _compact_segments(session_factory: Callable, read_session_factory: Callable, cutoff: int) -> Optional[List[Dict[str, Any]]]:
+    """Archive the oldest expired segment; [] if it grew meanwhile, None if none are left"""
+    with read_session_factory() as session:
+        expired = segments.expired_segments(session, from_micros(cutoff), limit=1)
+        if not expired:
+            return None
+        segment = expired[0]
+        rows = segments.segment_rows(session, segment)
+    chunks = [_encode(group) for group in _groups(rows)]
+    with session_factory() as session:
+        deleted = session.execute(
+            delete(ReadingSegment)
+            .where(ReadingSegment.id == segment.id)
+            .where(ReadingSegment.count == segment.count)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not deleted:
+            return []
+        session.execute(insert(ReadingChunk), chunks)
+        session.commit()
+    segments.remove_files([segment.id])
+    return chunks
+
+def compact(session_factory: Callable, read_session_factory: Callable, before: datetime,
+            max_chunks: Optional[int] = None) -> CompactReport:
+    """Move readings older than before into chunks, one committed batch at a time.
+
+    before is rounded down to a whole block, so a block is compacted once all
+    of it is old enough. Stops after max_chunks chunks, with report.more set
+    if readings are left over.
+    """
+    report = CompactReport()
+    started = time.perf_counter()
+    cutoff = micros(before) // BLOCK_US * BLOCK_US
+    step = _compact_segments if segments.ENABLED else _compact_sqlite
+    attempts = 0
+    while True:
+        if max_chunks is not None and report.chunks >= max_chunks:
+            report.more = True
+            break
+        chunks = step(session_factory, read_session_factory, cutoff)
+        if chunks is None:
+            break
+        if not chunks:
+            attempts += 1
+            if attempts >= MAX_ATTEMPTS:
+                report.more = True
+                break
+            continue
+        attempts = 0
+        report.chunks += len(chunks)
+        report.readings += sum(chunk["count"] for chunk in chunks)
+        report.chunk_bytes += sum(len(chunk["data"]) for chunk in chunks)
+    report.duration_s = round(time.perf_counter() - started, 3)
+    if report.readings:
+        logger.info(
+            "Archived %s readings into %s chunks (%s bytes) in %.3fs",
+            report.readings, report.chunks, report.chunk_bytes, report.duration_s,
+        )
+    return report
+
+def drop_expired(session_factory: Callable, before: datetime, device_id: Optional[str] = None,
+                 excluded: Sequence[str] = ()) -> int:
+    """Delete the chunks whose newest reading is older than before; returns readings dropped.
+
+    Limited to one device, or to every device not in excluded.
+    """
+    conditions = [ReadingChunk.last_created_at < micros(before)]
+    if device_id:
+        conditions.append(ReadingChunk.device_id == device_id)
+    elif excluded:
+        conditions.append(or_(ReadingChunk.device_id.is_(None), not_(ReadingChunk.device_id.in_(excluded))))
+    with session_factory() as session:
+        dropped = session.execute(select(func.sum(ReadingChunk.count)).where(*conditions)).scalar()
+        if not dropped:
+            return 0
+        session.execute(delete(ReadingChunk).where(*conditions).execution_options(synchronize_session=False))
+        session.commit()
+    return dropped
@@ -0,0 +1,43 @@
+import logging
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+class PeriodicTask:
+    """Run a function on a daemon thread every interval seconds until stopped.
+
+    If the function returns True it has more work queued up and is called
+    again straight away, so long jobs can run in bounded steps and still
+    notice stop() between them.
+    """
+
+    def __init__(self, name: str, interval: float, func: Callable[[], None]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        # Run once straight away, then on every interval
+        while True:
+            more = False
+            try:
+                more = self.func() is True
+            except Exception:
+                logger.exception("Background task %s failed", self.name)
+            if self._stop.wait(0 if more else self.interval):
+                break
@@ -0,0 +1,111 @@
+"""Compact binary encoding of sensor readings for microcontrollers.
+
+One body carries a header followed by any number of fixed-size records,
+all little-endian (the ESP32's native byte order):
+
+    magic             2 bytes   b"PS"
+    version           uint8     1
+    count             uint16    number of records
+    device_id         uint8 length + UTF-8 bytes
+    firmware_version  uint8 length + UTF-8 bytes (length 0 = not sent)
+    sensor_type       uint8 length + UTF-8 bytes (length 0 = not sent)
+    count x record    13 bytes each:
+        temperature   int16   hundredths of a degree C (-32768 = sensor failed)
+        humidity      uint16  hundredths of a percent (65535 = sensor failed)
+        lux           uint32  hundredths of a lux (4294967295 = sensor failed)
+        pump_active   uint8   0 or 1
+        timestamp     uint32  Unix time in seconds (see the README on duplicates)
+
+Fixed-point values decode to the same decimals the firmware would have put
+in JSON (2550 -> 25.5) with a single division. A single reading from the
+example firmware is 49 bytes against ~170 bytes of JSON, and each further
+reading in the same body costs 13 bytes.
+"""
+import struct
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+MAGIC = b"PS"
+VERSION = 1
+CONTENT_TYPE = "application/octet-stream"
+
+HEADER = struct.Struct("<2sBH")
+RECORD = struct.Struct("<hHIBI")
+SCALE = 100
+
+# Values the firmware sends when a sensor read fails
+NO_TEMPERATURE = -32768
+NO_HUMIDITY = 0xFFFF
+NO_LUX = 0xFFFFFFFF
+
+Record = Tuple[int, int, int, int, int]
+
+def _read_string(body: bytes, offset: int) -> Tuple[Optional[str], int]:
+    if offset >= len(body):
+        raise ValueError("Truncated header")
+    length = body[offset]
+    end = offset + 1 + length
+    if end > len(body):
+        raise ValueError("Truncated header")
+    try:
+        text = body[offset + 1:end].decode()
+    except UnicodeDecodeError:
+        raise ValueError("Header strings must be UTF-8")
+    return text or None, end
+
+def decode_readings(body: bytes) -> Tuple[Dict[str, Optional[str]], List[Record]]:
+    """Split a body into its header fields and raw record tuples; raises ValueError if malformed"""
+    if len(body) < HEADER.size:
+        raise ValueError("Body too short")
+    magic, version, count = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise ValueError("Not a sensor reading body (bad magic)")
+    if version != VERSION:
+        raise ValueError(f"Unsupported encoding version {version}")
+    offset = HEADER.size
+    header = {}
+    for name in ("device_id", "firmware_version", "sensor_type"):
+        header[name], offset = _read_string(body, offset)
+    if len(body) - offset != count * RECORD.size:
+        raise ValueError(f"Expected {count} records of {RECORD.size} bytes after the header")
+    return header, list(RECORD.iter_unpack(memoryview(body)[offset:]))
+
+def is_valid_record(record: Record) -> bool:
+    temperature, humidity, lux, pump_active, _ = record
+    return (
+        temperature != NO_TEMPERATURE and humidity != NO_HUMIDITY and lux != NO_LUX
+        and pump_active in (0, 1)
+    )
+
+def record_row(header: Dict[str, Optional[str]], record: Record, created_at: datetime,
+               device_id: Optional[str] = None) -> Dict[str, Any]:
+    """Same column mapping as ingest.sensor_row, without a pydantic model in between"""
+    temperature, humidity, lux, pump_active, timestamp = record
+    return {
+        "temperature": temperature / SCALE,
+        "humidity": humidity / SCALE,
+        "lux": lux / SCALE,
+        "pump_active": bool(pump_active),
+        "timestamp": timestamp,
+        "device_id": header["device_id"] or device_id,
+        "firmware_version": header["firmware_version"],
+        "sensor_type": header["sensor_type"],
+        "created_at": created_at,
+    }
+
+def encode_readings(readings: Iterable[Dict[str, Any]], device_id: str,
+                    firmware_version: Optional[str] = None, sensor_type: Optional[str] = None) -> bytes:
+    """Encode Arduino-style readings (pumpActive etc.) the way the firmware does"""
+    readings = list(readings)
+    parts = [HEADER.pack(MAGIC, VERSION, len(readings))]
+    for text in (device_id, firmware_version, sensor_type):
+        raw = (text or "").encode()
+        if len(raw) > 255:
+            raise ValueError("Header strings are limited to 255 bytes")
+        parts.append(bytes([len(raw)]) + raw)
+    for reading in readings:
+        parts.append(RECORD.pack(
+            round(reading["temperature"] * SCALE), round(reading["humidity"] * SCALE),
+            round(reading["lux"] * SCALE), 1 if reading["pumpActive"] else 0, reading["timestamp"],
+        ))
+    return b"".join(parts)
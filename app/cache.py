@@ -0,0 +1,63 @@
+"""Bounded in-memory LRU cache whose entries are tied to a version tag.
+
+Each entry is stored with the tag (see versions.py) that was current when
+its value was read or written, and a lookup only hits when that tag is
+still current. A reader that fills the cache takes the tag before it
+queries, so if a write commits in between, the entry it stores is already
+out of date and the next lookup misses instead of serving the old value.
+Writers put their committed value with the tag returned by their bump,
+holding versions.commit_lock() from commit to put so entries follow commit
+order, across worker processes too.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+class LRUCache:
+    def __init__(self, max_size: int):
+        self.max_size = max(0, max_size)
+        self._entries: "OrderedDict[Hashable, Tuple[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, tag: str) -> Optional[Any]:
+        """Cached value for key if it was stored under tag, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != tag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, tag: str, value: Any):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._entries[key] = (tag, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,195 @@
+"""Column encodings for the compressed reading chunks of app/archive.py.
+
+A chunk keeps each field of its readings together, in COLUMNS order, and
+encodes every column for what it holds:
+
+- integers (ids, created_at in microseconds, device timestamps) as deltas of
+  deltas. Devices report at a steady rate, so most of them are zero (one
+  bit) or small. As in Gorilla, a short prefix picks the width of the rest;
+  the widths leave room for the jitter of microsecond receive times, and the
+  last one fits any delta of delta of 64-bit values.
+- floats as the XOR with the previous value, as in Gorilla: a repeated
+  reading takes one bit, a changed one only its bits that differ, reusing
+  the previous leading/trailing zero counts when they fit.
+- booleans as the first value and the lengths of the runs that follow.
+
+Bits are handled as strings of "0" and "1": slicing them and int(bits, 2)
+keep the per-value work in C, which in CPython is much faster than shifting
+one big integer around.
+"""
+import itertools
+import struct
+from typing import List, Sequence
+
+COLUMNS = ("id", "created_at", "timestamp", "temperature", "humidity", "lux", "pump_active")
+
+VERSION = 1
+# Format version, number of readings; then each column as its length and bytes
+_HEADER = struct.Struct("<BI")
+_LENGTH = struct.Struct("<I")
+
+# Delta of delta widths after a 1, 2, 3, 4 or 5 bit prefix ("10", "110", ..., "11111")
+_WIDTHS = (7, 14, 21, 32, 67)
+_BUCKETS = tuple(
+    ("1" * (i + 1) + ("0" if i < len(_WIDTHS) - 1 else ""), 1 << (width - 1), (1 << width) - 1, f"0{width}b")
+    for i, width in enumerate(_WIDTHS)
+)
+
+def _to_bytes(bits: str) -> bytes:
+    if not bits:
+        return b""
+    bits += "0" * (-len(bits) % 8)
+    return int(bits, 2).to_bytes(len(bits) // 8, "big")
+
+def _to_bits(data: bytes) -> str:
+    return format(int.from_bytes(data, "big"), f"0{len(data) * 8}b") if data else ""
+
+def encode_ints(values: Sequence[int]) -> bytes:
+    out = []
+    previous = delta = 0
+    for value in values:
+        dod = value - previous - delta
+        delta = value - previous
+        previous = value
+        if not dod:
+            out.append("0")
+            continue
+        for prefix, limit, mask, fmt in _BUCKETS:
+            if -limit <= dod < limit:
+                out.append(prefix + format(dod & mask, fmt))
+                break
+    return _to_bytes("".join(out))
+
+def decode_ints(data: bytes, count: int) -> List[int]:
+    bits = _to_bits(data)
+    values = []
+    append = values.append
+    position = value = delta = 0
+    for _ in range(count):
+        end = bits.find("0", position, position + len(_WIDTHS))
+        if end == position:
+            position += 1
+        else:
+            if end < 0:
+                width = _WIDTHS[-1]
+                position += len(_WIDTHS)
+            else:
+                width = _WIDTHS[end - position - 1]
+                position = end + 1
+            dod = int(bits[position:position + width], 2)
+            if dod >> (width - 1):
+                dod -= 1 << width
+            delta += dod
+            position += width
+        value += delta
+        append(value)
+    return values
+
+def encode_floats(values: Sequence[float]) -> bytes:
+    words = struct.unpack(f"<{len(values)}Q", struct.pack(f"<{len(values)}d", *values))
+    out = []
+    previous = 0
+    # No window yet, so the first change always describes its own
+    leading = trailing = 64
+    for word in words:
+        xor = word ^ previous
+        previous = word
+        if not xor:
+            out.append("0")
+            continue
+        zeros_before = 64 - xor.bit_length()
+        zeros_after = (xor & -xor).bit_length() - 1
+        if zeros_before >= leading and zeros_after >= trailing:
+            out.append("10" + format(xor >> trailing, f"0{64 - leading - trailing}b"))
+        else:
+            # Five bits for the leading zeros, six for the length (64 stored as 0)
+            leading, trailing = min(zeros_before, 31), zeros_after
+            length = 64 - leading - trailing
+            out.append("11" + format(leading, "05b") + format(length & 63, "06b") + format(xor >> trailing, f"0{length}b"))
+    return _to_bytes("".join(out))
+
+def decode_floats(data: bytes, count: int) -> List[float]:
+    bits = _to_bits(data)
+    words = []
+    append = words.append
+    position = word = leading = trailing = 0
+    for _ in range(count):
+        if bits[position] == "0":
+            position += 1
+        else:
+            if bits[position + 1] == "1":
+                leading = int(bits[position + 2:position + 7], 2)
+                trailing = 64 - leading - (int(bits[position + 7:position + 13], 2) or 64)
+                position += 13
+            else:
+                position += 2
+            length = 64 - leading - trailing
+            word ^= int(bits[position:position + length], 2) << trailing
+            position += length
+        append(word)
+    return list(struct.unpack(f"<{count}d", struct.pack(f"<{count}Q", *words)))
+
+def _put_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+def encode_flags(values: Sequence[bool]) -> bytes:
+    out = bytearray([1 if values and values[0] else 0])
+    for _, run in itertools.groupby(values):
+        _put_varint(out, sum(1 for _ in run))
+    return bytes(out)
+
+def decode_flags(data: bytes, count: int) -> List[bool]:
+    values: List[bool] = []
+    flag = bool(data[0])
+    position = 1
+    while len(values) < count:
+        run = shift = 0
+        while True:
+            byte = data[position]
+            position += 1
+            run |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        values.extend([flag] * run)
+        flag = not flag
+    return values
+
+_ENCODERS = (encode_ints, encode_ints, encode_ints, encode_floats, encode_floats, encode_floats, encode_flags)
+_DECODERS = (decode_ints, decode_ints, decode_ints, decode_floats, decode_floats, decode_floats, decode_flags)
+
+def encode_chunk(columns: Sequence[Sequence]) -> bytes:
+    """Encode equally long columns given in COLUMNS order"""
+    parts = [_HEADER.pack(VERSION, len(columns[0]))]
+    for encode, values in zip(_ENCODERS, columns):
+        encoded = encode(values)
+        parts.append(_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    return b"".join(parts)
+
+def column_sizes(data: bytes) -> List[int]:
+    """Encoded bytes of each column of a chunk, in COLUMNS order"""
+    sizes = []
+    position = _HEADER.size
+    for _ in COLUMNS:
+        (length,) = _LENGTH.unpack_from(data, position)
+        sizes.append(length)
+        position += _LENGTH.size + length
+    return sizes
+
+def decode_chunk(data: bytes) -> List[list]:
+    """The columns of a chunk, in COLUMNS order"""
+    version, count = _HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Unsupported chunk version: {version}")
+    columns = []
+    position = _HEADER.size
+    for decode in _DECODERS:
+        (length,) = _LENGTH.unpack_from(data, position)
+        position += _LENGTH.size
+        columns.append(decode(data[position:position + length], count))
+        position += length
+    return columns
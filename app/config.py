@@ -0,0 +1,91 @@
+import os
+from dataclasses import dataclass
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+def _env_str(name: str, default: str) -> str:
+    return os.environ.get(name) or default
+
+@dataclass
+class Settings:
+    """Runtime settings, read from PI_SENSOR_* environment variables"""
+    # "direct" commits every reading in its own request,
+    # "group" hands readings to the write-behind buffer
+    ingest_mode: str = "direct"
+    flush_size: int = 100
+    flush_interval_ms: int = 50
+    # SQLite storage
+    db_path: str = "./db.sqlite"
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    mmap_size: int = 64 * 1024 * 1024
+    cache_size: int = -8000  # negative values are KiB, positive values are pages
+    busy_timeout_ms: int = 5000
+    read_pool_size: int = 4
+    # Seconds between rollup catch-up runs
+    rollup_interval_s: int = 60
+    # Retention policy, e.g. "sensordata=30d,sensor_rollup_1h=2y"; empty keeps everything
+    retention: str = ""
+    retention_interval_s: int = 3600
+    retention_chunk_size: int = 500
+    # Devices whose watering state is kept in memory; 0 disables the cache
+    watering_cache_size: int = 256
+    # "auto" serves the hot reads through aiosqlite when it is installed; "on" or "off" to force
+    async_db: str = "auto"
+    # Shared state for multi-worker mode (writer socket, version counters); set by serve.py
+    run_dir: str = ""
+    # UDP telemetry listener; port 0 leaves it off
+    udp_host: str = "0.0.0.0"
+    udp_port: int = 0
+    udp_max_queue: int = 10000
+    # Statements slower than this are logged with their query plan; 0 turns the log off
+    slow_query_ms: int = 200
+    # "sqlite" keeps raw readings in the sensordata table, "segments" in append-only files (app/segments.py)
+    reading_store: str = "sqlite"
+    # Directory for the segment files; empty puts them next to the database (<db_path>-segments)
+    segment_dir: str = ""
+    # A device starts a new segment after this many readings or this many seconds
+    segment_records: int = 65536
+    segment_span_s: int = 86400
+    # Readings older than this, e.g. "30d", are compacted into compressed chunks (app/archive.py); empty leaves them
+    archive_age: str = ""
+    archive_interval_s: int = 3600
+    # Time span a chunk may cover
+    archive_block_s: int = 86400
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            ingest_mode=_env_str("PI_SENSOR_INGEST_MODE", cls.ingest_mode),
+            flush_size=_env_int("PI_SENSOR_FLUSH_SIZE", cls.flush_size),
+            flush_interval_ms=_env_int("PI_SENSOR_FLUSH_INTERVAL_MS", cls.flush_interval_ms),
+            db_path=_env_str("PI_SENSOR_DB_PATH", cls.db_path),
+            journal_mode=_env_str("PI_SENSOR_JOURNAL_MODE", cls.journal_mode).upper(),
+            synchronous=_env_str("PI_SENSOR_SYNCHRONOUS", cls.synchronous).upper(),
+            mmap_size=_env_int("PI_SENSOR_MMAP_SIZE", cls.mmap_size),
+            cache_size=_env_int("PI_SENSOR_CACHE_SIZE", cls.cache_size),
+            busy_timeout_ms=_env_int("PI_SENSOR_BUSY_TIMEOUT_MS", cls.busy_timeout_ms),
+            read_pool_size=_env_int("PI_SENSOR_READ_POOL_SIZE", cls.read_pool_size),
+            rollup_interval_s=_env_int("PI_SENSOR_ROLLUP_INTERVAL_S", cls.rollup_interval_s),
+            retention=_env_str("PI_SENSOR_RETENTION", cls.retention),
+            retention_interval_s=_env_int("PI_SENSOR_RETENTION_INTERVAL_S", cls.retention_interval_s),
+            retention_chunk_size=_env_int("PI_SENSOR_RETENTION_CHUNK_SIZE", cls.retention_chunk_size),
+            watering_cache_size=_env_int("PI_SENSOR_WATERING_CACHE_SIZE", cls.watering_cache_size),
+            async_db=_env_str("PI_SENSOR_ASYNC_DB", cls.async_db).lower(),
+            run_dir=_env_str("PI_SENSOR_RUN_DIR", cls.run_dir),
+            udp_host=_env_str("PI_SENSOR_UDP_HOST", cls.udp_host),
+            udp_port=_env_int("PI_SENSOR_UDP_PORT", cls.udp_port),
+            udp_max_queue=_env_int("PI_SENSOR_UDP_MAX_QUEUE", cls.udp_max_queue),
+            slow_query_ms=_env_int("PI_SENSOR_SLOW_QUERY_MS", cls.slow_query_ms),
+            reading_store=_env_str("PI_SENSOR_READING_STORE", cls.reading_store).lower(),
+            segment_dir=_env_str("PI_SENSOR_SEGMENT_DIR", cls.segment_dir),
+            segment_records=_env_int("PI_SENSOR_SEGMENT_RECORDS", cls.segment_records),
+            segment_span_s=_env_int("PI_SENSOR_SEGMENT_SPAN_S", cls.segment_span_s),
+            archive_age=_env_str("PI_SENSOR_ARCHIVE_AGE", cls.archive_age),
+            archive_interval_s=_env_int("PI_SENSOR_ARCHIVE_INTERVAL_S", cls.archive_interval_s),
+            archive_block_s=_env_int("PI_SENSOR_ARCHIVE_BLOCK_S", cls.archive_block_s),
+        )
+
+settings = Settings.from_env()
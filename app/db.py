@@ -1,13 +1,135 @@
+import fcntl
+import os
+import threading
 from contextlib import contextmanager
-from sqlmodel import SQLModel, create_engine, Session
+from sqlalchemy import event
+from sqlmodel import create_engine, Session
+from .config import settings
+from .migrations import migrate
+from .querystats import connection_factory
 
-DATABASE_URL = "sqlite:///./db.sqlite"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}, echo=False)
+JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+if settings.journal_mode not in JOURNAL_MODES:
+    raise ValueError(f"Unsupported PI_SENSOR_JOURNAL_MODE: {settings.journal_mode}")
+if settings.synchronous not in SYNCHRONOUS_MODES:
+    raise ValueError(f"Unsupported PI_SENSOR_SYNCHRONOUS: {settings.synchronous}")
+
+DATABASE_PATH = os.path.abspath(settings.db_path)
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+READ_ONLY_URL = f"sqlite:///file:{DATABASE_PATH}?mode=ro&uri=true"
+
+# Every statement is timed and counted by the connection class (see querystats.py)
+WRITE_CONNECT_ARGS = {"check_same_thread": False, "factory": connection_factory("write")}
+READ_CONNECT_ARGS = {"check_same_thread": False, "factory": connection_factory("read")}
+
+# All writes go through one connection so requests queue on the pool
+# instead of fighting over SQLite's lock
+engine = create_engine(
+    DATABASE_URL,
+    connect_args=WRITE_CONNECT_ARGS,
+    pool_size=1,
+    max_overflow=0,
+    echo=False,
+)
+
+# Read-only connections for the GET handlers; under WAL they never block on the writer
+read_engine = create_engine(
+    READ_ONLY_URL,
+    connect_args=READ_CONNECT_ARGS,
+    pool_size=settings.read_pool_size,
+    max_overflow=0,
+    echo=False,
+)
+
+def _apply_pragmas(dbapi_connection):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {int(settings.busy_timeout_ms)}")
+    cursor.execute(f"PRAGMA cache_size = {int(settings.cache_size)}")
+    cursor.execute(f"PRAGMA mmap_size = {int(settings.mmap_size)}")
+    cursor.close()
+
+@event.listens_for(engine, "connect")
+def _on_writer_connect(dbapi_connection, connection_record):
+    # Let SQLAlchemy emit BEGIN itself (see _on_writer_begin)
+    dbapi_connection.isolation_level = None
+    _apply_pragmas(dbapi_connection)
+    cursor = dbapi_connection.cursor()
+    # Only takes effect on a brand-new file, and only before journal_mode is set.
+    # Lets the retention job hand freed pages back with incremental_vacuum.
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cursor.execute(f"PRAGMA journal_mode = {settings.journal_mode}")
+    cursor.execute(f"PRAGMA synchronous = {settings.synchronous}")
+    cursor.close()
+
+@event.listens_for(engine, "begin")
+def _on_writer_begin(conn):
+    # Take the write lock up front so busy_timeout applies, rather than failing
+    # with SQLITE_BUSY when a read transaction is upgraded mid-way
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+@event.listens_for(read_engine, "connect")
+def _on_reader_connect(dbapi_connection, connection_record):
+    _apply_pragmas(dbapi_connection)
 
 def init_db():
-    SQLModel.metadata.create_all(engine)
+    migrate(engine)
+
+def close_db():
+    # Closing the last connection checkpoints the WAL back into db.sqlite
+    read_engine.dispose()
+    engine.dispose()
+
+# With several processes (PI_SENSOR_RUN_DIR, see serve.py) write sessions take
+# turns through a file lock, the cross-process version of the single-connection
+# pool above. Waiters sleep in the kernel instead of polling through
+# busy_timeout, so a burst of writes can't starve one into "database is locked".
+_write_lock = threading.Lock()
+_write_lock_fd = None
+if settings.run_dir:
+    _write_lock_fd = os.open(os.path.join(settings.run_dir, "write.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+
+class _WriteTurn:
+    """Holds the write lock from a session's first transaction until it closes.
+
+    Taken lazily so a request only waits once its handler touches the
+    database, and held across commits so it always comes before
+    versions.commit_lock() and the two can't deadlock.
+    """
+
+    def __init__(self):
+        self.held = False
+
+    def take(self, session, transaction):
+        if self.held:
+            return
+        # The thread lock comes first: record locks don't exclude threads of the same process
+        _write_lock.acquire()
+        fcntl.lockf(_write_lock_fd, fcntl.LOCK_EX)
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            fcntl.lockf(_write_lock_fd, fcntl.LOCK_UN)
+            _write_lock.release()
 
 @contextmanager
 def get_session():
-    with Session(engine) as session:
+    if _write_lock_fd is None:
+        with Session(engine) as session:
+            yield session
+        return
+    turn = _WriteTurn()
+    try:
+        with Session(engine) as session:
+            event.listen(session, "after_transaction_create", turn.take)
+            yield session
+    finally:
+        turn.release()
+
+@contextmanager
+def get_read_session():
+    with Session(read_engine) as session:
         yield session
@@ -0,0 +1,73 @@
+"""Async database access for the hot request handlers.
+
+When aiosqlite is installed (pip install aiosqlite), run_read executes a
+plain sync function -- the same query helpers the rest of the app uses --
+on an AsyncSession through run_sync. The SQL and pragmas are identical to
+the read-only engine in db.py, but the request waits on the event loop
+instead of holding one of the thread pool's workers. Without aiosqlite, or
+with PI_SENSOR_ASYNC_DB=off, it runs the function on a sync session in the
+thread pool, which is what a plain `def` handler does.
+
+run_write always uses the thread pool and the single-writer engine of
+db.py: a second writer connection would make the two take turns on
+SQLite's lock through busy_timeout instead of queueing on the pool.
+"""
+from typing import Any, Callable, TypeVar
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+from .config import settings
+from .db import DATABASE_PATH, READ_CONNECT_ARGS, _on_reader_connect, get_read_session, get_session
+
+try:
+    import aiosqlite  # noqa: F401
+except ImportError:
+    aiosqlite = None
+
+ASYNC_MODES = {"auto", "on", "off"}
+if settings.async_db not in ASYNC_MODES:
+    raise ValueError(f"Unsupported PI_SENSOR_ASYNC_DB: {settings.async_db}")
+if settings.async_db == "on" and aiosqlite is None:
+    raise RuntimeError("PI_SENSOR_ASYNC_DB=on needs aiosqlite: pip install aiosqlite")
+
+ASYNC_DB = aiosqlite is not None and settings.async_db != "off"
+
+T = TypeVar("T")
+
+async_read_engine = None
+if ASYNC_DB:
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    # Read-only, like read_engine; under WAL it never blocks on the writer
+    async_read_engine = create_async_engine(
+        f"sqlite+aiosqlite:///file:{DATABASE_PATH}?mode=ro&uri=true",
+        connect_args=READ_CONNECT_ARGS,
+        pool_size=settings.read_pool_size,
+        max_overflow=0,
+    )
+    event.listen(async_read_engine.sync_engine, "connect", _on_reader_connect)
+
+def _read_in_thread(func: Callable[..., T], *args: Any) -> T:
+    with get_read_session() as session:
+        return func(session, *args)
+
+def _write_in_thread(func: Callable[..., T], *args: Any) -> T:
+    with get_session() as session:
+        result = func(session, *args)
+        session.commit()
+        return result
+
+async def run_read(func: Callable[..., T], *args: Any) -> T:
+    """Call func(session, *args) on a read-only session"""
+    if not ASYNC_DB:
+        return await run_in_threadpool(_read_in_thread, func, *args)
+    async with AsyncSession(async_read_engine) as session:
+        return await session.run_sync(func, *args)
+
+async def run_write(func: Callable[..., T], *args: Any) -> T:
+    """Call func(session, *args) on the writer in the thread pool and commit"""
+    return await run_in_threadpool(_write_in_thread, func, *args)
+
+async def close_async_db():
+    if ASYNC_DB:
+        await async_read_engine.dispose()
@@ -0,0 +1,101 @@
+"""One-off cleanup for databases that stored duplicate readings.
+
+Before the unique (device_id, timestamp) key, a device that resent a reading
+after a lost response got it stored twice, and migration 6 can't add the key
+while such copies exist. dedup() finds them with one read-only GROUP BY,
+deletes every copy but the first stored one (lowest id) in committed chunks
+of chunk_size readings, and then creates the index. Readings keep arriving
+meanwhile, so if a new duplicate slipped in, creating the index fails and
+the cleanup runs again.
+
+Rollups describe what was ingested and still count the deleted copies until
+they are rebuilt (manage.py rebuild-rollups).
+"""
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Tuple
+from sqlalchemy import delete, func, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from .ingest import DEDUP_INDEX, refresh_device_latest
+from .models import SensorData
+from .versions import versions
+
+logger = logging.getLogger(__name__)
+
+# Cleanup passes before giving up on creating the index
+MAX_ATTEMPTS = 3
+
+@dataclass
+class DedupReport:
+    duplicate_readings: int = 0
+    rows_deleted: int = 0
+    index_created: bool = False
+    duration_s: float = 0.0
+
+def index_exists(session_factory: Callable) -> bool:
+    with session_factory() as session:
+        indexes = session.connection().exec_driver_sql("PRAGMA index_list(sensordata)").all()
+    return any(index[1] == DEDUP_INDEX for index in indexes)
+
+def find_duplicates(read_session_factory: Callable) -> List[Tuple[str, int, int]]:
+    """(device_id, timestamp, id to keep) for every reading stored more than once"""
+    with read_session_factory() as session:
+        return session.execute(
+            select(SensorData.device_id, SensorData.timestamp, func.min(SensorData.id))
+            .where(SensorData.device_id.is_not(None))
+            .group_by(SensorData.device_id, SensorData.timestamp)
+            .having(func.count() > 1)
+        ).all()
+
+def delete_duplicates(session_factory: Callable, duplicates: List[Tuple[str, int, int]], chunk_size: int) -> int:
+    """Delete all but the kept copy of each reading, one committed chunk at a time; returns rows deleted"""
+    deleted = 0
+    for start in range(0, len(duplicates), chunk_size):
+        chunk = duplicates[start:start + chunk_size]
+        devices = {device_id for device_id, _, _ in chunk}
+        with session_factory() as session:
+            deleted += session.execute(
+                delete(SensorData)
+                .where(tuple_(SensorData.device_id, SensorData.timestamp).in_([(d, t) for d, t, _ in chunk]))
+                .where(SensorData.id.not_in([keep for _, _, keep in chunk]))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            # device_latest may have pointed at a deleted copy
+            for device_id in devices:
+                refresh_device_latest(session, device_id)
+            session.commit()
+        for device_id in devices:
+            versions.bump("sensordata", device_id)
+    return deleted
+
+def create_index(session_factory: Callable) -> bool:
+    """Add the unique key; False if duplicates are still present"""
+    try:
+        with session_factory() as session:
+            session.connection().exec_driver_sql(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {DEDUP_INDEX} ON sensordata (device_id, timestamp)"
+            )
+            session.commit()
+    except IntegrityError:
+        return False
+    return True
+
+def dedup(session_factory: Callable, read_session_factory: Callable, chunk_size: int = 500) -> DedupReport:
+    report = DedupReport()
+    started = time.perf_counter()
+    chunk_size = max(1, chunk_size)
+    for _ in range(MAX_ATTEMPTS):
+        duplicates = find_duplicates(read_session_factory)
+        report.duplicate_readings += len(duplicates)
+        report.rows_deleted += delete_duplicates(session_factory, duplicates, chunk_size)
+        if create_index(session_factory):
+            report.index_created = True
+            break
+    report.duration_s = round(time.perf_counter() - started, 3)
+    logger.info(
+        "Dedup removed %s copies of %s readings in %.3fs; unique key %s",
+        report.rows_deleted, report.duplicate_readings, report.duration_s,
+        "created" if report.index_created else "still missing",
+    )
+    return report
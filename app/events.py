@@ -0,0 +1,98 @@
+"""In-process broadcast of data changes to Server-Sent Events subscribers.
+
+Write handlers call publish() after their transaction commits. They run in
+worker threads, so messages are handed to each subscriber's event loop with
+call_soon_threadsafe. A message is encoded once and shared by every
+subscriber, and publish() returns straight away when nobody is listening.
+A subscriber that falls too far behind has its backlog dropped and gets a
+single "resync" event asking it to reload instead.
+"""
+import asyncio
+import json
+import threading
+from typing import Any, AsyncIterator, Dict, Optional
+
+HEARTBEAT_SECONDS = 15.0
+SUBSCRIBER_QUEUE_SIZE = 100
+
+def format_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+RESYNC = format_event("resync", {})
+
+class EventBroker:
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue:
+        """Register a queue on the running event loop"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def publish(self, event: str, data: Any):
+        """Send an event to every subscriber; safe to call from any thread"""
+        if not self._subscribers:
+            return
+        self._broadcast(format_event(event, data))
+
+    def close(self):
+        """End every open stream"""
+        self._broadcast(None)
+
+    def _broadcast(self, message: Optional[str]):
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        if message is not None:
+            self.published += 1
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._offer, queue, message)
+            except RuntimeError:
+                # Loop already closed; the subscriber is gone
+                self.unsubscribe(queue)
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, message: Optional[str]):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Slow client: drop what it hasn't read and tell it to reload
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None if message is None else RESYNC)
+
+    async def stream(self) -> AsyncIterator[str]:
+        """SSE body for one client; ends on close() or when the client disconnects"""
+        queue = self.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from timing out an idle stream
+                    message = ": keep-alive\n\n"
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(queue)
+
+broker = EventBroker()
@@ -0,0 +1,94 @@
+"""Streaming export of sensor readings as NDJSON or CSV.
+
+Rows are read from a read-only connection in fixed-size chunks and encoded
+chunk by chunk, so memory use stays flat however many rows are exported.
+The connection is held for the life of the stream and released when the
+client finishes or disconnects. In segment mode the rows come from the
+segment files (app/segments.py) and the connection is only used up front.
+Archived readings (app/archive.py) are merged in by (created_at, id) from a
+connection of their own.
+"""
+import csv
+import heapq
+import io
+import itertools
+import json
+from operator import itemgetter
+from typing import Iterator, List
+from sqlalchemy import select
+from .db import get_read_session, read_engine
+from .models import SensorData
+from .queries import SENSOR_DATA_FIELDS, ReadingFilter, sensor_data_filters
+from . import archive, segments
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+EXPORT_CHUNK_SIZE = 1000
+
+COLUMNS = [
+    SensorData.id, SensorData.created_at, SensorData.device_id,
+    SensorData.temperature, SensorData.humidity, SensorData.lux, SensorData.pump_active,
+    SensorData.timestamp, SensorData.firmware_version, SensorData.sensor_type,
+]
+FIELD_NAMES = [column.key for column in COLUMNS]
+# Segment rows come in model field order
+_EXPORT_ORDER = itemgetter(*[SENSOR_DATA_FIELDS.index(name) for name in FIELD_NAMES])
+
+def iter_sensor_rows(filters: list, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[tuple]]:
+    """Yield lists of row tuples, oldest first"""
+    stmt = select(*COLUMNS).where(*filters).order_by(SensorData.created_at, SensorData.id)
+    with read_engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(stmt)
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+def iter_segment_rows(reading_filter: ReadingFilter, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[tuple]]:
+    for rows in segments.iter_rows(reading_filter, chunk_size):
+        yield [_EXPORT_ORDER(row) for row in rows]
+
+def iter_archived_rows(reading_filter: ReadingFilter) -> Iterator[tuple]:
+    """Archived row tuples, oldest first, in export column order"""
+    with get_read_session() as session:
+        for row in archive.read_rows(session, reading_filter):
+            yield _EXPORT_ORDER(row)
+
+def _ndjson(rows: List[tuple]) -> bytes:
+    lines = []
+    for row in rows:
+        record = dict(zip(FIELD_NAMES, row))
+        record["created_at"] = record["created_at"].isoformat()
+        lines.append(json.dumps(record, separators=(",", ":")))
+    return ("\n".join(lines) + "\n").encode()
+
+def _csv(rows: List[tuple]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row[:1] + (row[1].isoformat(),) + tuple(row[2:]))
+    return buffer.getvalue().encode()
+
+def export_sensor_data(reading_filter: ReadingFilter, fmt: str, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    if fmt == "csv":
+        header = io.StringIO()
+        csv.writer(header).writerow(FIELD_NAMES)
+        yield header.getvalue().encode()
+    encode = _csv if fmt == "csv" else _ndjson
+    if segments.ENABLED:
+        chunks = iter_segment_rows(reading_filter, chunk_size)
+    else:
+        chunks = iter_sensor_rows(sensor_data_filters(*reading_filter), chunk_size)
+    with get_read_session() as session:
+        archived = archive.newest(session, reading_filter) is not None
+    if archived:
+        merged = heapq.merge(
+            itertools.chain.from_iterable(chunks), iter_archived_rows(reading_filter), key=itemgetter(1, 0),
+        )
+        chunks = iter(lambda: list(itertools.islice(merged, chunk_size)), [])
+    for rows in chunks:
+        yield encode(rows)
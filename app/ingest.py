@@ -0,0 +1,187 @@
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Tuple
+from sqlalchemy import insert, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select
+from .models import ArduinoSensorData, DeviceLatest, SensorData
+from . import rollups, segments
+from .versions import versions
+
+# Upper bound on readings accepted in one batch request
+MAX_BATCH_SIZE = 1000
+
+LATEST_COLUMNS = (
+    "temperature", "humidity", "lux", "pump_active", "timestamp",
+    "firmware_version", "sensor_type", "created_at",
+)
+
+def sensor_row(payload: ArduinoSensorData, device_id: Optional[str] = None) -> Dict[str, Any]:
+    """Convert Arduino field names to a SensorData column mapping"""
+    return {
+        "temperature": payload.temperature,
+        "humidity": payload.humidity,
+        "lux": payload.lux,
+        "pump_active": payload.pumpActive,
+        "timestamp": payload.timestamp,
+        "device_id": payload.device_id or device_id,
+        "firmware_version": payload.firmware_version,
+        "sensor_type": payload.sensor_type,
+        "created_at": datetime.utcnow(),
+    }
+
+# Unique (device_id, timestamp) key; a reading sent again after a lost response is stored once
+DEDUP_INDEX = "ux_sensordata_device_id_timestamp"
+# How often to look for the index again while it is missing (see manage.py dedup)
+DEDUP_INDEX_RECHECK_S = 60
+
+class InsertResult(NamedTuple):
+    # One per input row; a duplicate gets the id of the reading already stored
+    ids: List[int]
+    # Positions of the rows that were duplicates
+    duplicates: List[int]
+
+    def part(self, start: int, end: int) -> "InsertResult":
+        """The result for rows[start:end]"""
+        return InsertResult(self.ids[start:end], [i - start for i in self.duplicates if start <= i < end])
+
+_dedup_index_present = False
+_dedup_index_checked_at: Optional[float] = None
+
+def has_dedup_index(session: Session) -> bool:
+    """Whether the unique key exists; databases with old duplicates lack it until they are cleaned up"""
+    global _dedup_index_present, _dedup_index_checked_at
+    if _dedup_index_present:
+        return True
+    if _dedup_index_checked_at is not None and time.monotonic() - _dedup_index_checked_at < DEDUP_INDEX_RECHECK_S:
+        return False
+    indexes = session.connection().exec_driver_sql("PRAGMA index_list(sensordata)").all()
+    _dedup_index_present = any(index[1] == DEDUP_INDEX for index in indexes)
+    _dedup_index_checked_at = time.monotonic()
+    return _dedup_index_present
+
+def insert_sensor_rows(session: Session, rows: List[Dict[str, Any]]) -> InsertResult:
+    """Insert rows with a single multi-row INSERT and return their ids in order.
+
+    Readings whose (device_id, timestamp) is already stored, or repeated in
+    rows, are skipped and reported as duplicates. With
+    PI_SENSOR_READING_STORE=segments the rows are appended to segment files
+    instead (app/segments.py). Derived tables are updated for the new rows
+    in the same transaction. The caller owns the transaction; nothing is
+    committed here.
+    """
+    if not rows:
+        return InsertResult([], [])
+    if segments.ENABLED:
+        result = InsertResult(*segments.append_rows(session, rows))
+    elif has_dedup_index(session):
+        result = _insert_new_rows(session, rows)
+    else:
+        stmt = insert(SensorData).returning(SensorData.id)
+        result = InsertResult(sorted(int(sensor_id) for sensor_id in session.execute(stmt, rows).scalars()), [])
+    added, added_ids = inserted_rows(rows, result)
+    upsert_device_latest(session, added, added_ids)
+    rollups.apply_rows(session, added, added_ids)
+    return result
+
+def _insert_new_rows(session: Session, rows: List[Dict[str, Any]]) -> InsertResult:
+    # Asking SQLAlchemy for parameter ordering makes it fall back to one INSERT per
+    # row on SQLite. Rowids are handed out in VALUES order under the write lock,
+    # so each key's ids, sorted, line up with the rows that were inserted.
+    stmt = sqlite_insert(SensorData).on_conflict_do_nothing(
+        index_elements=[SensorData.device_id, SensorData.timestamp],
+    ).returning(SensorData.id, SensorData.device_id, SensorData.timestamp)
+    inserted: Dict[Tuple[Optional[str], int], Deque[int]] = defaultdict(deque)
+    # RETURNING hands integers back as floats here, hence the casts
+    for sensor_id, device_id, timestamp in sorted(session.execute(stmt, rows).all()):
+        inserted[(device_id, int(timestamp))].append(int(sensor_id))
+    ids = []
+    duplicates = []
+    for position, row in enumerate(rows):
+        pending = inserted.get((row["device_id"], row["timestamp"]))
+        if pending:
+            ids.append(pending.popleft())
+        else:
+            ids.append(None)
+            duplicates.append(position)
+    if duplicates:
+        keys = list({(rows[i]["device_id"], rows[i]["timestamp"]) for i in duplicates})
+        stored = {
+            (device_id, timestamp): sensor_id
+            for sensor_id, device_id, timestamp in session.execute(
+                select(SensorData.id, SensorData.device_id, SensorData.timestamp)
+                .where(tuple_(SensorData.device_id, SensorData.timestamp).in_(keys))
+            )
+        }
+        for i in duplicates:
+            ids[i] = stored[(rows[i]["device_id"], rows[i]["timestamp"])]
+    return InsertResult(ids, duplicates)
+
+def inserted_rows(rows: List[Dict[str, Any]], result: InsertResult) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """The rows that were actually inserted, and their ids"""
+    if not result.duplicates:
+        return rows, result.ids
+    skipped = set(result.duplicates)
+    kept = [i for i in range(len(rows)) if i not in skipped]
+    return [rows[i] for i in kept], [result.ids[i] for i in kept]
+
+def upsert_device_latest(session: Session, rows: List[Dict[str, Any]], ids: List[int]):
+    """Record the newest of the given rows for each device in device_latest"""
+    newest: Dict[str, Dict[str, Any]] = {}
+    for row, sensor_id in zip(rows, ids):
+        device_id = row["device_id"]
+        if device_id is None:
+            continue
+        current = newest.get(device_id)
+        if current is None or row["created_at"] >= current["created_at"]:
+            newest[device_id] = dict(
+                {column: row[column] for column in LATEST_COLUMNS},
+                device_id=device_id,
+                sensor_data_id=sensor_id,
+            )
+    if not newest:
+        return
+
+    stmt = sqlite_insert(DeviceLatest)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DeviceLatest.device_id],
+        set_={column: stmt.excluded[column] for column in LATEST_COLUMNS + ("sensor_data_id",)},
+        # Replayed readings from a buffer must not replace a newer one
+        where=stmt.excluded.created_at >= DeviceLatest.created_at,
+    )
+    session.execute(stmt, list(newest.values()))
+
+def mark_sensor_rows_committed(rows: List[Dict[str, Any]]):
+    """Bump the sensordata versions for every device in a committed insert"""
+    for device_id in {row["device_id"] for row in rows}:
+        versions.bump("sensordata", device_id)
+
+def refresh_device_latest(session: Session, device_id: Optional[str]):
+    """Recompute a device's entry after one of its readings was edited or deleted"""
+    if device_id is None:
+        return
+    latest = session.exec(
+        select(SensorData)
+        .where(SensorData.device_id == device_id)
+        .order_by(SensorData.created_at.desc(), SensorData.id.desc())
+        .limit(1)
+    ).first()
+    entry = session.get(DeviceLatest, device_id)
+    if latest is None:
+        if entry:
+            session.delete(entry)
+        return
+    if entry is None:
+        entry = DeviceLatest(device_id=device_id, sensor_data_id=latest.id, **{c: getattr(latest, c) for c in LATEST_COLUMNS})
+    else:
+        entry.sensor_data_id = latest.id
+        for column in LATEST_COLUMNS:
+            setattr(entry, column, getattr(latest, column))
+    session.add(entry)
+
+def validation_message(exc) -> str:
+    """Flatten a pydantic ValidationError into a single line"""
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in exc.errors()
+    )
@@ -1,20 +1,132 @@
-from fastapi import FastAPI, HTTPException, Depends, Request
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Body, Depends, Query, Request, Response
+from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from typing import List, Optional
-from sqlmodel import select
-from .models import SensorData, SensorDataCreate, SensorDataUpdate, ArduinoSensorData, WateringData, WateringDataUpdate, WateringHistory, WateringHistoryCreate, WateringHistoryUpdate
-from .db import init_db, get_session
-from datetime import datetime
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+from typing import Any, Dict, List, Optional
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import func, select
+from .models import SensorData, DeviceLatest, SensorAggregate, SensorDataCreate, SensorDataUpdate, SensorDataBatchItem, SensorDataBatchResult, ArduinoSensorData, WateringData, WateringDataUpdate, WateringHistory, WateringHistoryCreate, WateringHistoryUpdate
+from .db import DATABASE_PATH, init_db, close_db, get_session, get_read_session
+from .db_async import close_async_db, run_read, run_write
+from .ingest import MAX_BATCH_SIZE, InsertResult, sensor_row, inserted_rows, insert_sensor_rows, mark_sensor_rows_committed, refresh_device_latest, validation_message
+from .config import settings
+from .writebehind import GroupCommitWriter
+from .udp import UDPListener
+from .writer_service import WriterClient, WriterUnavailable, socket_path
+from .aggregates import BUCKETS, MAX_BUCKETS, aggregate_sensor_data, align_range, bucket_count
+from .background import PeriodicTask
+from . import rollups
+from .retention import RetentionEngine, parse_duration, parse_policy
+from .timeutil import as_utc
+from .export import FORMATS, export_sensor_data
+from .events import broker
+from . import binary
+from .versions import etag_matches, versions
+from .cache import LRUCache
+from . import metrics
+from . import watering
+from . import querystats
+from . import segments
+from . import archive
+from .queries import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, SENSOR_DATA_FIELDS, WATERING_HISTORY_FIELDS, ReadingFilter, list_watering_history_page
+from .serialize import rows_response
+from datetime import datetime, timedelta
+import asyncio
 import os
 
 app = FastAPI(title="Pi Sensor Data Backend", version="1.0.0")
 
+# Request latency per route (see /metrics); statement and commit timings come from the connections
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Worker of a multi-process deployment (serve.py): sensor readings are committed by the writer process,
+# which also runs migrations, rollups, retention, archive compaction and the UDP listener
+writer_client = None
+if settings.run_dir:
+    writer_client = WriterClient(socket_path(settings.run_dir), broker.publish)
+
+# Optional write-behind buffer for single-reading ingest (PI_SENSOR_INGEST_MODE=group)
+ingest_writer = None
+if settings.ingest_mode == "group" and not writer_client:
+    ingest_writer = GroupCommitWriter(get_session, settings.flush_size, settings.flush_interval_ms)
+
+# Optional UDP telemetry listener (PI_SENSOR_UDP_PORT); shares the write-behind buffer when there is one
+udp_listener = None
+if settings.udp_port and not writer_client:
+    udp_writer = ingest_writer or GroupCommitWriter(get_session, settings.flush_size, settings.flush_interval_ms)
+    udp_listener = UDPListener(udp_writer, settings.udp_host, settings.udp_port, settings.udp_max_queue)
+
+# Rolls up readings the ingest path couldn't, e.g. ones stored before the rollup tables existed
+rollup_task = PeriodicTask(
+    "sensor-rollup-catch-up",
+    settings.rollup_interval_s,
+    lambda: rollups.catch_up(get_session, max_chunks=1),
+)
+
+# Deletes expired rows in small chunks when PI_SENSOR_RETENTION is set
+retention_engine = RetentionEngine(get_session, parse_policy(settings.retention), settings.retention_chunk_size)
+retention_task = PeriodicTask("retention", settings.retention_interval_s, retention_engine.run)
+
+# Compacts readings older than PI_SENSOR_ARCHIVE_AGE into compressed chunks when it is set
+archive_age = parse_duration(settings.archive_age) if settings.archive_age else None
+archive_task = PeriodicTask(
+    "archive",
+    settings.archive_interval_s,
+    lambda: archive.compact(get_session, get_read_session, datetime.utcnow() - archive_age, archive.CHUNKS_PER_RUN).more,
+)
+
+# Watering state per device, polled by every dashboard tab and every ESP32
+watering_cache = LRUCache(settings.watering_cache_size)
+
 # Create DB tables at startup
 @app.on_event("startup")
 def on_startup():
+    if writer_client:
+        return
     init_db()
+    if segments.ENABLED:
+        segments.warn_unmoved(get_read_session)
+    if ingest_writer:
+        ingest_writer.start()
+    if udp_listener and udp_listener.writer is not ingest_writer:
+        udp_listener.writer.start()
+    rollup_task.start()
+    if retention_engine.rules:
+        retention_task.start()
+    if archive_age:
+        archive_task.start()
+
+@app.on_event("startup")
+async def start_udp_listener():
+    # The datagram endpoint has to be created on the server's event loop
+    if udp_listener:
+        await udp_listener.start()
+    if writer_client:
+        await writer_client.start()
+
+# Commit everything still buffered before the process exits
+@app.on_event("shutdown")
+def on_shutdown():
+    if udp_listener:
+        udp_listener.stop()
+        if udp_listener.writer is not ingest_writer:
+            udp_listener.writer.stop()
+    broker.close()
+    archive_task.stop()
+    retention_task.stop()
+    rollup_task.stop()
+    if ingest_writer:
+        ingest_writer.stop()
+    close_db()
+
+@app.on_event("shutdown")
+async def close_async_engines():
+    if writer_client:
+        await writer_client.stop()
+    await close_async_db()
 
 # Static + templates for the tiny frontend
 static_dir = os.path.join(os.path.dirname(__file__), "static")
@@ -31,152 +143,460 @@ def index(request: Request):
 def health():
     return {"status": "ok"}
 
+@app.get("/api/v1/stream")
+async def stream_events():
+    # Server-Sent Events: sensor_data and watering events as they are committed
+    return StreamingResponse(
+        broker.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/v1/cache/stats")
+def cache_stats():
+    return {"watering": watering_cache.stats()}
+
+@app.get("/api/v1/maintenance/retention")
+async def retention_stats():
+    if writer_client:
+        return (await writer_stats())["retention"]
+    return retention_engine.stats()
+
+@app.get("/api/v1/ingest/stats")
+async def ingest_stats():
+    if writer_client:
+        stats = await writer_stats()
+        stats.pop("retention", None)
+        return {"mode": "writer", **stats}
+    stats = {"mode": "group" if ingest_writer else "direct"}
+    if ingest_writer:
+        stats.update(ingest_writer.stats())
+    if udp_listener:
+        stats["udp"] = udp_listener.stats()
+        if udp_listener.writer is not ingest_writer:
+            stats["udp"]["writer"] = udp_listener.writer.stats()
+    return stats
+
+async def writer_stats() -> Dict[str, Any]:
+    try:
+        return await writer_client.stats()
+    except WriterUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
 from sqlmodel import Session
 
 def session_dep():
     with get_session() as s:
         yield s
 
+def read_session_dep():
+    with get_read_session() as s:
+        yield s
+
+# ------------------ Metrics ------------------
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint(session: Session = Depends(read_session_dep)):
+    # Prometheus scrape target; sizes and device counts are read now, the rest is kept as requests run
+    def gauges():
+        yield from metrics.render_gauge(
+            "pi_sensor_http_requests_in_flight", "Requests being handled",
+            [({}, metrics.requests_in_flight.value)],
+        )
+        yield from metrics.render_gauge(
+            "pi_sensor_http_streams_open", "Open event streams (/api/v1/stream), not counted as requests",
+            [({}, metrics.streams_open.value)],
+        )
+        yield from metrics.render_gauge(
+            "pi_sensor_db_file_bytes", "Size of the SQLite database and its write-ahead log",
+            [({"file": name}, file_size(DATABASE_PATH + suffix)) for name, suffix in (("db", ""), ("wal", "-wal"))],
+        )
+        devices = session.exec(select(func.count()).select_from(DeviceLatest)).one()
+        watering = session.exec(select(func.count()).select_from(WateringData)).one()
+        yield from metrics.render_gauge(
+            "pi_sensor_devices", "Devices that have sent readings, and devices with watering state",
+            [({"kind": "sensor"}, devices), ({"kind": "watering"}, watering)],
+        )
+        if ingest_writer:
+            yield from metrics.render_gauge(
+                "pi_sensor_ingest_queue_depth", "Readings waiting for a group commit",
+                [({}, ingest_writer.queue_depth)],
+            )
+    return PlainTextResponse(metrics.render(gauges), media_type=metrics.CONTENT_TYPE)
+
+def file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+@app.get("/api/v1/debug/queries")
+async def debug_queries(limit: int = Query(20, ge=1, le=1000), sort: str = "total"):
+    # Statements this process has run, heaviest first; with serve.py, each worker answers for itself
+    if sort not in querystats.SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(sorted(querystats.SORT_KEYS))}")
+    return {"slow_query_ms": settings.slow_query_ms, "statements": querystats.top(limit, sort)}
+
+@app.delete("/api/v1/debug/queries")
+async def reset_debug_queries():
+    querystats.reset()
+    return {"message": "Query statistics reset"}
+
 
 # ------------------ Sensor Data API ------------------
 @app.post("/api/v1/sensor-data", response_model=SensorData, status_code=201)
-def create_sensor_data(payload: ArduinoSensorData, request: Request, session: Session = Depends(session_dep)):
+async def create_sensor_data(payload: ArduinoSensorData, request: Request, response: Response):
     # Use device_id from payload, fallback to header for backward compatibility
-    device_id = payload.device_id or request.headers.get("X-Device-ID")
-    
-    # Convert Arduino field names to our database field names
-    sensor_data = SensorData(
-        temperature=payload.temperature,
-        humidity=payload.humidity,
-        lux=payload.lux,
-        pump_active=payload.pumpActive,
-        timestamp=payload.timestamp,
-        device_id=device_id,
-        firmware_version=payload.firmware_version,
-        sensor_type=payload.sensor_type
-    )
-    
-    session.add(sensor_data)
-    session.commit()
-    session.refresh(sensor_data)
+    row = sensor_row(payload, request.headers.get("X-Device-ID"))
+    if writer_client:
+        # The writer process sends the event to every worker's stream
+        result = await commit_in_writer([row])
+    elif ingest_writer:
+        # Resumes once the group holding this reading has been committed; no thread waits meanwhile
+        result = await asyncio.wrap_future(ingest_writer.submit(row))
+    else:
+        result = await run_write(insert_sensor_rows, [row])
+        if not result.duplicates:
+            mark_sensor_rows_committed([row])
+    [sensor_id] = result.ids
+    if result.duplicates:
+        # A resend of a stored reading (same device and timestamp): answer with what was stored
+        stored = await run_read(load_sensor_data, sensor_id)
+        if stored is not None:
+            response.status_code = 200
+            return stored
+    sensor_data = SensorData(id=sensor_id, **row)
+    if broker.has_subscribers and not writer_client:
+        broker.publish("sensor_data", jsonable_encoder([sensor_data]))
     return sensor_data
 
+def load_sensor_data(session: Session, sensor_id: int) -> Optional[SensorData]:
+    if segments.ENABLED:
+        reading = segments.get_reading(session, sensor_id)
+    else:
+        reading = session.get(SensorData, sensor_id)
+    return reading or archive.get_reading(session, sensor_id)
+
+def rollup_row(sensor_data: SensorData) -> Dict[str, Any]:
+    return {column.key: getattr(sensor_data, column.key) for column in rollups.ROW_COLUMNS}
+
+def reject_segment_edit():
+    if segments.ENABLED:
+        raise HTTPException(status_code=405, detail="Readings in the segment store can't be changed or deleted")
+
+def missing_sensor_data(session: Session, sensor_id: int) -> HTTPException:
+    if archive.get_reading(session, sensor_id) is not None:
+        return HTTPException(status_code=405, detail="Archived readings can't be changed or deleted")
+    return HTTPException(status_code=404, detail="Sensor data not found")
+
+def duplicate_sensor_data(session: Session, device_id: Optional[str], timestamp: float) -> HTTPException:
+    stored = session.exec(
+        select(SensorData.id).where(SensorData.device_id == device_id, SensorData.timestamp == timestamp)
+    ).first()
+    return HTTPException(status_code=409, detail=f"Reading {stored} already has this device_id and timestamp")
+
+@app.post("/api/v1/sensor-data/batch", response_model=SensorDataBatchResult, status_code=201)
+async def create_sensor_data_batch(payload: List[Any], request: Request):
+    # Buffered readings replayed by a device after it reconnects.
+    # Items are validated one by one so a bad reading doesn't reject the whole batch.
+    if len(payload) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_SIZE} readings")
+
+    header_device_id = request.headers.get("X-Device-ID")
+    items = []
+    rows = []
+    for index, raw in enumerate(payload):
+        if not isinstance(raw, dict):
+            items.append(SensorDataBatchItem(index=index, status="error", error="Reading must be a JSON object"))
+            continue
+        try:
+            reading = ArduinoSensorData(**raw)
+        except ValidationError as e:
+            items.append(SensorDataBatchItem(index=index, status="error", error=validation_message(e)))
+            continue
+        items.append(SensorDataBatchItem(index=index, status="created"))
+        rows.append(sensor_row(reading, header_device_id))
+    return await store_sensor_batch(items, rows)
+
+@app.post("/api/v1/sensor-data/binary", response_model=SensorDataBatchResult, status_code=201)
+async def create_sensor_data_binary(request: Request, payload: bytes = Body(..., media_type=binary.CONTENT_TYPE)):
+    # Compact encoding of one or more readings for constrained devices (see app/binary.py)
+    try:
+        header, records = binary.decode_readings(payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(records) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_SIZE} readings")
+
+    header_device_id = request.headers.get("X-Device-ID")
+    created_at = datetime.utcnow()
+    items = []
+    rows = []
+    for index, record in enumerate(records):
+        if not binary.is_valid_record(record):
+            items.append(SensorDataBatchItem(index=index, status="error", error="Sensor read failed or invalid pump flag"))
+            continue
+        items.append(SensorDataBatchItem(index=index, status="created"))
+        rows.append(binary.record_row(header, record, created_at, header_device_id))
+    return await store_sensor_batch(items, rows)
+
+async def store_sensor_batch(items: List[SensorDataBatchItem], rows: List[Dict[str, Any]]) -> SensorDataBatchResult:
+    # One INSERT and one commit for the whole batch
+    if writer_client:
+        result = await commit_in_writer(rows) if rows else InsertResult([], [])
+    else:
+        result = await run_write(insert_sensor_rows, rows)
+        added, added_ids = inserted_rows(rows, result)
+        mark_sensor_rows_committed(added)
+        if added and broker.has_subscribers:
+            broker.publish("sensor_data", jsonable_encoder([SensorData(id=i, **r) for i, r in zip(added_ids, added)]))
+
+    duplicates = set(result.duplicates)
+    position = 0
+    for item in items:
+        if item.status == "created":
+            item.id = result.ids[position]
+            if position in duplicates:
+                item.status = "duplicate"
+            position += 1
+    return SensorDataBatchResult(
+        created=len(rows) - len(duplicates),
+        failed=len(items) - len(rows),
+        duplicates=len(duplicates),
+        items=items,
+    )
+
+async def commit_in_writer(rows: List[Dict[str, Any]]) -> InsertResult:
+    try:
+        return await writer_client.insert(rows)
+    except WriterUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def not_modified(request: Request, response: Response, table: str, device_id: Optional[str] = None) -> Optional[Response]:
+    # Taken before the query runs, so a 304 never opens a database connection
+    etag = versions.etag(table, device_id)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+def set_next_cursor(request: Request, response: Response, next_cursor: Optional[str]):
+    # Pages are plain lists; the cursor for the next page travels in headers
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+
 @app.get("/api/v1/sensor-data", response_model=List[SensorData])
-def list_sensor_data(session: Session = Depends(session_dep), limit: Optional[int] = 100):
-    stmt = select(SensorData).order_by(SensorData.created_at.desc()).limit(limit)
-    return session.exec(stmt).all()
+async def list_sensor_data(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    device_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    pump_active: Optional[bool] = None,
+    firmware_version: Optional[str] = None,
+    sensor_type: Optional[str] = None,
+):
+    cached = not_modified(request, response, "sensordata", device_id)
+    if cached:
+        return cached
+    reading_filter = ReadingFilter(device_id, as_utc(start), as_utc(end), pump_active, firmware_version, sensor_type)
+    try:
+        # Pages of the live store, with archived readings merged in where they reach
+        rows, next_cursor = await run_read(archive.list_page, reading_filter, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_next_cursor(request, response, next_cursor)
+    # Row tuples go straight to JSON; response_model only documents the schema
+    return rows_response(SENSOR_DATA_FIELDS, rows, response.headers)
+
+@app.get("/api/v1/sensor-data/aggregate", response_model=SensorAggregate)
+def aggregate_sensor_data_endpoint(
+    device_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket: str = "1h",
+    session: Session = Depends(read_session_dep),
+):
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of: {', '.join(BUCKETS)}")
+    end = as_utc(end) or datetime.utcnow()
+    start = as_utc(start) or end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    # Buckets are always whole, so the range is widened to bucket boundaries
+    start, end = align_range(start, end, bucket)
+    if bucket_count(start, end, bucket) > MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Range covers more than {MAX_BUCKETS} buckets; use a larger bucket")
+
+    source, buckets = aggregate_sensor_data(session, start, end, bucket, device_id)
+    return SensorAggregate(device_id=device_id, bucket=bucket, source=source, start=start, end=end, buckets=buckets)
+
+@app.get("/api/v1/sensor-data/export")
+def export_sensor_data_endpoint(
+    format: str = "ndjson",
+    device_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    pump_active: Optional[bool] = None,
+    firmware_version: Optional[str] = None,
+    sensor_type: Optional[str] = None,
+):
+    # Streams from its own read-only connection rather than a request-scoped session
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(FORMATS)}")
+    reading_filter = ReadingFilter(device_id, as_utc(start), as_utc(end), pump_active, firmware_version, sensor_type)
+    return StreamingResponse(
+        export_sensor_data(reading_filter, format),
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="sensor-data.{format}"'},
+    )
 
 @app.get("/api/v1/sensor-data/{sensor_id}", response_model=SensorData)
-def get_sensor_data(sensor_id: int, session: Session = Depends(session_dep)):
-    sensor_data = session.get(SensorData, sensor_id)
+def get_sensor_data(sensor_id: int, request: Request, response: Response, session: Session = Depends(read_session_dep)):
+    cached = not_modified(request, response, "sensordata")
+    if cached:
+        return cached
+    sensor_data = load_sensor_data(session, sensor_id)
     if not sensor_data:
         raise HTTPException(status_code=404, detail="Sensor data not found")
     return sensor_data
 
 @app.put("/api/v1/sensor-data/{sensor_id}", response_model=SensorData)
 def update_sensor_data(sensor_id: int, payload: SensorDataUpdate, session: Session = Depends(session_dep)):
+    reject_segment_edit()
     sensor_data = session.get(SensorData, sensor_id)
     if not sensor_data:
-        raise HTTPException(status_code=404, detail="Sensor data not found")
+        raise missing_sensor_data(session, sensor_id)
+    old_device_id = sensor_data.device_id
+    old_row = rollup_row(sensor_data)
     data = payload.dict(exclude_unset=True)
     for k, v in data.items():
         setattr(sensor_data, k, v)
+    key = (sensor_data.device_id, sensor_data.timestamp)
     session.add(sensor_data)
+    try:
+        session.flush()
+    except IntegrityError:
+        # Another reading already has this device and timestamp (see ingest.DEDUP_INDEX)
+        session.rollback()
+        raise duplicate_sensor_data(session, *key)
+    rollups.apply_change(session, old_row, rollup_row(sensor_data))
+    refresh_device_latest(session, old_device_id)
+    if sensor_data.device_id != old_device_id:
+        refresh_device_latest(session, sensor_data.device_id)
     session.commit()
+    versions.bump("sensordata", old_device_id)
+    versions.bump("sensordata", sensor_data.device_id)
     session.refresh(sensor_data)
     return sensor_data
 
 @app.delete("/api/v1/sensor-data/{sensor_id}", status_code=204)
 def delete_sensor_data(sensor_id: int, session: Session = Depends(session_dep)):
+    reject_segment_edit()
     sensor_data = session.get(SensorData, sensor_id)
     if not sensor_data:
-        raise HTTPException(status_code=404, detail="Sensor data not found")
+        raise missing_sensor_data(session, sensor_id)
     session.delete(sensor_data)
+    session.flush()
+    rollups.apply_change(session, rollup_row(sensor_data), None)
+    refresh_device_latest(session, sensor_data.device_id)
     session.commit()
+    versions.bump("sensordata", sensor_data.device_id)
     return
 
+# ------------------ Devices API ------------------
+@app.get("/api/v1/devices/latest", response_model=List[DeviceLatest])
+def list_device_latest(request: Request, response: Response, session: Session = Depends(read_session_dep)):
+    cached = not_modified(request, response, "sensordata")
+    if cached:
+        return cached
+    # One row per device, maintained on ingest
+    stmt = select(DeviceLatest).order_by(DeviceLatest.created_at.desc())
+    return session.exec(stmt).all()
+
 # ------------------ Watering Data API ------------------
-@app.get("/api/v1/watering/{device_id}", response_model=WateringData)
-def get_watering_data(device_id: str, session: Session = Depends(session_dep)):
-    watering_data = session.get(WateringData, device_id)
-    if not watering_data:
-        # Create default watering data if it doesn't exist
-        watering_data = WateringData(device_id=device_id)
-        session.add(watering_data)
-        session.commit()
-        session.refresh(watering_data)
+def load_watering_data(session: Session, device_id: str) -> Optional[WateringData]:
+    return session.get(WateringData, device_id)
+
+def create_default_watering_data(device_id: str) -> WateringData:
+    with get_session() as write_session:
+        watering_data = write_session.get(WateringData, device_id)
+        if not watering_data:
+            watering_data = WateringData(device_id=device_id)
+            write_session.add(watering_data)
+            with versions.commit_lock():
+                write_session.commit()
+                tag = versions.bump("wateringdata", device_id)
+                write_session.refresh(watering_data)
+                watering_cache.put(device_id, tag, watering_data)
     return watering_data
 
+@app.get("/api/v1/watering/{device_id}", response_model=WateringData)
+async def get_watering_data(device_id: str, request: Request, response: Response):
+    cached = not_modified(request, response, "wateringdata", device_id)
+    if cached:
+        return cached
+    # The ETag doubles as the cache tag; it was taken before any read below
+    tag = response.headers["ETag"]
+    watering_data = watering_cache.get(device_id, tag)
+    if watering_data:
+        return watering_data
+    watering_data = await run_read(load_watering_data, device_id)
+    if watering_data:
+        watering_cache.put(device_id, tag, watering_data)
+        return watering_data
+    # Create default watering data if it doesn't exist. Rare, and it takes the
+    # commit lock, so it runs in the thread pool rather than on the loop
+    return await run_in_threadpool(create_default_watering_data, device_id)
+
 @app.put("/api/v1/watering", response_model=WateringData)
 def update_watering_data(payload: WateringDataUpdate, session: Session = Depends(session_dep)):
     # Get device_id from payload, use default if not provided
     device_id = payload.device_id or "default"
-    
-    watering_data = session.get(WateringData, device_id)
-    if not watering_data:
-        # Create new watering data if it doesn't exist
-        watering_data = WateringData(device_id=device_id)
-        session.add(watering_data)
+    # One transaction for the state change and its history record; the object isn't read back
+    watering_data = watering.apply_update(session, device_id, payload.dict(exclude_unset=True))
+    session.expire_on_commit = False
+    with versions.commit_lock():
         session.commit()
-        session.refresh(watering_data)
-    
-    # Check if pump status is changing
-    old_pump_active = watering_data.pump_active
-    new_pump_active = payload.pump_active
-    
-    # Update fields
-    data = payload.dict(exclude_unset=True)
-    for k, v in data.items():
-        if k != "device_id":  # Don't update device_id after creation
-            setattr(watering_data, k, v)
-    
-    # Update the timestamp
-    watering_data.timestamp = datetime.utcnow().timestamp()
-    
-    # Create history records when watering starts or ends
-    if old_pump_active != new_pump_active and new_pump_active is not None:
-        current_time = datetime.utcnow()
-        
-        if new_pump_active and not old_pump_active:
-            # Watering started - create new history record
-            history = WateringHistory(
-                device_id=device_id,
-                watering_duration=watering_data.watering_duration,
-                auto_watering=watering_data.auto_watering,
-                watering_started=current_time,
-                watering_ended=None
-            )
-            session.add(history)
-        elif not new_pump_active and old_pump_active:
-            # Watering ended - update the most recent incomplete history record
-            latest_history = session.exec(
-                select(WateringHistory)
-                .where(WateringHistory.device_id == device_id)
-                .where(WateringHistory.watering_ended.is_(None))
-                .order_by(WateringHistory.watering_started.desc())
-            ).first()
-            
-            if latest_history:
-                latest_history.watering_ended = current_time
-                session.add(latest_history)
-    
-    session.add(watering_data)
-    session.commit()
-    session.refresh(watering_data)
+        tag = versions.bump("wateringdata", device_id)
+        watering_cache.put(device_id, tag, watering_data)
+    versions.bump("wateringhistory", device_id)
+    event = jsonable_encoder(watering_data)
+    broker.publish("watering", event)
+    if writer_client:
+        writer_client.publish("watering", event)
     return watering_data
 
 # ------------------ Watering History API ------------------
 @app.get("/api/v1/watering-history", response_model=List[WateringHistory])
-def list_watering_history(device_id: Optional[str] = None, session: Session = Depends(session_dep)):
-    statement = select(WateringHistory)
-    if device_id:
-        statement = statement.where(WateringHistory.device_id == device_id)
-    statement = statement.order_by(WateringHistory.watering_started.desc())
-    history = session.exec(statement).all()
-    return history
+def list_watering_history(
+    request: Request,
+    response: Response,
+    device_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: Session = Depends(read_session_dep),
+):
+    cached = not_modified(request, response, "wateringhistory", device_id)
+    if cached:
+        return cached
+    try:
+        history, next_cursor = list_watering_history_page(session, device_id, as_utc(start), as_utc(end), limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_next_cursor(request, response, next_cursor)
+    return rows_response(WATERING_HISTORY_FIELDS, history, response.headers)
 
 @app.get("/api/v1/watering-history/{history_id}", response_model=WateringHistory)
-def get_watering_history(history_id: int, session: Session = Depends(session_dep)):
+def get_watering_history(history_id: int, request: Request, response: Response, session: Session = Depends(read_session_dep)):
+    cached = not_modified(request, response, "wateringhistory")
+    if cached:
+        return cached
     history = session.get(WateringHistory, history_id)
     if not history:
         raise HTTPException(status_code=404, detail="Watering history not found")
@@ -187,6 +607,7 @@ def create_watering_history(history_data: WateringHistoryCreate, session: Sessio
     history = WateringHistory(**history_data.dict())
     session.add(history)
     session.commit()
+    versions.bump("wateringhistory", history.device_id)
     session.refresh(history)
     return history
 
@@ -195,6 +616,7 @@ def update_watering_history(history_id: int, payload: WateringHistoryUpdate, ses
     history = session.get(WateringHistory, history_id)
     if not history:
         raise HTTPException(status_code=404, detail="Watering history not found")
+    old_device_id = history.device_id
     
     data = payload.dict(exclude_unset=True)
     for k, v in data.items():
@@ -202,6 +624,8 @@ def update_watering_history(history_id: int, payload: WateringHistoryUpdate, ses
     
     session.add(history)
     session.commit()
+    versions.bump("wateringhistory", old_device_id)
+    versions.bump("wateringhistory", history.device_id)
     session.refresh(history)
     return history
 
@@ -212,4 +636,5 @@ def delete_watering_history(history_id: int, session: Session = Depends(session_
         raise HTTPException(status_code=404, detail="Watering history not found")
     session.delete(history)
     session.commit()
+    versions.bump("wateringhistory", history.device_id)
     return
\ No newline at end of file
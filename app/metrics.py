@@ -0,0 +1,151 @@
+"""Prometheus text-format metrics without a client library.
+
+Histograms allocate their bucket counts once, when a label set is first
+seen, and observing is a bisect plus two additions. Nothing takes a lock:
+request metrics are only updated on the event loop thread, and the database
+metrics, which can also be updated from thread-pool workers, would at worst
+lose an increment to a badly timed thread switch. That is an acceptable
+error for monitoring and keeps the ingest path free of lock traffic.
+
+Counters are per process; with several workers (serve.py) each scrape
+reports the worker that answered it.
+"""
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+HTTP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One slot per bound plus +Inf; made cumulative only when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class HistogramFamily:
+    """A histogram per combination of label values"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], bounds: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.bounds = bounds
+        self.children: Dict[Tuple[str, ...], Histogram] = {}
+
+    def labels(self, *values: str) -> Histogram:
+        child = self.children.get(values)
+        if child is None:
+            child = self.children.setdefault(values, Histogram(self.bounds))
+        return child
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for values, child in sorted(self.children.items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, values))
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.bounds, child.counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+            cumulative += child.counts[-1]
+            yield f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}'
+            suffix = f"{{{labels}}}" if labels else ""
+            yield f"{self.name}_sum{suffix} {child.sum}"
+            yield f"{self.name}_count{suffix} {cumulative}"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_gauge(name: str, help_text: str, samples: Iterable[Tuple[Dict[str, str], float]]) -> Iterable[str]:
+    yield f"# HELP {name} {help_text}"
+    yield f"# TYPE {name} gauge"
+    for labels, value in samples:
+        label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        yield f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}"
+
+http_requests = HistogramFamily(
+    "pi_sensor_http_request_duration_seconds",
+    "Time to answer an HTTP request, by route template and status code",
+    ("method", "route", "status"),
+    HTTP_BUCKETS,
+)
+db_statements = HistogramFamily(
+    "pi_sensor_db_statement_duration_seconds",
+    "Time to execute a SQL statement, by connection pool and statement type",
+    ("pool", "statement"),
+    DB_BUCKETS,
+)
+db_commits = HistogramFamily(
+    "pi_sensor_db_commit_duration_seconds",
+    "Time to commit a write transaction",
+    (),
+    DB_BUCKETS,
+)
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+requests_in_flight = Gauge()
+streams_open = Gauge()
+
+# Long-lived responses: counted in streams_open, kept out of the latency histogram and requests_in_flight
+STREAMING_PATHS = {"/api/v1/stream"}
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency per route, the requests in flight and the open streams"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if scope["path"] in STREAMING_PATHS:
+            # A stream lasts as long as the dashboard stays open; its duration says nothing about latency
+            streams_open.value += 1
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                streams_open.value -= 1
+            return
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        requests_in_flight.value += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            requests_in_flight.value -= 1
+            # The router puts the matched route in the scope; the template keeps label values bounded
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            http_requests.labels(scope["method"], path, str(status)).observe(time.perf_counter() - started)
+
+def render(gauges: Optional[Callable[[], Iterable[str]]] = None) -> str:
+    lines: List[str] = []
+    for family in (http_requests, db_statements, db_commits):
+        lines.extend(family.render())
+    if gauges:
+        lines.extend(gauges())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,294 @@
+"""Versioned schema migrations.
+
+The schema version lives in SQLite's PRAGMA user_version. init_db() applies
+every migration newer than the stored version in order, each one in its own
+transaction together with the version bump, so an existing db.sqlite is
+upgraded in place and a half-applied migration is never recorded.
+
+Migrations are append-only: never edit one that has shipped, add a new one.
+Steps are SQL strings or callables taking a SQLAlchemy Connection.
+"""
+import logging
+from typing import Callable, List, NamedTuple, Sequence, Union
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+Step = Union[str, Callable[[Connection], None]]
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    steps: Sequence[Step]
+
+def _unique_reading_key(conn: Connection):
+    # Creating the index fails while duplicates exist; those databases keep
+    # accepting them until manage.py dedup removes them and adds the index
+    duplicate = conn.exec_driver_sql(
+        "SELECT 1 FROM sensordata WHERE device_id IS NOT NULL GROUP BY device_id, timestamp HAVING COUNT(*) > 1 LIMIT 1"
+    ).first()
+    if duplicate:
+        logger.warning("sensordata holds duplicate readings; run `python manage.py dedup` to remove them")
+        return
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_sensordata_device_id_timestamp ON sensordata (device_id, timestamp)"
+    )
+
+def _sensordata_autoincrement(conn: Connection):
+    # Without AUTOINCREMENT SQLite hands out max(id) + 1, so once the newest
+    # readings are deleted or archived their ids would be given out again.
+    # SQLite can't add it to an existing table; the table is copied instead.
+    indexes = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'sensordata' AND sql IS NOT NULL"
+    ).scalars().all()
+    conn.exec_driver_sql("""CREATE TABLE sensordata_new (
+        temperature FLOAT NOT NULL,
+        humidity FLOAT NOT NULL,
+        lux FLOAT NOT NULL,
+        pump_active BOOLEAN NOT NULL,
+        timestamp INTEGER NOT NULL,
+        device_id VARCHAR(50),
+        firmware_version VARCHAR(20),
+        sensor_type VARCHAR(50),
+        id INTEGER NOT NULL,
+        created_at DATETIME NOT NULL,
+        PRIMARY KEY (id AUTOINCREMENT)
+    )""")
+    conn.exec_driver_sql("""INSERT INTO sensordata_new (
+        temperature, humidity, lux, pump_active, timestamp, device_id, firmware_version, sensor_type, id, created_at
+    )
+    SELECT temperature, humidity, lux, pump_active, timestamp, device_id, firmware_version, sensor_type, id, created_at
+    FROM sensordata""")
+    conn.exec_driver_sql("DROP TABLE sensordata")
+    conn.exec_driver_sql("ALTER TABLE sensordata_new RENAME TO sensordata")
+    for sql in indexes:
+        conn.exec_driver_sql(sql)
+    # Carry on above every id handed out so far, wherever the reading lives now.
+    # sqlite_sequence has no unique name, and the copy brought its own row along.
+    conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'sensordata'")
+    conn.exec_driver_sql("""INSERT INTO sqlite_sequence (name, seq) SELECT 'sensordata', max(
+        coalesce((SELECT max(id) FROM sensordata), 0),
+        coalesce((SELECT max(last_id) FROM reading_chunk), 0),
+        coalesce((SELECT max(last_id) FROM reading_segment), 0),
+        coalesce((SELECT value FROM rollup_state WHERE name = 'high_water_mark'), 0)
+    )""")
+    conn.exec_driver_sql("ANALYZE sensordata")
+
+MIGRATIONS: List[Migration] = [
+    # Databases created before migrations existed already have these tables,
+    # hence IF NOT EXISTS; they are adopted as version 1.
+    Migration(1, "baseline tables", [
+        """CREATE TABLE IF NOT EXISTS sensordata (
+            temperature FLOAT NOT NULL,
+            humidity FLOAT NOT NULL,
+            lux FLOAT NOT NULL,
+            pump_active BOOLEAN NOT NULL,
+            timestamp INTEGER NOT NULL,
+            device_id VARCHAR(50),
+            firmware_version VARCHAR(20),
+            sensor_type VARCHAR(50),
+            id INTEGER NOT NULL,
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS wateringdata (
+            device_id VARCHAR NOT NULL,
+            pump_active BOOLEAN NOT NULL,
+            last_watering DATETIME,
+            watering_duration INTEGER NOT NULL,
+            auto_watering BOOLEAN NOT NULL,
+            timestamp FLOAT NOT NULL,
+            PRIMARY KEY (device_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS wateringhistory (
+            device_id VARCHAR(50) NOT NULL,
+            watering_duration INTEGER NOT NULL,
+            auto_watering BOOLEAN NOT NULL,
+            watering_started DATETIME NOT NULL,
+            watering_ended DATETIME,
+            id INTEGER NOT NULL,
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+    ]),
+    Migration(2, "indexes for hot query paths", [
+        # list_sensor_data without a device filter
+        "CREATE INDEX IF NOT EXISTS ix_sensordata_created_at ON sensordata (created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_sensordata_device_id_created_at ON sensordata (device_id, created_at)",
+        # list_watering_history without a device filter
+        "CREATE INDEX IF NOT EXISTS ix_wateringhistory_watering_started ON wateringhistory (watering_started)",
+        "CREATE INDEX IF NOT EXISTS ix_wateringhistory_device_id_watering_started ON wateringhistory (device_id, watering_started)",
+        # Open session lookup in update_watering_data; only unfinished sessions are indexed
+        "CREATE INDEX IF NOT EXISTS ix_wateringhistory_open ON wateringhistory (device_id, watering_started) WHERE watering_ended IS NULL",
+        "ANALYZE",
+    ]),
+    Migration(3, "latest reading per device", [
+        """CREATE TABLE IF NOT EXISTS device_latest (
+            device_id VARCHAR(50) NOT NULL,
+            sensor_data_id INTEGER NOT NULL,
+            temperature FLOAT NOT NULL,
+            humidity FLOAT NOT NULL,
+            lux FLOAT NOT NULL,
+            pump_active BOOLEAN NOT NULL,
+            timestamp INTEGER NOT NULL,
+            firmware_version VARCHAR(20),
+            sensor_type VARCHAR(50),
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY (device_id)
+        )""",
+        # SQLite takes the bare columns from the row that supplied MAX(created_at)
+        """INSERT OR REPLACE INTO device_latest (
+            device_id, sensor_data_id, temperature, humidity, lux, pump_active,
+            timestamp, firmware_version, sensor_type, created_at
+        )
+        SELECT device_id, id, temperature, humidity, lux, pump_active,
+               timestamp, firmware_version, sensor_type, MAX(created_at)
+        FROM sensordata
+        WHERE device_id IS NOT NULL
+        GROUP BY device_id""",
+    ]),
+    # Existing readings are rolled up by the catch-up job, starting from id 0
+    Migration(4, "sensor rollups", [
+        """CREATE TABLE IF NOT EXISTS sensor_rollup_1m (
+            device_id VARCHAR(50) NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            temperature_sum FLOAT NOT NULL,
+            temperature_min FLOAT NOT NULL,
+            temperature_max FLOAT NOT NULL,
+            humidity_sum FLOAT NOT NULL,
+            humidity_min FLOAT NOT NULL,
+            humidity_max FLOAT NOT NULL,
+            lux_sum FLOAT NOT NULL,
+            lux_min FLOAT NOT NULL,
+            lux_max FLOAT NOT NULL,
+            pump_on INTEGER NOT NULL,
+            PRIMARY KEY (device_id, bucket_start)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS ix_sensor_rollup_1m_bucket_start ON sensor_rollup_1m (bucket_start)",
+        """CREATE TABLE IF NOT EXISTS sensor_rollup_1h (
+            device_id VARCHAR(50) NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            temperature_sum FLOAT NOT NULL,
+            temperature_min FLOAT NOT NULL,
+            temperature_max FLOAT NOT NULL,
+            humidity_sum FLOAT NOT NULL,
+            humidity_min FLOAT NOT NULL,
+            humidity_max FLOAT NOT NULL,
+            lux_sum FLOAT NOT NULL,
+            lux_min FLOAT NOT NULL,
+            lux_max FLOAT NOT NULL,
+            pump_on INTEGER NOT NULL,
+            PRIMARY KEY (device_id, bucket_start)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS ix_sensor_rollup_1h_bucket_start ON sensor_rollup_1h (bucket_start)",
+        """CREATE TABLE IF NOT EXISTS sensor_rollup_1d (
+            device_id VARCHAR(50) NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            temperature_sum FLOAT NOT NULL,
+            temperature_min FLOAT NOT NULL,
+            temperature_max FLOAT NOT NULL,
+            humidity_sum FLOAT NOT NULL,
+            humidity_min FLOAT NOT NULL,
+            humidity_max FLOAT NOT NULL,
+            lux_sum FLOAT NOT NULL,
+            lux_min FLOAT NOT NULL,
+            lux_max FLOAT NOT NULL,
+            pump_on INTEGER NOT NULL,
+            PRIMARY KEY (device_id, bucket_start)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS ix_sensor_rollup_1d_bucket_start ON sensor_rollup_1d (bucket_start)",
+        """CREATE TABLE IF NOT EXISTS rollup_state (
+            name VARCHAR NOT NULL,
+            value INTEGER NOT NULL,
+            PRIMARY KEY (name)
+        )""",
+        "INSERT OR IGNORE INTO rollup_state (name, value) VALUES ('high_water_mark', 0)",
+    ]),
+    # Pumps running now get the record update_watering_data would have closed
+    Migration(5, "open watering record per device", [
+        "ALTER TABLE wateringdata ADD COLUMN open_history_id INTEGER",
+        """UPDATE wateringdata SET open_history_id = (
+            SELECT id FROM wateringhistory
+            WHERE wateringhistory.device_id = wateringdata.device_id AND watering_ended IS NULL
+            ORDER BY watering_started DESC
+            LIMIT 1
+        )
+        WHERE pump_active""",
+    ]),
+    Migration(6, "unique reading per device and device timestamp", [_unique_reading_key]),
+    # Used only with PI_SENSOR_READING_STORE=segments (app/segments.py)
+    Migration(7, "segment store index", [
+        """CREATE TABLE IF NOT EXISTS reading_segment (
+            id INTEGER NOT NULL,
+            device_id VARCHAR(50),
+            count INTEGER NOT NULL,
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            first_created_at INTEGER NOT NULL,
+            last_created_at INTEGER NOT NULL,
+            PRIMARY KEY (id AUTOINCREMENT)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_reading_segment_device_id ON reading_segment (device_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_reading_segment_last_created_at ON reading_segment (last_created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_reading_segment_last_id ON reading_segment (last_id)",
+        """CREATE TABLE IF NOT EXISTS reading_tag (
+            id INTEGER NOT NULL,
+            firmware_version VARCHAR(20),
+            sensor_type VARCHAR(50),
+            PRIMARY KEY (id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_reading_tag_firmware_version_sensor_type ON reading_tag (firmware_version, sensor_type)",
+    ]),
+    Migration(8, "compressed reading chunks", [
+        """CREATE TABLE IF NOT EXISTS reading_chunk (
+            id INTEGER NOT NULL,
+            device_id VARCHAR(50),
+            firmware_version VARCHAR(20),
+            sensor_type VARCHAR(50),
+            count INTEGER NOT NULL,
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            first_created_at INTEGER NOT NULL,
+            last_created_at INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (id AUTOINCREMENT)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_reading_chunk_device_id_last_created_at ON reading_chunk (device_id, last_created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_reading_chunk_last_created_at ON reading_chunk (last_created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_reading_chunk_last_id ON reading_chunk (last_id)",
+    ]),
+    # Copies sensordata once, so upgrading a large database takes a while
+    Migration(9, "reading ids never reused", [_sensordata_autoincrement]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+def get_version(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+def migrate(engine: Engine) -> int:
+    """Bring the database up to LATEST_VERSION; returns the resulting version"""
+    with engine.connect() as conn:
+        current = get_version(conn)
+    if current > LATEST_VERSION:
+        raise RuntimeError(
+            f"Database schema version {current} is newer than this code supports ({LATEST_VERSION})"
+        )
+
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        logger.info("Applying migration %s: %s", migration.version, migration.description)
+        with engine.begin() as conn:
+            for step in migration.steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.exec_driver_sql(step)
+            # user_version is part of the database header, so it commits atomically with the steps
+            conn.exec_driver_sql(f"PRAGMA user_version = {int(migration.version)}")
+        current = migration.version
+    return current
@@ -1,5 +1,6 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
+from sqlalchemy import Index, text
 from sqlmodel import SQLModel, Field
 from pydantic import BaseModel
 
@@ -24,13 +25,157 @@ class SensorDataBase(SQLModel):
     firmware_version: Optional[str] = Field(default=None, max_length=20, description="Firmware version")
     sensor_type: Optional[str] = Field(default=None, max_length=50, description="Sensor type")
 
+# Indexes mirror app/migrations.py, which owns the actual schema
 class SensorData(SensorDataBase, table=True):
+    __table_args__ = (
+        Index("ix_sensordata_created_at", "created_at"),
+        Index("ix_sensordata_device_id_created_at", "device_id", "created_at"),
+        # Created by migration 6 only once the table holds no duplicates (see manage.py dedup)
+        Index("ux_sensordata_device_id_timestamp", "device_id", "timestamp", unique=True),
+        # Ids are never reused, so archived readings (app/archive.py) keep theirs (migration 9)
+        {"sqlite_autoincrement": True},
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
 
+# Latest reading per device, kept current by the ingest path so the
+# device overview never has to scan sensordata
+class DeviceLatest(SQLModel, table=True):
+    __tablename__ = "device_latest"
+    device_id: str = Field(primary_key=True, max_length=50, description="Device identifier")
+    sensor_data_id: int = Field(description="Id of the SensorData row this reading came from")
+    temperature: float
+    humidity: float
+    lux: float
+    pump_active: bool
+    timestamp: int = Field(description="Device timestamp")
+    firmware_version: Optional[str] = Field(default=None, max_length=20)
+    sensor_type: Optional[str] = Field(default=None, max_length=50)
+    created_at: datetime
+
+# Rollups of SensorData per device and time bucket, maintained by app/rollups.py.
+# Sums are stored instead of averages so buckets can be merged.
+class SensorRollupBase(SQLModel):
+    device_id: str = Field(primary_key=True, max_length=50, description="Device identifier ('' for readings without one)")
+    bucket_start: int = Field(primary_key=True, description="Bucket start, Unix seconds")
+    count: int
+    temperature_sum: float
+    temperature_min: float
+    temperature_max: float
+    humidity_sum: float
+    humidity_min: float
+    humidity_max: float
+    lux_sum: float
+    lux_min: float
+    lux_max: float
+    pump_on: int = Field(description="Readings with the pump running")
+
+class SensorRollup1m(SensorRollupBase, table=True):
+    __tablename__ = "sensor_rollup_1m"
+    __table_args__ = (Index("ix_sensor_rollup_1m_bucket_start", "bucket_start"),)
+
+class SensorRollup1h(SensorRollupBase, table=True):
+    __tablename__ = "sensor_rollup_1h"
+    __table_args__ = (Index("ix_sensor_rollup_1h_bucket_start", "bucket_start"),)
+
+class SensorRollup1d(SensorRollupBase, table=True):
+    __tablename__ = "sensor_rollup_1d"
+    __table_args__ = (Index("ix_sensor_rollup_1d_bucket_start", "bucket_start"),)
+
+class RollupState(SQLModel, table=True):
+    __tablename__ = "rollup_state"
+    name: str = Field(primary_key=True)
+    value: int = Field(default=0)
+
+# Index of the segment files that hold raw readings with PI_SENSOR_READING_STORE=segments
+# (app/segments.py). Times are microseconds since the epoch; ids are never reused, since
+# worker processes may still have a dropped segment's file mapped.
+class ReadingSegment(SQLModel, table=True):
+    __tablename__ = "reading_segment"
+    __table_args__ = (
+        Index("ix_reading_segment_device_id", "device_id", "id"),
+        Index("ix_reading_segment_last_created_at", "last_created_at"),
+        Index("ix_reading_segment_last_id", "last_id"),
+        {"sqlite_autoincrement": True},
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    device_id: Optional[str] = Field(default=None, max_length=50)
+    count: int = Field(default=0, description="Committed records; anything past them in the file is ignored")
+    first_id: int
+    last_id: int
+    first_created_at: int
+    last_created_at: int
+
+# Firmware version and sensor type pairs, stored once and referenced from segment records
+class ReadingTag(SQLModel, table=True):
+    __tablename__ = "reading_tag"
+    __table_args__ = (Index("ix_reading_tag_firmware_version_sensor_type", "firmware_version", "sensor_type"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    firmware_version: Optional[str] = Field(default=None, max_length=20)
+    sensor_type: Optional[str] = Field(default=None, max_length=50)
+
+# Compressed readings older than PI_SENSOR_ARCHIVE_AGE (app/archive.py): one device, firmware
+# version and sensor type per chunk, encoded column by column (app/columnar.py). Times are
+# microseconds since the epoch; first_id and last_id are the lowest and highest id in the chunk.
+# Chunk ids are never reused, since processes keep recently decoded chunks by id.
+class ReadingChunk(SQLModel, table=True):
+    __tablename__ = "reading_chunk"
+    __table_args__ = (
+        Index("ix_reading_chunk_device_id_last_created_at", "device_id", "last_created_at"),
+        Index("ix_reading_chunk_last_created_at", "last_created_at"),
+        Index("ix_reading_chunk_last_id", "last_id"),
+        {"sqlite_autoincrement": True},
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    device_id: Optional[str] = Field(default=None, max_length=50)
+    firmware_version: Optional[str] = Field(default=None, max_length=20)
+    sensor_type: Optional[str] = Field(default=None, max_length=50)
+    count: int
+    first_id: int
+    last_id: int
+    first_created_at: int
+    last_created_at: int
+    data: bytes
+
 class SensorDataCreate(SensorDataBase):
     pass
 
+class SensorDataBatchItem(BaseModel):
+    """Per-reading outcome of a batch ingest"""
+    index: int
+    status: str  # "created", "duplicate" (already stored; id is the stored reading) or "error"
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+class SensorDataBatchResult(BaseModel):
+    created: int
+    failed: int
+    duplicates: int = 0
+    items: List[SensorDataBatchItem]
+
+class SensorAggregateBucket(BaseModel):
+    """Summary of the readings in one time bucket"""
+    bucket_start: datetime
+    count: int
+    temperature_min: float
+    temperature_max: float
+    temperature_avg: float
+    humidity_min: float
+    humidity_max: float
+    humidity_avg: float
+    lux_min: float
+    lux_max: float
+    lux_avg: float
+    pump_duty_cycle: float  # fraction of readings with the pump running
+
+class SensorAggregate(BaseModel):
+    device_id: Optional[str] = None
+    bucket: str
+    source: str  # "raw" or the rollup table the buckets were computed from
+    start: datetime
+    end: datetime
+    buckets: List[SensorAggregateBucket]
+
 class SensorDataUpdate(SQLModel):
     temperature: Optional[float] = None
     humidity: Optional[float] = None
@@ -49,6 +194,8 @@ class WateringData(SQLModel, table=True):
     watering_duration: int = Field(default=30, description="Watering duration in seconds")
     auto_watering: bool = Field(default=True, description="Auto watering enabled")
     timestamp: float = Field(default_factory=lambda: datetime.utcnow().timestamp(), description="Last update timestamp")
+    # WateringHistory record of the running pump (see app/watering.py); internal, not part of the API
+    open_history_id: Optional[int] = Field(default=None, exclude=True)
 
 class WateringDataUpdate(SQLModel):
     pump_active: Optional[bool] = None
@@ -67,6 +214,11 @@ class WateringHistoryBase(SQLModel):
     watering_ended: Optional[datetime] = Field(default=None, description="When watering ended")
 
 class WateringHistory(WateringHistoryBase, table=True):
+    __table_args__ = (
+        Index("ix_wateringhistory_watering_started", "watering_started"),
+        Index("ix_wateringhistory_device_id_watering_started", "device_id", "watering_started"),
+        Index("ix_wateringhistory_open", "device_id", "watering_started", sqlite_where=text("watering_ended IS NULL")),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
 
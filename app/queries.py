@@ -0,0 +1,120 @@
+"""Filtered, keyset-paginated reads for the list endpoints.
+
+Pages are ordered newest first by (timestamp column, id) and a cursor holds
+the sort key of the last row returned. The next page starts with a range
+seek on the matching index, so deep pages cost the same as the first one,
+unlike OFFSET.
+
+Pages are plain row tuples rather than ORM objects, with the columns in the
+model's field order (SENSOR_DATA_FIELDS, WATERING_HISTORY_FIELDS), so they
+can be encoded without building and validating a model per row; see
+app/serialize.py.
+"""
+import base64
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+from sqlalchemy import Row, select, tuple_
+from sqlmodel import Session
+from .models import SensorData, WateringHistory
+from .serialize import model_columns
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+SENSOR_DATA_COLUMNS = model_columns(SensorData)
+SENSOR_DATA_FIELDS = [column.key for column in SENSOR_DATA_COLUMNS]
+WATERING_HISTORY_COLUMNS = model_columns(WateringHistory)
+WATERING_HISTORY_FIELDS = [column.key for column in WATERING_HISTORY_COLUMNS]
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    raw = f"{sort_value.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Raises ValueError for anything that isn't a cursor we issued"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        sort_value, row_id = raw.split("|")
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+class ReadingFilter(NamedTuple):
+    """The reading filters of the list and export endpoints, for either store
+
+    sensor_data_filters(*reading_filter) turns one into SQL conditions.
+    """
+    device_id: Optional[str] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    pump_active: Optional[bool] = None
+    firmware_version: Optional[str] = None
+    sensor_type: Optional[str] = None
+
+def sensor_data_filters(
+    device_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    pump_active: Optional[bool] = None,
+    firmware_version: Optional[str] = None,
+    sensor_type: Optional[str] = None,
+) -> list:
+    conditions = []
+    if device_id:
+        conditions.append(SensorData.device_id == device_id)
+    if start:
+        conditions.append(SensorData.created_at >= start)
+    if end:
+        conditions.append(SensorData.created_at < end)
+    if pump_active is not None:
+        conditions.append(SensorData.pump_active == pump_active)
+    if firmware_version:
+        conditions.append(SensorData.firmware_version == firmware_version)
+    if sensor_type:
+        conditions.append(SensorData.sensor_type == sensor_type)
+    return conditions
+
+def list_sensor_data_page(
+    session: Session,
+    filters: list,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Tuple[List[Row], Optional[str]]:
+    """One page of readings, newest first; returns (rows, next cursor or None)"""
+    stmt = select(*SENSOR_DATA_COLUMNS).where(*filters)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(SensorData.created_at, SensorData.id) < (created_at, row_id))
+    # Fetch one extra row to learn whether another page exists
+    stmt = stmt.order_by(SensorData.created_at.desc(), SensorData.id.desc()).limit(limit + 1)
+    rows = session.execute(stmt).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+def list_watering_history_page(
+    session: Session,
+    device_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Tuple[List[Row], Optional[str]]:
+    """One page of watering sessions, most recently started first"""
+    stmt = select(*WATERING_HISTORY_COLUMNS)
+    if device_id:
+        stmt = stmt.where(WateringHistory.device_id == device_id)
+    if start:
+        stmt = stmt.where(WateringHistory.watering_started >= start)
+    if end:
+        stmt = stmt.where(WateringHistory.watering_started < end)
+    if cursor:
+        started, row_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(WateringHistory.watering_started, WateringHistory.id) < (started, row_id))
+    stmt = stmt.order_by(WateringHistory.watering_started.desc(), WateringHistory.id.desc()).limit(limit + 1)
+    rows = session.execute(stmt).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].watering_started, rows[-1].id)
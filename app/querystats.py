@@ -0,0 +1,203 @@
+"""Per-statement timings, row counts and a slow-query log.
+
+Connections are opened with connection_factory() (see db.py), whose cursors
+time each statement from execute through its last fetch and count the rows
+it touched: rows fetched for a SELECT, rows changed for a write. SQLite only
+runs a SELECT to its first row in execute() and steps through the rest as it
+is fetched, so timing execute alone, as SQLAlchemy's cursor events do, would
+miss most of a large scan. Each statement is recorded when its cursor is
+closed, which SQLAlchemy does once the result is consumed.
+
+Totals are kept per statement text; SQLAlchemy compiles each query once with
+bound parameters, so the texts are few. Statements slower than
+PI_SENSOR_SLOW_QUERY_MS are logged with their parameters and the output of
+EXPLAIN QUERY PLAN, which is also kept for /api/v1/debug/queries. The same
+timings feed the statement histograms on /metrics.
+
+As in metrics.py nothing takes a lock, and the numbers are per process.
+"""
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+from .config import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Statements tracked individually; anything new past this only reaches /metrics
+MAX_STATEMENTS = 1000
+# Statements EXPLAIN QUERY PLAN can describe
+EXPLAINABLE = {"SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH"}
+SORT_KEYS = {"total", "max", "count", "rows"}
+
+class StatementStats:
+    __slots__ = ("statement", "kind", "count", "total", "max", "rows", "slow", "plan")
+
+    def __init__(self, statement: str, kind: str):
+        self.statement = statement
+        self.kind = kind
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.plan: Optional[List[str]] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "statement": self.statement,
+            "type": self.kind,
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "avg_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+            "rows": self.rows,
+            "slow": self.slow,
+            "plan": self.plan,
+        }
+
+_stats: Dict[str, StatementStats] = {}
+
+def _statement_kind(statement: str) -> str:
+    words = statement.split(None, 1)
+    return words[0].upper() if words else "EMPTY"
+
+def _entry(statement: str) -> StatementStats:
+    entry = _stats.get(statement)
+    if entry is None:
+        entry = StatementStats(statement, _statement_kind(statement))
+        if len(_stats) < MAX_STATEMENTS:
+            entry = _stats.setdefault(statement, entry)
+    return entry
+
+def explain(connection: sqlite3.Connection, statement: str, parameters: Any) -> List[str]:
+    """EXPLAIN QUERY PLAN as indented lines, like the sqlite3 shell prints it"""
+    # A plain cursor, so the EXPLAIN itself isn't recorded
+    cursor = sqlite3.Cursor(connection)
+    try:
+        rows = cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+    except sqlite3.Error as e:
+        return [f"(no plan: {e})"]
+    finally:
+        cursor.close()
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node] + detail)
+    return lines
+
+def _short(value: Any, limit: int = 500) -> str:
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+def record(pool: str, connection: sqlite3.Connection, statement: str, parameters: Any, elapsed: float, rows: int):
+    entry = _entry(statement)
+    entry.count += 1
+    entry.total += elapsed
+    entry.rows += rows
+    if elapsed > entry.max:
+        entry.max = elapsed
+    metrics.db_statements.labels(pool, entry.kind).observe(elapsed)
+    if settings.slow_query_ms and elapsed * 1000 >= settings.slow_query_ms:
+        entry.slow += 1
+        # Plans only change with the schema, so one per statement is enough
+        if entry.plan is None and entry.kind in EXPLAINABLE:
+            entry.plan = explain(connection, statement, parameters)
+        logger.warning(
+            "Slow query (%.1f ms, %d rows, %s pool): %s\n  parameters: %s%s",
+            elapsed * 1000, rows, pool, statement, _short(parameters),
+            "".join("\n  " + line for line in entry.plan or ()),
+        )
+
+def top(limit: int, sort: str = "total") -> List[Dict[str, Any]]:
+    """The tracked statements with the highest total time (or max, count, rows)"""
+    key = {"total": lambda s: s.total, "max": lambda s: s.max, "count": lambda s: s.count, "rows": lambda s: s.rows}[sort]
+    return [entry.as_dict() for entry in sorted(list(_stats.values()), key=key, reverse=True)[:limit]]
+
+def reset():
+    _stats.clear()
+
+class _Cursor(sqlite3.Cursor):
+    """Times a statement across execute and fetches and counts its rows"""
+
+    _statement = None
+    _parameters = None
+    _elapsed = 0.0
+    _fetched = 0
+
+    def _finish(self):
+        if self._statement is not None:
+            rows = max(self._fetched, self.rowcount)
+            record(self.connection.label, self.connection, self._statement, self._parameters, self._elapsed, rows)
+            self._statement = None
+
+    def execute(self, sql, parameters=()):
+        # A cursor can be reused; the previous statement is done once the next one starts
+        self._finish()
+        self._statement = sql
+        self._parameters = parameters
+        self._fetched = 0
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._elapsed = time.perf_counter() - started
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        seq_of_parameters = list(seq_of_parameters)
+        self._statement = sql
+        # The first set is enough to explain the statement
+        self._parameters = seq_of_parameters[0] if seq_of_parameters else ()
+        self._fetched = 0
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._elapsed = time.perf_counter() - started
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._elapsed += time.perf_counter() - started
+        if row is not None:
+            self._fetched += 1
+        return row
+
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        rows = super().fetchmany(*args)
+        self._elapsed += time.perf_counter() - started
+        self._fetched += len(rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._elapsed += time.perf_counter() - started
+        self._fetched += len(rows)
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+def connection_factory(pool: str):
+    """A sqlite3.Connection class for connect(factory=...) whose statements are recorded under pool"""
+
+    class _Connection(sqlite3.Connection):
+        label = pool
+
+        def cursor(self, factory=_Cursor):
+            return super().cursor(factory)
+
+        def commit(self):
+            if not self.in_transaction:
+                return super().commit()
+            started = time.perf_counter()
+            super().commit()
+            metrics.db_commits.labels().observe(time.perf_counter() - started)
+
+    return _Connection
@@ -0,0 +1,221 @@
+"""Retention policy: delete old rows in small chunks and give the space back.
+
+A policy is a comma separated list of rules, e.g.
+
+    sensordata=30d,sensor_rollup_1m=14d,sensor_rollup_1h=2y,sensordata:arduino_003=7d
+
+A rule without a device applies to every device that has no rule of its own
+for that table. Each chunk of rows is deleted in its own short transaction so
+the writer connection is never held for long, and freed pages are returned to
+the filesystem with PRAGMA incremental_vacuum (databases created with
+auto_vacuum=INCREMENTAL; see manage.py enable-incremental-vacuum). In
+segment mode (app/segments.py) sensordata rules drop whole segment files
+instead, once the newest reading in them has expired, and in either mode
+they drop archived chunks (app/archive.py) the same way. Readings are only
+deleted once they are in the rollups: sensordata rules run the rollup
+catch-up first and never delete above its high-water mark. Devices whose
+newest reading expired then get their device_latest entry recomputed.
+"""
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from sqlalchemy import and_, delete, not_, or_, select, tuple_
+from .models import DeviceLatest, SensorData, SensorRollup1d, SensorRollup1h, SensorRollup1m, WateringHistory
+from . import archive, rollups, segments
+from .ingest import refresh_device_latest
+from .versions import TABLES as VERSIONED_TABLES, versions
+
+logger = logging.getLogger(__name__)
+
+# Tables a policy may name, with the column that decides a row's age
+TABLES = {
+    "sensordata": (SensorData, SensorData.created_at),
+    "sensor_rollup_1m": (SensorRollup1m, SensorRollup1m.bucket_start),
+    "sensor_rollup_1h": (SensorRollup1h, SensorRollup1h.bucket_start),
+    "sensor_rollup_1d": (SensorRollup1d, SensorRollup1d.bucket_start),
+    "wateringhistory": (WateringHistory, WateringHistory.watering_started),
+}
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400, "y": 365 * 86400}
+
+# Pages returned to the filesystem per incremental_vacuum transaction
+VACUUM_STEP_PAGES = 1000
+
+@dataclass
+class RetentionRule:
+    table: str
+    max_age: timedelta
+    device_id: Optional[str] = None
+
+    def __str__(self):
+        target = f"{self.table}:{self.device_id}" if self.device_id else self.table
+        return f"{target}={int(self.max_age.total_seconds())}s"
+
+@dataclass
+class RetentionReport:
+    started_at: datetime
+    duration_s: float = 0.0
+    rows_purged: Dict[str, int] = field(default_factory=dict)
+    pages_reclaimed: int = 0
+
+def parse_duration(text: str) -> timedelta:
+    match = re.fullmatch(r"\s*(\d+)\s*([smhdwy])\s*", text)
+    if not match:
+        raise ValueError(f"Invalid age '{text}', expected e.g. 30d, 12h, 2y")
+    return timedelta(seconds=int(match.group(1)) * UNITS[match.group(2)])
+
+def parse_policy(spec: str) -> List[RetentionRule]:
+    rules = []
+    for entry in filter(None, (part.strip() for part in (spec or "").split(","))):
+        target, sep, age = entry.partition("=")
+        if not sep:
+            raise ValueError(f"Invalid retention rule '{entry}', expected table=age")
+        table, _, device_id = target.strip().partition(":")
+        if table not in TABLES:
+            raise ValueError(f"Unknown retention table '{table}', expected one of: {', '.join(TABLES)}")
+        rules.append(RetentionRule(table=table, max_age=parse_duration(age), device_id=device_id or None))
+    return rules
+
+def _condition(rule: RetentionRule, rules: List[RetentionRule], now: datetime):
+    model, column = TABLES[rule.table]
+    cutoff = now - rule.max_age
+    if column.type.python_type is int:
+        cutoff = rollups.epoch_seconds(cutoff)
+    conditions = [column < cutoff]
+    if rule.device_id:
+        conditions.append(model.device_id == rule.device_id)
+    else:
+        overridden = _overridden(rule, rules)
+        if overridden:
+            conditions.append(or_(model.device_id.is_(None), not_(model.device_id.in_(overridden))))
+    return and_(*conditions)
+
+def _overridden(rule: RetentionRule, rules: List[RetentionRule]) -> List[str]:
+    # Devices with their own rule for this table are handled by that rule
+    if rule.device_id:
+        return []
+    return [r.device_id for r in rules if r.table == rule.table and r.device_id]
+
+def _chunk_filter(model, condition, chunk_size: int):
+    # Rollup tables are WITHOUT ROWID, so chunks are picked by primary key
+    if model.__tablename__.startswith("sensor_rollup_"):
+        chunk = select(model.device_id, model.bucket_start).where(condition).limit(chunk_size)
+        return tuple_(model.device_id, model.bucket_start).in_(chunk)
+    return model.id.in_(select(model.id).where(condition).limit(chunk_size))
+
+def purge_rule(session_factory: Callable, rule: RetentionRule, rules: List[RetentionRule],
+               chunk_size: int, now: datetime) -> int:
+    """Delete the rows a rule expires, one committed chunk at a time; returns rows deleted"""
+    if rule.table != "sensordata":
+        return _purge_rows(session_factory, rule, _condition(rule, rules, now), chunk_size)
+    # Readings the rollups haven't counted yet would be lost from them for good
+    rollups.catch_up(session_factory)
+    with session_factory() as session:
+        high_water_mark = rollups.get_high_water_mark(session)
+    cutoff, overridden = now - rule.max_age, _overridden(rule, rules)
+    purged = archive.drop_expired(session_factory, cutoff, rule.device_id, overridden)
+    if segments.ENABLED:
+        purged += segments.drop_expired(session_factory, cutoff, rule.device_id, overridden)
+    else:
+        condition = and_(_condition(rule, rules, now), SensorData.id <= high_water_mark)
+        purged += _purge_rows(session_factory, rule, condition, chunk_size)
+    if purged:
+        versions.bump(rule.table, rule.device_id)
+        _refresh_expired_latest(session_factory, cutoff, rule.device_id, overridden)
+    return purged
+
+def _purge_rows(session_factory: Callable, rule: RetentionRule, condition, chunk_size: int) -> int:
+    model, _ = TABLES[rule.table]
+    stmt = (
+        delete(model)
+        .where(_chunk_filter(model, condition, chunk_size))
+        .execution_options(synchronize_session=False)
+    )
+    purged = 0
+    while True:
+        with session_factory() as session:
+            deleted = session.execute(stmt).rowcount
+            session.commit()
+        if deleted and rule.table in VERSIONED_TABLES:
+            versions.bump(rule.table, rule.device_id)
+        purged += deleted
+        if deleted < chunk_size:
+            return purged
+
+def _refresh_expired_latest(session_factory: Callable, cutoff: datetime, device_id: Optional[str], excluded: List[str]):
+    # A device_latest entry older than the cutoff points at the device's newest reading, which was just purged
+    conditions = [DeviceLatest.created_at < cutoff]
+    if device_id:
+        conditions.append(DeviceLatest.device_id == device_id)
+    elif excluded:
+        conditions.append(not_(DeviceLatest.device_id.in_(excluded)))
+    with session_factory() as session:
+        for entry in session.execute(select(DeviceLatest).where(*conditions)).scalars().all():
+            if segments.ENABLED:
+                if segments.get_reading(session, entry.sensor_data_id) is None and archive.get_reading(session, entry.sensor_data_id) is None:
+                    session.delete(entry)
+            else:
+                refresh_device_latest(session, entry.device_id)
+        session.commit()
+
+def incremental_vacuum(session_factory: Callable, step_pages: int = VACUUM_STEP_PAGES) -> int:
+    """Return free pages to the filesystem in bounded steps; returns pages reclaimed"""
+    reclaimed = 0
+    while True:
+        with session_factory() as session:
+            conn = session.connection()
+            if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+                return reclaimed
+            free = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if not free:
+                return reclaimed
+            step = min(free, step_pages)
+            # sqlite3 steps a statement that returns no rows only once, and
+            # incremental_vacuum frees a single page per step
+            for _ in range(step):
+                conn.exec_driver_sql("PRAGMA incremental_vacuum(1)")
+            session.commit()
+        reclaimed += step
+        if step < step_pages:
+            return reclaimed
+
+class RetentionEngine:
+    """Applies a retention policy and keeps a report of the last run"""
+
+    def __init__(self, session_factory: Callable, rules: List[RetentionRule], chunk_size: int = 500):
+        self.session_factory = session_factory
+        self.rules = rules
+        self.chunk_size = max(1, chunk_size)
+        self.last_report: Optional[RetentionReport] = None
+        self.total_rows_purged = 0
+        self.runs = 0
+
+    def run(self, now: Optional[datetime] = None) -> RetentionReport:
+        now = now or datetime.utcnow()
+        report = RetentionReport(started_at=now)
+        started = time.perf_counter()
+        for rule in self.rules:
+            purged = purge_rule(self.session_factory, rule, self.rules, self.chunk_size, now)
+            report.rows_purged[rule.table] = report.rows_purged.get(rule.table, 0) + purged
+        report.pages_reclaimed = incremental_vacuum(self.session_factory)
+        report.duration_s = round(time.perf_counter() - started, 3)
+
+        self.runs += 1
+        self.total_rows_purged += sum(report.rows_purged.values())
+        self.last_report = report
+        logger.info(
+            "Retention purged %s rows (%s) and reclaimed %s pages in %.3fs",
+            sum(report.rows_purged.values()), report.rows_purged, report.pages_reclaimed, report.duration_s,
+        )
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": [str(rule) for rule in self.rules],
+            "runs": self.runs,
+            "total_rows_purged": self.total_rows_purged,
+            "last_run": vars(self.last_report) if self.last_report else None,
+        }
@@ -0,0 +1,236 @@
+"""1-minute, 1-hour and 1-day rollups of SensorData.
+
+Readings are added to the rollups in the same transaction that inserts them
+(see insert_sensor_rows). rollup_state keeps a high-water mark on
+SensorData.id: every reading with id <= the mark is included in the rollups.
+Rows the ingest path could not roll up, such as readings that existed before
+the rollup tables did, are picked up by catch_up(), which runs in the
+background. rebuild() recomputes all rollups from the raw table, or from
+the segment files in segment mode (app/segments.py), and from the archived
+chunks (app/archive.py).
+
+Editing or deleting a reading through the API moves it between buckets in
+the same transaction (apply_change). Counts and sums are adjusted exactly;
+a bucket's minimum or maximum that came from the old value is recomputed
+from the readings still stored in the bucket, so it can't account for ones
+retention has already deleted.
+"""
+from datetime import datetime, timedelta
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type
+from sqlalchemy import delete, func, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select
+from .queries import SENSOR_DATA_FIELDS, ReadingFilter
+from .models import RollupState, SensorData, SensorRollup1d, SensorRollup1h, SensorRollup1m, SensorRollupBase
+from . import archive, segments
+
+# Finest first
+RESOLUTIONS: List[Tuple[str, int, Type[SensorRollupBase]]] = [
+    ("1m", 60, SensorRollup1m),
+    ("1h", 60 * 60, SensorRollup1h),
+    ("1d", 24 * 60 * 60, SensorRollup1d),
+]
+
+HIGH_WATER_MARK = "high_water_mark"
+CATCH_UP_CHUNK = 5000
+
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+
+ROW_COLUMNS = (
+    SensorData.id, SensorData.device_id, SensorData.created_at,
+    SensorData.temperature, SensorData.humidity, SensorData.lux, SensorData.pump_active,
+)
+
+def epoch_seconds(value: datetime) -> int:
+    return (value - EPOCH) // ONE_SECOND
+
+def rollup_for(bucket_seconds: int) -> Optional[Tuple[str, Type[SensorRollupBase]]]:
+    """Coarsest rollup whose buckets tile a bucket of the given width"""
+    best = None
+    for name, seconds, model in RESOLUTIONS:
+        if seconds <= bucket_seconds and bucket_seconds % seconds == 0:
+            best = (name, model)
+    return best
+
+def _accumulate(rows: Iterable[Dict[str, Any]]) -> Dict[Type[SensorRollupBase], Dict[Tuple[str, int], Dict[str, Any]]]:
+    groups: Dict[Type[SensorRollupBase], Dict[Tuple[str, int], Dict[str, Any]]] = {model: {} for _, _, model in RESOLUTIONS}
+    for row in rows:
+        device_id = row["device_id"] or ""
+        ts = epoch_seconds(row["created_at"])
+        t, h, l = row["temperature"], row["humidity"], row["lux"]
+        pump = 1 if row["pump_active"] else 0
+        for _, seconds, model in RESOLUTIONS:
+            key = (device_id, ts - ts % seconds)
+            agg = groups[model].get(key)
+            if agg is None:
+                groups[model][key] = {
+                    "device_id": key[0], "bucket_start": key[1], "count": 1,
+                    "temperature_sum": t, "temperature_min": t, "temperature_max": t,
+                    "humidity_sum": h, "humidity_min": h, "humidity_max": h,
+                    "lux_sum": l, "lux_min": l, "lux_max": l,
+                    "pump_on": pump,
+                }
+                continue
+            agg["count"] += 1
+            agg["pump_on"] += pump
+            for name, value in (("temperature", t), ("humidity", h), ("lux", l)):
+                agg[f"{name}_sum"] += value
+                agg[f"{name}_min"] = min(agg[f"{name}_min"], value)
+                agg[f"{name}_max"] = max(agg[f"{name}_max"], value)
+    return groups
+
+def _merge(session: Session, rows: Iterable[Dict[str, Any]]):
+    for model, buckets in _accumulate(rows).items():
+        if not buckets:
+            continue
+        stmt = sqlite_insert(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[model.device_id, model.bucket_start],
+            set_={
+                "count": model.count + stmt.excluded.count,
+                "pump_on": model.pump_on + stmt.excluded.pump_on,
+                **{
+                    column: getattr(model, column) + stmt.excluded[column]
+                    for column in ("temperature_sum", "humidity_sum", "lux_sum")
+                },
+                **{
+                    column: func.min(getattr(model, column), stmt.excluded[column])
+                    for column in ("temperature_min", "humidity_min", "lux_min")
+                },
+                **{
+                    column: func.max(getattr(model, column), stmt.excluded[column])
+                    for column in ("temperature_max", "humidity_max", "lux_max")
+                },
+            },
+        )
+        session.execute(stmt, list(buckets.values()))
+
+def get_high_water_mark(session: Session) -> int:
+    state = session.get(RollupState, HIGH_WATER_MARK)
+    return state.value if state else 0
+
+def _set_high_water_mark(session: Session, value: int):
+    session.execute(
+        update(RollupState).where(RollupState.name == HIGH_WATER_MARK).values(value=func.max(RollupState.value, value))
+    )
+
+def apply_rows(session: Session, rows: List[Dict[str, Any]], ids: List[int]):
+    """Roll up freshly inserted rows inside the ingest transaction.
+
+    Skipped when older readings are still waiting for catch_up(), because
+    moving the high-water mark past them would leave them out for good.
+    """
+    if not ids:
+        return
+    if min(ids) > get_high_water_mark(session) + 1:
+        return
+    _merge(session, rows)
+    _set_high_water_mark(session, max(ids))
+
+MEASURES = ("temperature", "humidity", "lux")
+
+def apply_change(session: Session, old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]):
+    """Replace a rolled-up reading's old values with its new ones; new is None when it was deleted.
+
+    Call it after the change is flushed. Readings above the high-water mark
+    are left to catch_up(), which will see them as they are now.
+    """
+    if old["id"] > get_high_water_mark(session):
+        return
+    _subtract(session, old)
+    if new is not None:
+        _merge(session, [new])
+
+def _subtract(session: Session, row: Dict[str, Any]):
+    device_id = row["device_id"] or ""
+    ts = epoch_seconds(row["created_at"])
+    for _, seconds, model in RESOLUTIONS:
+        bucket_start = ts - ts % seconds
+        bucket = session.get(model, (device_id, bucket_start))
+        if bucket is None:
+            continue
+        if bucket.count <= 1:
+            session.delete(bucket)
+            continue
+        bucket.count -= 1
+        bucket.pump_on -= 1 if row["pump_active"] else 0
+        stale = []
+        for name in MEASURES:
+            value = row[name]
+            setattr(bucket, f"{name}_sum", getattr(bucket, f"{name}_sum") - value)
+            if value <= getattr(bucket, f"{name}_min") or value >= getattr(bucket, f"{name}_max"):
+                stale.append(name)
+        if stale:
+            extremes = _extremes(session, device_id, bucket_start, seconds, row["id"], stale)
+            for name, (low, high) in extremes.items():
+                setattr(bucket, f"{name}_min", low)
+                setattr(bucket, f"{name}_max", high)
+        session.add(bucket)
+    session.flush()
+
+def _extremes(session: Session, device_id: str, bucket_start: int, seconds: int, exclude_id: int,
+              names: List[str]) -> Dict[str, Tuple[float, float]]:
+    """Minimum and maximum of the stored readings in a bucket, other than exclude_id"""
+    start = EPOCH + timedelta(seconds=bucket_start)
+    end = start + timedelta(seconds=seconds)
+    stmt = (
+        select(*(getattr(SensorData, name) for name in names))
+        .where(SensorData.device_id == device_id if device_id else SensorData.device_id.is_(None))
+        .where(SensorData.created_at >= start, SensorData.created_at < end)
+        .where(SensorData.id <= get_high_water_mark(session), SensorData.id != exclude_id)
+    )
+    values = [tuple(row) for row in session.execute(stmt)]
+    for row in archive.read_rows(session, ReadingFilter(device_id=device_id or None, start=start, end=end)):
+        reading = dict(zip(SENSOR_DATA_FIELDS, row))
+        if (reading["device_id"] or "") == device_id:
+            values.append(tuple(reading[name] for name in names))
+    if not values:
+        return {}
+    return {name: (min(column), max(column)) for name, column in zip(names, zip(*values))}
+
+def catch_up(session_factory: Callable, chunk_size: int = CATCH_UP_CHUNK, max_chunks: Optional[int] = None) -> bool:
+    """Roll up readings above the high-water mark, one committed chunk at a time.
+
+    Returns True if readings are left over after max_chunks.
+    """
+    chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        with session_factory() as session:
+            mark = get_high_water_mark(session)
+            if segments.ENABLED:
+                result = segments.rows_after(session, mark, chunk_size)
+            else:
+                result = session.execute(
+                    select(*ROW_COLUMNS).where(SensorData.id > mark).order_by(SensorData.id).limit(chunk_size)
+                ).mappings().all()
+            archived = archive.rows_after(session, mark, chunk_size)
+            if archived:
+                result = sorted([*result, *archived], key=itemgetter("id"))[:chunk_size]
+            if not result:
+                return False
+            _merge(session, result)
+            _set_high_water_mark(session, result[-1]["id"])
+            session.commit()
+        chunks += 1
+        if len(result) < chunk_size:
+            return False
+    return True
+
+def rebuild(session_factory: Callable, chunk_size: int = CATCH_UP_CHUNK) -> int:
+    """Drop every rollup and recompute them from the raw readings; returns the high-water mark"""
+    with session_factory() as session:
+        for _, _, model in RESOLUTIONS:
+            session.execute(delete(model))
+        session.execute(update(RollupState).where(RollupState.name == HIGH_WATER_MARK).values(value=0))
+        session.commit()
+    catch_up(session_factory, chunk_size)
+    with session_factory() as session:
+        return get_high_water_mark(session)
+
+def is_current(session: Session) -> bool:
+    """True when every stored reading is included in the rollups"""
+    max_id = segments.max_id(session) if segments.ENABLED else session.exec(select(func.max(SensorData.id))).one()
+    max_id = max(filter(None, (max_id, archive.max_id(session))), default=None)
+    return max_id is None or max_id <= get_high_water_mark(session)
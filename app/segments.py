@@ -0,0 +1,659 @@
+"""Append-only segment files for raw readings (PI_SENSOR_READING_STORE=segments).
+
+A reading is a few numbers, but as a sensordata row it also pays for a
+record header, three index entries and the B-tree pages that hold them. In
+segment mode each device's readings are appended as fixed-width RECORDs to
+files in SEGMENT_DIR instead, and SQLite keeps the metadata: a
+reading_segment row per file with its device, record count and the range of
+ids and created_at it covers, and the firmware version / sensor type pairs
+in reading_tag. A device starts a new segment after PI_SENSOR_SEGMENT_RECORDS
+readings or PI_SENSOR_SEGMENT_SPAN_S seconds.
+
+Records are written inside the caller's write transaction, at the offset of
+the segment's committed count, and the count is raised in the same
+transaction. Nothing past the count is ever read, so a rolled back append is
+invisible and the next one overwrites it. Files are synced before the commit
+only with PI_SENSOR_SYNCHRONOUS=FULL or EXTRA; otherwise, as with SQLite, a
+power cut may cost the newest readings.
+
+Within a segment ids increase and created_at never decreases (a reading that
+lost the race for the write lock takes its predecessor's created_at), so a
+time range is two binary searches over the memory-mapped file and a zero-copy
+slice between them. Results from several segments are merged by (created_at,
+id), and a segment is only opened once it can hold the next row.
+
+A reading is a duplicate when its device timestamp matches one of the
+device's last DEDUP_WINDOW readings, which the writing process keeps in
+memory. That covers resends and replayed batches, but unlike the unique key
+on sensordata not a timestamp repeated weeks later.
+
+Readings can't be edited or deleted one at a time; retention drops whole
+segments once their newest reading has expired.
+"""
+import heapq
+import itertools
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from sqlalchemy import Result, Row, delete, event, func, not_, or_, select
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session
+from .config import settings
+from .db import DATABASE_PATH, get_read_session
+from .models import ReadingChunk, ReadingSegment, ReadingTag, RollupState, SensorData
+from .queries import DEFAULT_PAGE_SIZE, SENSOR_DATA_COLUMNS, SENSOR_DATA_FIELDS, ReadingFilter, decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+STORES = {"sqlite", "segments"}
+if settings.reading_store not in STORES:
+    raise ValueError(f"Unsupported PI_SENSOR_READING_STORE: {settings.reading_store}")
+
+ENABLED = settings.reading_store == "segments"
+
+SEGMENT_DIR = os.path.abspath(settings.segment_dir or DATABASE_PATH + "-segments")
+SEGMENT_RECORDS = max(1, settings.segment_records)
+SEGMENT_SPAN_US = max(1, settings.segment_span_s) * 1_000_000
+SYNC_FILES = settings.synchronous in ("FULL", "EXTRA")
+
+# id, created_at (microseconds since the epoch), device timestamp, temperature, humidity, lux,
+# reading_tag id, pump_active, three spare bytes
+RECORD = struct.Struct("<qqqdddI?3x")
+SIZE = RECORD.size
+# Leading fields only: (id, created_at) for searches, (id, device timestamp) for the dedup window
+_HEAD = struct.Struct("<qq")
+_KEY = struct.Struct(f"<q8xq{SIZE - 24}x")
+
+# A device's readings checked for a repeated device timestamp; covers a replayed batch
+DEDUP_WINDOW = 4096
+# Segment files kept mapped per process, and how much of a file is mapped at a time
+MAX_MAPS = 256
+MAP_GRAIN = 1 << 16
+# Seconds between checks for mapped files that have been dropped
+SWEEP_INTERVAL_S = 60
+# Records decoded first when walking a segment backwards; a page often needs only a few
+FIRST_BLOCK = 16
+# Records decoded at a time while walking a segment
+BLOCK = 256
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+SEGMENT_COLUMNS = (
+    ReadingSegment.id, ReadingSegment.device_id, ReadingSegment.count,
+    ReadingSegment.first_id, ReadingSegment.last_id,
+    ReadingSegment.first_created_at, ReadingSegment.last_created_at,
+)
+
+def micros(value: datetime) -> int:
+    return (value - EPOCH) // ONE_MICROSECOND
+
+def from_micros(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+def segment_path(segment_id: int) -> str:
+    return os.path.join(SEGMENT_DIR, f"{segment_id:08d}.seg")
+
+def _device(device_id: Optional[str]):
+    return ReadingSegment.device_id.is_(None) if device_id is None else ReadingSegment.device_id == device_id
+
+# ------------------ Reading ------------------
+_maps: "OrderedDict[int, mmap.mmap]" = OrderedDict()
+_maps_lock = threading.Lock()
+_swept_at = 0.0
+
+def _view(segment_id: int, count: int) -> memoryview:
+    """The first count records of a segment file, memory-mapped"""
+    mapped = _maps.get(segment_id)
+    if mapped is None or len(mapped) < count * SIZE:
+        mapped = _map(segment_id, count)
+        if mapped is None:
+            return memoryview(b"")
+    else:
+        try:
+            _maps.move_to_end(segment_id)
+        except KeyError:
+            pass
+    # A file cut short by a crash only has the records that reached the disk
+    return memoryview(mapped)[:min(count, len(mapped) // SIZE) * SIZE]
+
+def _map(segment_id: int, count: int) -> Optional[mmap.mmap]:
+    """Map at least count records; the newest segments are mapped again as they grow"""
+    global _swept_at
+    try:
+        fd = os.open(segment_path(segment_id), os.O_RDONLY)
+    except FileNotFoundError:
+        # Dropped by retention since the caller read the index
+        return None
+    try:
+        size = min(os.fstat(fd).st_size, -(-count * SIZE // MAP_GRAIN) * MAP_GRAIN)
+        mapped = mmap.mmap(fd, size, access=mmap.ACCESS_READ) if size else None
+    finally:
+        os.close(fd)
+    with _maps_lock:
+        # A mapped file keeps its disk space, so let go of files dropped since,
+        # by this process or another. Views handed out keep their map alive.
+        now = time.monotonic()
+        if now - _swept_at >= SWEEP_INTERVAL_S:
+            _swept_at = now
+            for stale in [key for key in _maps if not os.path.exists(segment_path(key))]:
+                del _maps[stale]
+        while len(_maps) >= MAX_MAPS:
+            _maps.popitem(last=False)
+        if mapped is not None:
+            _maps[segment_id] = mapped
+            _maps.move_to_end(segment_id)
+    return mapped
+
+def _bisect(view: memoryview, key: Tuple[int, int]) -> int:
+    """Number of records whose (created_at, id) sorts before key"""
+    lo, hi = 0, len(view) // SIZE
+    while lo < hi:
+        mid = (lo + hi) // 2
+        row_id, created_at = _HEAD.unpack_from(view, mid * SIZE)
+        if (created_at, row_id) < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def _bisect_id(view: memoryview, row_id: int) -> int:
+    """Number of records with an id below row_id"""
+    lo, hi = 0, len(view) // SIZE
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _HEAD.unpack_from(view, mid * SIZE)[0] < row_id:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+_tag_names: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+
+def _tags(session: Session) -> Dict[int, Tuple[Optional[str], Optional[str]]]:
+    """reading_tag as {id: (firmware_version, sensor_type)}; tags never change, so only new ones are loaded"""
+    newest = max(_tag_names, default=0)
+    for tag_id, firmware_version, sensor_type in session.execute(
+        select(ReadingTag.id, ReadingTag.firmware_version, ReadingTag.sensor_type).where(ReadingTag.id > newest)
+    ):
+        _tag_names[tag_id] = (firmware_version, sensor_type)
+    return _tag_names
+
+def _row(record: tuple, device_id: Optional[str], tags: Dict[int, Tuple[Optional[str], Optional[str]]]) -> tuple:
+    """A record as a row tuple in SENSOR_DATA_FIELDS order"""
+    row_id, created_at, timestamp, temperature, humidity, lux, tag, pump_active = record
+    firmware_version, sensor_type = tags[tag]
+    return (
+        temperature, humidity, lux, pump_active, timestamp,
+        device_id, firmware_version, sensor_type, row_id, from_micros(created_at),
+    )
+
+def _walk(segment: Row, tags: Dict, low: Optional[Tuple[int, int]], high: Optional[Tuple[int, int]],
+          pump_active: Optional[bool], allowed_tags: Optional[set], descending: bool) -> Iterator[Tuple[int, int, tuple]]:
+    """(created_at, id, row) for a segment's matching records with low <= (created_at, id) < high"""
+    view = _view(segment.id, segment.count)
+    lo = _bisect(view, low) if low else 0
+    hi = _bisect(view, high) if high else len(view) // SIZE
+    device_id = segment.device_id
+    if descending:
+        ends = [hi]
+        size = FIRST_BLOCK
+        while ends[-1] > lo:
+            ends.append(max(lo, ends[-1] - size))
+            size = min(size * 2, BLOCK)
+        blocks = [(start, end) for end, start in zip(ends, ends[1:])]
+    else:
+        blocks = [(start, min(start + BLOCK, hi)) for start in range(lo, hi, BLOCK)]
+    for start, end in blocks:
+        block = RECORD.iter_unpack(view[start * SIZE:end * SIZE])
+        if descending:
+            block = reversed(list(block))
+        for record in block:
+            if pump_active is not None and record[7] != pump_active:
+                continue
+            if allowed_tags is not None and record[6] not in allowed_tags:
+                continue
+            yield record[1], record[0], _row(record, device_id, tags)
+
+def _walk_ids(segment: Row, tags: Dict, after: int) -> Iterator[Tuple[int, int, tuple]]:
+    """(id, 0, row) for a segment's records with an id above after"""
+    view = _view(segment.id, segment.count)
+    start = _bisect_id(view, after + 1)
+    for record in RECORD.iter_unpack(view[start * SIZE:]):
+        yield record[0], 0, _row(record, segment.device_id, tags)
+
+def merge(sources: Iterable[Tuple[Tuple[int, int], Callable[[], Iterator]]], descending: bool = False) -> Iterator[tuple]:
+    """Rows of several sorted sources as one sorted stream.
+
+    A source is (bound, walk): the smallest key it can produce (largest when
+    descending) and a function that starts walking it. Sources come in bound
+    order and are only taken, and started, once their bound could be next, so
+    a page from a long history touches the few segments it needs.
+    """
+    sign = -1 if descending else 1
+    pending = iter(sources)
+    upcoming = next(pending, None)
+    heap: List[tuple] = []
+    order = itertools.count()
+    while True:
+        while upcoming is not None and (not heap or (sign * upcoming[0][0], sign * upcoming[0][1]) <= heap[0][:2]):
+            rows = upcoming[1]()
+            upcoming = next(pending, None)
+            first = next(rows, None)
+            if first is not None:
+                heapq.heappush(heap, (sign * first[0], sign * first[1], next(order), first[2], rows))
+        if not heap:
+            return
+        row, rows = heap[0][3], heap[0][4]
+        yield row
+        following = next(rows, None)
+        if following is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (sign * following[0], sign * following[1], next(order), following[2], rows))
+
+def _segments(session: Session, reading_filter: ReadingFilter, descending: bool = False,
+              before: Optional[Tuple[int, int]] = None) -> Result:
+    """Index entries of the segments that can hold readings matching the filter, in merge's bound order"""
+    if descending:
+        stmt = select(*SEGMENT_COLUMNS).order_by(ReadingSegment.last_created_at.desc(), ReadingSegment.last_id.desc())
+    else:
+        stmt = select(*SEGMENT_COLUMNS).order_by(ReadingSegment.first_created_at, ReadingSegment.first_id)
+    if reading_filter.device_id:
+        stmt = stmt.where(ReadingSegment.device_id == reading_filter.device_id)
+    if reading_filter.start:
+        stmt = stmt.where(ReadingSegment.last_created_at >= micros(reading_filter.start))
+    if reading_filter.end:
+        stmt = stmt.where(ReadingSegment.first_created_at < micros(reading_filter.end))
+    if before:
+        stmt = stmt.where(ReadingSegment.first_created_at <= before[0])
+    # Through Core, since ORM execution would fetch every row up front
+    return session.connection().execute(stmt)
+
+def _sources(segments: Iterable[Row], tags: Dict, reading_filter: ReadingFilter, descending: bool,
+             before: Optional[Tuple[int, int]] = None) -> Iterator[Tuple[Tuple[int, int], Callable[[], Iterator]]]:
+    low = (micros(reading_filter.start), 0) if reading_filter.start else None
+    high = (micros(reading_filter.end), 0) if reading_filter.end else None
+    if before and (high is None or before < high):
+        high = before
+    allowed_tags = None
+    if reading_filter.firmware_version or reading_filter.sensor_type:
+        allowed_tags = {
+            tag for tag, (firmware_version, sensor_type) in tags.items()
+            if (not reading_filter.firmware_version or firmware_version == reading_filter.firmware_version)
+            and (not reading_filter.sensor_type or sensor_type == reading_filter.sensor_type)
+        }
+    for segment in segments:
+        bound = (segment.last_created_at, segment.last_id) if descending else (segment.first_created_at, segment.first_id)
+        yield bound, partial(_walk, segment, tags, low, high, reading_filter.pump_active, allowed_tags, descending)
+
+def list_page(
+    session: Session,
+    reading_filter: ReadingFilter,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Tuple[List[tuple], Optional[str]]:
+    """One page of readings, newest first, with the same cursors as queries.list_sensor_data_page"""
+    before = None
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        before = (micros(created_at), row_id)
+    tags = _tags(session)
+    # The index is read as the merge needs segments, so the newest page reads a few entries
+    sources = _sources(_segments(session, reading_filter, True, before), tags, reading_filter, True, before)
+    rows = list(itertools.islice(merge(sources, descending=True), limit + 1))
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][9], rows[-1][8])
+
+def read_rows(session: Session, reading_filter: ReadingFilter) -> Iterator[tuple]:
+    """Every matching reading, oldest first; the index is read now and the files as the rows are consumed"""
+    tags = _tags(session)
+    return merge(_sources(_segments(session, reading_filter).all(), tags, reading_filter, False))
+
+def iter_rows(reading_filter: ReadingFilter, chunk_size: int) -> Iterator[List[tuple]]:
+    """Lists of row tuples, oldest first, for streaming.
+
+    Records below the committed counts never change, so the read connection
+    is only needed for the index and goes back to the pool before the first row.
+    """
+    with get_read_session() as session:
+        rows = read_rows(session, reading_filter)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def get_reading(session: Session, sensor_id: int) -> Optional[SensorData]:
+    candidates = session.execute(
+        select(*SEGMENT_COLUMNS)
+        .where(ReadingSegment.last_id >= sensor_id)
+        .where(ReadingSegment.first_id <= sensor_id)
+    ).all()
+    for segment in candidates:
+        view = _view(segment.id, segment.count)
+        position = _bisect_id(view, sensor_id)
+        if position < len(view) // SIZE:
+            record = RECORD.unpack_from(view, position * SIZE)
+            if record[0] == sensor_id:
+                tags = _tag_names if record[6] in _tag_names else _tags(session)
+                # The record's values already have the field types; skip validation like session.get does
+                return SensorData.model_construct(**dict(zip(SENSOR_DATA_FIELDS, _row(record, segment.device_id, tags))))
+    return None
+
+def rows_after(session: Session, after: int, limit: int) -> List[Dict[str, Any]]:
+    """Up to limit readings with an id above after, in id order, as mappings like sensordata rows"""
+    tags = _tags(session)
+    segments = session.connection().execute(
+        select(*SEGMENT_COLUMNS).where(ReadingSegment.last_id > after).order_by(ReadingSegment.first_id)
+    )
+    sources = [((segment.first_id, 0), partial(_walk_ids, segment, tags, after)) for segment in segments]
+    return [dict(zip(SENSOR_DATA_FIELDS, row)) for row in itertools.islice(merge(sources), limit)]
+
+def max_id(session: Session) -> Optional[int]:
+    return session.execute(select(func.max(ReadingSegment.last_id))).scalar()
+
+# ------------------ Writing ------------------
+# Per device, device timestamp -> id of its last DEDUP_WINDOW readings as committed, with the
+# (segment id, count) of its newest segment they reflect. Filled by the process that writes.
+_windows: Dict[Optional[str], Tuple[Tuple[int, int], "OrderedDict[int, int]"]] = {}
+# session.info key for window updates that apply once the transaction commits
+_PENDING = "segment_windows"
+
+def _newest(session: Session, device_id: Optional[str]) -> Optional[ReadingSegment]:
+    return session.execute(
+        select(ReadingSegment)
+        .where(_device(device_id))
+        .order_by(ReadingSegment.id.desc())
+        .limit(1)
+        .execution_options(populate_existing=True)
+    ).scalars().first()
+
+def _segment_key(segment: Optional[ReadingSegment]) -> Optional[Tuple[int, int]]:
+    return (segment.id, segment.count) if segment is not None else None
+
+def _load_window(session: Session, device_id: str) -> "OrderedDict[int, int]":
+    """The device's last DEDUP_WINDOW readings, read back from its newest segments"""
+    parts = []
+    needed = DEDUP_WINDOW
+    for segment_id, count in session.execute(
+        select(ReadingSegment.id, ReadingSegment.count).where(_device(device_id)).order_by(ReadingSegment.id.desc())
+    ):
+        view = _view(segment_id, count)
+        take = min(needed, len(view) // SIZE)
+        parts.append(view[len(view) - take * SIZE:])
+        needed -= take
+        if not needed:
+            break
+    window: "OrderedDict[int, int]" = OrderedDict()
+    for part in reversed(parts):
+        for row_id, timestamp in _KEY.iter_unpack(part):
+            window[timestamp] = row_id
+    return window
+
+def _window(session: Session, device_id: str, newest: Optional[ReadingSegment]) -> Tuple["OrderedDict[int, int]", bool]:
+    """The device's dedup window and whether it had to be read back from the files"""
+    cached = _windows.get(device_id)
+    if cached is not None and cached[0] == _segment_key(newest):
+        return cached[1], False
+    return _load_window(session, device_id), True
+
+@event.listens_for(OrmSession, "after_commit")
+def _commit_windows(session: OrmSession):
+    for device_id, before, appended, after, loaded in session.info.pop(_PENDING, ()):
+        if loaded is not None:
+            window = loaded
+        else:
+            cached = _windows.get(device_id)
+            if cached is None or cached[0] != before:
+                # Changed under us; read back on next use
+                _windows.pop(device_id, None)
+                continue
+            window = cached[1]
+        window.update(appended)
+        while len(window) > DEDUP_WINDOW:
+            window.popitem(last=False)
+        _windows[device_id] = (after, window)
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_windows(session: OrmSession):
+    session.info.pop(_PENDING, None)
+
+def _next_id(session: Session) -> int:
+    # Ids carry on from sensordata, so readings moved over keep theirs, from archived
+    # chunks, and from the rollups' high-water mark, so they aren't reused once retention
+    # drops the newest segment
+    newest = session.execute(select(func.max(
+        func.coalesce(select(func.max(ReadingSegment.last_id)).scalar_subquery(), 0),
+        func.coalesce(select(func.max(ReadingChunk.last_id)).scalar_subquery(), 0),
+        func.coalesce(select(func.max(SensorData.id)).scalar_subquery(), 0),
+        func.coalesce(select(RollupState.value).where(RollupState.name == "high_water_mark").scalar_subquery(), 0),
+    ))).scalar()
+    return newest + 1
+
+def _tag_id(session: Session, firmware_version: Optional[str], sensor_type: Optional[str]) -> int:
+    tag_id = session.execute(
+        select(ReadingTag.id)
+        .where(ReadingTag.firmware_version.is_(firmware_version))
+        .where(ReadingTag.sensor_type.is_(sensor_type))
+    ).scalar()
+    if tag_id is None:
+        tag = ReadingTag(firmware_version=firmware_version, sensor_type=sensor_type)
+        session.add(tag)
+        session.flush()
+        tag_id = tag.id
+    return tag_id
+
+def _start_segment(session: Session, device_id: Optional[str], row_id: int, created_at: int) -> ReadingSegment:
+    segment = ReadingSegment(
+        device_id=device_id, count=0,
+        first_id=row_id, last_id=row_id, first_created_at=created_at, last_created_at=created_at,
+    )
+    session.add(segment)
+    session.flush()
+    os.makedirs(SEGMENT_DIR, exist_ok=True)
+    # Sized for a full segment up front, sparse until written, so readers map it once
+    fd = os.open(segment_path(segment.id), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, SEGMENT_RECORDS * SIZE)
+    finally:
+        os.close(fd)
+    return segment
+
+def _write(segment: Optional[ReadingSegment], records: List[bytes]):
+    if not records:
+        return
+    fd = os.open(segment_path(segment.id), os.O_WRONLY)
+    try:
+        os.pwrite(fd, b"".join(records), segment.count * SIZE)
+        if SYNC_FILES:
+            os.fdatasync(fd)
+    finally:
+        os.close(fd)
+    segment.count += len(records)
+
+def _append(session: Session, device_id: Optional[str], segment: Optional[ReadingSegment],
+            rows: List[Dict[str, Any]], ids: List[int], tags: Dict[Tuple[Optional[str], Optional[str]], int]) -> ReadingSegment:
+    """Write one device's rows after the given segment (a new one if None); returns its newest segment"""
+    records: List[bytes] = []
+    for row, row_id in zip(rows, ids):
+        created_at = micros(row["created_at"])
+        if segment is not None and created_at < segment.last_created_at:
+            created_at = segment.last_created_at
+            row["created_at"] = from_micros(created_at)
+        if (
+            segment is None
+            or segment.count + len(records) >= SEGMENT_RECORDS
+            or created_at - segment.first_created_at >= SEGMENT_SPAN_US
+        ):
+            _write(segment, records)
+            records = []
+            segment = _start_segment(session, device_id, row_id, created_at)
+        tag_key = (row["firmware_version"], row["sensor_type"])
+        tag = tags.get(tag_key)
+        if tag is None:
+            tag = tags[tag_key] = _tag_id(session, *tag_key)
+        records.append(RECORD.pack(
+            row_id, created_at, row["timestamp"], row["temperature"], row["humidity"], row["lux"], tag, row["pump_active"],
+        ))
+        segment.last_id = row_id
+        segment.last_created_at = created_at
+    _write(segment, records)
+    return segment
+
+def append_rows(session: Session, rows: List[Dict[str, Any]]) -> Tuple[List[int], List[int]]:
+    """Append rows to their devices' newest segments; returns (ids, duplicate positions).
+
+    Matches the INSERT in insert_sensor_rows: ids follow the order of rows, a
+    duplicate gets the id of the reading already stored, rows without a
+    device are never duplicates, and nothing is committed here. A row's
+    created_at is moved up if it would sort before its device's last reading.
+    """
+    devices: Dict[Optional[str], List[int]] = {}
+    for position, row in enumerate(rows):
+        devices.setdefault(row["device_id"], []).append(position)
+
+    ids: List[Optional[int]] = [None] * len(rows)
+    duplicates = []
+    repeats: Dict[int, int] = {}
+    newest: Dict[Optional[str], Optional[ReadingSegment]] = {}
+    windows: Dict[str, Tuple["OrderedDict[int, int]", bool]] = {}
+    for device_id, positions in devices.items():
+        newest[device_id] = _newest(session, device_id)
+        if device_id is None:
+            continue
+        window, loaded = windows[device_id] = _window(session, device_id, newest[device_id])
+        first: Dict[int, int] = {}
+        for position in positions:
+            timestamp = rows[position]["timestamp"]
+            if timestamp in window:
+                ids[position] = window[timestamp]
+                duplicates.append(position)
+            elif timestamp in first:
+                repeats[position] = first[timestamp]
+                duplicates.append(position)
+            else:
+                first[timestamp] = position
+
+    duplicates.sort()
+    skipped = set(duplicates)
+    next_id = _next_id(session)
+    for position in range(len(rows)):
+        if position not in skipped:
+            ids[position] = next_id
+            next_id += 1
+    for position, original in repeats.items():
+        ids[position] = ids[original]
+
+    tags: Dict[Tuple[Optional[str], Optional[str]], int] = {}
+    for device_id, positions in devices.items():
+        kept = [position for position in positions if position not in skipped]
+        if not kept:
+            continue
+        before = _segment_key(newest[device_id])
+        segment = _append(session, device_id, newest[device_id], [rows[p] for p in kept], [ids[p] for p in kept], tags)
+        if device_id is not None:
+            window, loaded = windows[device_id]
+            session.info.setdefault(_PENDING, []).append((
+                device_id, before, [(rows[p]["timestamp"], ids[p]) for p in kept],
+                _segment_key(segment), window if loaded else None,
+            ))
+    return ids, duplicates
+
+# ------------------ Maintenance ------------------
+def expired_segments(session: Session, before: datetime, device_id: Optional[str] = None,
+                     excluded: Sequence[str] = (), limit: Optional[int] = None) -> List[Row]:
+    """Index entries of the segments whose newest reading is older than before, oldest first.
+
+    Limited to one device, or to every device not in excluded.
+    """
+    stmt = select(*SEGMENT_COLUMNS).where(ReadingSegment.last_created_at < micros(before)).order_by(ReadingSegment.id)
+    if device_id:
+        stmt = stmt.where(ReadingSegment.device_id == device_id)
+    elif excluded:
+        stmt = stmt.where(or_(ReadingSegment.device_id.is_(None), not_(ReadingSegment.device_id.in_(excluded))))
+    return session.execute(stmt.limit(limit)).all()
+
+def segment_rows(session: Session, segment: Row) -> List[tuple]:
+    """Every reading in a segment as row tuples, oldest first"""
+    return [row for _, _, row in _walk(segment, _tags(session), None, None, None, None, False)]
+
+def remove_files(segment_ids: Iterable[int]):
+    """Remove dropped segments' files; call once the index no longer lists them"""
+    for segment_id in segment_ids:
+        _maps.pop(segment_id, None)
+        try:
+            os.remove(segment_path(segment_id))
+        except FileNotFoundError:
+            pass
+
+def drop_expired(session_factory: Callable, before: datetime, device_id: Optional[str] = None,
+                 excluded: Sequence[str] = ()) -> int:
+    """Delete the segments whose newest reading is older than before; returns readings dropped.
+
+    Limited to one device, or to every device not in excluded. The files are
+    removed once the index no longer lists them.
+    """
+    with session_factory() as session:
+        expired = expired_segments(session, before, device_id, excluded)
+        if not expired:
+            return 0
+        session.execute(
+            delete(ReadingSegment)
+            .where(ReadingSegment.id.in_([segment.id for segment in expired]))
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+    remove_files(segment.id for segment in expired)
+    return sum(segment.count for segment in expired)
+
+def move_from_sqlite(session_factory: Callable, chunk_size: int = 5000) -> int:
+    """Move the readings in sensordata to segments, keeping their ids; returns readings moved.
+
+    Each device's readings go to new segments in id order, one committed chunk
+    at a time, so an interrupted move can simply be run again. Readings
+    arriving meanwhile would land in the same segments, so stop the server first.
+    """
+    chunk_size = max(1, chunk_size)
+    started = set()
+    moved = 0
+    while True:
+        with session_factory() as session:
+            rows = [
+                dict(row) for row in session.execute(
+                    select(*SENSOR_DATA_COLUMNS).order_by(SensorData.id).limit(chunk_size)
+                ).mappings()
+            ]
+            if not rows:
+                return moved
+            devices: Dict[Optional[str], List[Dict[str, Any]]] = {}
+            for row in rows:
+                devices.setdefault(row["device_id"], []).append(row)
+            tags: Dict[Tuple[Optional[str], Optional[str]], int] = {}
+            for device_id, device_rows in devices.items():
+                segment = _newest(session, device_id) if device_id in started else None
+                _append(session, device_id, segment, device_rows, [row["id"] for row in device_rows], tags)
+                started.add(device_id)
+            session.execute(
+                delete(SensorData).where(SensorData.id <= rows[-1]["id"]).execution_options(synchronize_session=False)
+            )
+            session.commit()
+        moved += len(rows)
+
+def warn_unmoved(session_factory: Callable):
+    """Segment mode only reads segments; say so if sensordata still holds readings"""
+    with session_factory() as session:
+        if session.execute(select(SensorData.id).limit(1)).first():
+            logger.warning(
+                "sensordata still holds readings, which segment mode doesn't serve; "
+                "stop the server and run `python manage.py move-to-segments`"
+            )
@@ -0,0 +1,44 @@
+"""Direct JSON encoding for the large list responses.
+
+Returning ORM objects from a handler makes FastAPI validate each one against
+response_model and walk it again with the JSON encoder; for a page of a
+thousand readings that is most of the request. The list endpoints instead
+select plain row tuples, with the columns in the model's field order, and
+encode them straight to JSON bytes here. The body holds the same keys and
+values as the response model would produce, with ISO 8601 datetimes; keys
+follow the model's field order. orjson is used when it is installed
+(pip install orjson); otherwise the stdlib json module is used.
+"""
+import json
+from datetime import datetime
+from typing import Any, List, Mapping, Sequence
+from fastapi import Response
+from sqlalchemy import Column
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def model_columns(model) -> List[Column]:
+    """Table columns in the order the model's fields are serialised"""
+    return [model.__table__.c[name] for name in model.model_fields]
+
+def _default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    # The same settings as FastAPI's JSONResponse
+    return json.dumps(value, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+def rows_json(keys: Sequence[str], rows: Sequence[Sequence[Any]]) -> bytes:
+    """JSON array of objects from row tuples whose values are in keys order"""
+    return dumps([dict(zip(keys, row)) for row in rows])
+
+def rows_response(keys: Sequence[str], rows: Sequence[Sequence[Any]], headers: Mapping[str, str]) -> Response:
+    # A returned Response skips response_model, and the injected response's headers with it
+    return Response(content=rows_json(keys, rows), media_type="application/json", headers=dict(headers))
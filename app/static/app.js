@@ -1,12 +1,15 @@
 const $ = (sel) => document.querySelector(sel);
+// Device whose watering state the header and its device card show
+const WATERING_DEVICE_ID = 'autogrow_esp32';
 const api = {
   async health(){ const r = await fetch('/api/v1/health'); return r.json(); },
-  async listSensors(q){ const r = await fetch('/api/v1/sensor-data' + (q?`?q=${encodeURIComponent(q)}`:'')); return r.json(); },
+  async listSensors(deviceId){ const r = await fetch('/api/v1/sensor-data' + (deviceId?`?device_id=${encodeURIComponent(deviceId)}`:'')); return r.json(); },
+  async listDeviceLatest(){ const r = await fetch('/api/v1/devices/latest'); if(!r.ok) throw new Error('Get devices failed'); return r.json(); },
   async getSensor(id){ const r = await fetch('/api/v1/sensor-data/'+id); if(!r.ok) throw new Error('Not found'); return r.json(); },
   async createSensor(data){ const r = await fetch('/api/v1/sensor-data',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(data)}); if(!r.ok) throw new Error('Create failed'); return r.json(); },
   async updateSensor(id,data){ const r = await fetch('/api/v1/sensor-data/'+id,{method:'PUT',headers:{'Content-Type':'application/json'},body:JSON.stringify(data)}); if(!r.ok) throw new Error('Update failed'); return r.json(); },
   async delSensor(id){ const r = await fetch('/api/v1/sensor-data/'+id,{method:'DELETE'}); if(!r.ok) throw new Error('Delete failed'); return true; },
-  async getWatering(deviceId = 'autogrow_esp32'){ const r = await fetch('/api/v1/watering/' + deviceId); if(!r.ok) throw new Error('Get watering failed'); return r.json(); },
+  async getWatering(deviceId = WATERING_DEVICE_ID){ const r = await fetch('/api/v1/watering/' + deviceId); if(!r.ok) throw new Error('Get watering failed'); return r.json(); },
   async updateWatering(data){ const r = await fetch('/api/v1/watering',{method:'PUT',headers:{'Content-Type':'application/json'},body:JSON.stringify(data)}); if(!r.ok) throw new Error('Update watering failed'); return r.json(); },
   async listWateringHistory(deviceId){ const r = await fetch('/api/v1/watering-history' + (deviceId?`?device_id=${encodeURIComponent(deviceId)}`:'')); return r.json(); },
   async getWateringHistory(id){ const r = await fetch('/api/v1/watering-history/'+id); if(!r.ok) throw new Error('Not found'); return r.json(); },
@@ -63,26 +66,36 @@ function formatWateringStatus(wateringEnded){
 }
 
 
-async function updateLatestReadings(sensors){
-  if(sensors.length === 0) return;
-  
-  const latest = sensors[0];
-  $('#latest-temp').textContent = formatTemperature(latest.temperature);
-  $('#latest-humidity').textContent = formatHumidity(latest.humidity);
-  $('#latest-lux').textContent = formatLux(latest.lux);
-  $('#latest-device').textContent = latest.device_id || 'Unknown';
-  
-  // Fetch watering data and update pump status
+// Last known state, so live events can redraw the page without asking the server again
+let wateringState = null;  // api.getWatering(), shown in the header and on its device's card
+let deviceLatest = [];     // latest reading per device, newest first
+let latestReading = null;  // reading shown in the header
+
+async function refreshWatering(){
   try {
-    const wateringData = await api.getWatering();
-    $('#latest-pump').textContent = formatPumpStatus(latest.pump_active, wateringData);
+    wateringState = await api.getWatering();
   } catch (error) {
     console.error('Failed to load watering data:', error);
-    // Fallback to sensor data if watering data fails
-    $('#latest-pump').textContent = formatPumpStatus(latest.pump_active, null);
+    // Fall back to the pump flag of the readings
+    wateringState = null;
   }
 }
 
+function renderLatestReading(latest){
+  latestReading = latest;
+  $('#latest-temp').textContent = formatTemperature(latest.temperature);
+  $('#latest-humidity').textContent = formatHumidity(latest.humidity);
+  $('#latest-lux').textContent = formatLux(latest.lux);
+  $('#latest-device').textContent = latest.device_id || 'Unknown';
+  $('#latest-pump').textContent = formatPumpStatus(latest.pump_active, wateringState);
+}
+
+async function updateLatestReadings(sensors){
+  if(sensors.length === 0) return;
+  await refreshWatering();
+  renderLatestReading(sensors[0]);
+}
+
 function rowHtml(sensor){
   const created = formatDateTime(sensor.created_at);
   const deviceId = sensor.device_id || 'Unknown';
@@ -143,19 +156,6 @@ async function loadWateringTable(deviceId){
   }
 }
 
-function getUniqueDevices(sensors){
-  const deviceMap = new Map();
-  
-  sensors.forEach(sensor => {
-    const deviceId = sensor.device_id || 'Unknown';
-    if (!deviceMap.has(deviceId) || new Date(sensor.created_at) > new Date(deviceMap.get(deviceId).created_at)) {
-      deviceMap.set(deviceId, sensor);
-    }
-  });
-  
-  return Array.from(deviceMap.values()).sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
-}
-
 function deviceCardHtml(device, wateringData = null){
   const deviceId = device.device_id || 'Unknown';
   const firmware = device.firmware_version || 'N/A';
@@ -198,31 +198,39 @@ function deviceCardHtml(device, wateringData = null){
   `;
 }
 
+function renderDeviceOverview(){
+  if (deviceLatest.length === 0) {
+    $('#device-overview').innerHTML = '<div class="no-data">No device data available</div>';
+    return;
+  }
+  $('#device-overview').innerHTML = deviceLatest.map(device => deviceCardHtml(device, wateringState)).join('');
+}
+
 async function loadDeviceOverview(){
   try {
-    const sensors = await api.listSensors();
-    const uniqueDevices = getUniqueDevices(sensors);
-    
-    if (uniqueDevices.length === 0) {
-      $('#device-overview').innerHTML = '<div class="no-data">No device data available</div>';
-      return;
-    }
-    
-    // Fetch watering data for all devices
-    let wateringData = null;
-    try {
-      wateringData = await api.getWatering();
-    } catch (error) {
-      console.error('Failed to load watering data for device overview:', error);
-    }
-    
-    $('#device-overview').innerHTML = uniqueDevices.map(device => deviceCardHtml(device, wateringData)).join('');
+    // Latest reading per device, already sorted newest first by the server
+    deviceLatest = await api.listDeviceLatest();
+    await refreshWatering();
+    renderDeviceOverview();
   } catch (error) {
     console.error('Failed to load device overview:', error);
     $('#device-overview').innerHTML = '<div class="error">Failed to load device data</div>';
   }
 }
 
+function mergeDeviceLatest(readings){
+  // Same rule as device_latest on the server: a replayed older reading doesn't replace a newer one
+  for (const reading of readings) {
+    const current = deviceLatest.find(device => device.device_id === reading.device_id);
+    if (!current) {
+      deviceLatest.push(reading);
+    } else if (new Date(reading.created_at) >= new Date(current.created_at)) {
+      Object.assign(current, reading);
+    }
+  }
+  deviceLatest.sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
+}
+
 
 document.addEventListener('click', async (e) => {
   const delId = e.target.getAttribute('data-del');
@@ -266,33 +274,119 @@ $('#watering-refresh-btn').addEventListener('click', async () => {
   await loadWateringTable($('#watering-search').value.trim());
 });
 
-// Auto-refresh sensor data every 30 seconds
-setInterval(async () => {
+// Polling fallback, used only while the live event stream is unavailable
+let pollTimers = [];
+
+function startPolling(){
+  if (pollTimers.length > 0) return;
+
+  // Auto-refresh sensor data every 30 seconds
+  pollTimers.push(setInterval(async () => {
+    await loadTable($('#search').value.trim());
+    await loadDeviceOverview();
+  }, 30000));
+
+  // Auto-refresh pump status (including watering data) every 5 seconds (more frequent for real-time updates)
+  pollTimers.push(setInterval(async () => {
+    try {
+      // Get latest sensor data to ensure we have the most recent pump status
+      const sensors = await api.listSensors();
+      if (sensors.length > 0) {
+        const latest = sensors[0];
+        const wateringData = await api.getWatering();
+        $('#latest-pump').textContent = formatPumpStatus(latest.pump_active, wateringData);
+        
+        // Also refresh device overview pump status
+        await loadDeviceOverview();
+      }
+    } catch (error) {
+      console.error('Failed to refresh pump/watering status:', error);
+    }
+  }, 5000));
+}
+
+// Runs fn once, ms after the first call, however often it is called meanwhile
+function throttle(fn, ms){
+  let timer = null;
+  return () => {
+    if (timer) return;
+    timer = setTimeout(() => {
+      timer = null;
+      fn();
+    }, ms);
+  };
+}
+
+// Watering events come in bursts (start, stop, history); refetch the table once per burst
+const WATERING_TABLE_REFRESH_MS = 3000;
+const refreshWateringTable = throttle(() => loadWateringTable($('#watering-search').value.trim()), WATERING_TABLE_REFRESH_MS);
+
+function stopPolling(){
+  pollTimers.forEach(clearInterval);
+  pollTimers = [];
+}
+
+async function reloadAll(){
   await loadTable($('#search').value.trim());
   await loadDeviceOverview();
-}, 30000);
+  await loadWateringTable($('#watering-search').value.trim());
+}
 
-// Auto-refresh pump status (including watering data) every 5 seconds (more frequent for real-time updates)
-setInterval(async () => {
-  try {
-    // Get latest sensor data to ensure we have the most recent pump status
-    const sensors = await api.listSensors();
-    if (sensors.length > 0) {
-      const latest = sensors[0];
-      const wateringData = await api.getWatering();
-      $('#latest-pump').textContent = formatPumpStatus(latest.pump_active, wateringData);
-      
-      // Also refresh device overview pump status
-      await loadDeviceOverview();
-    }
-  } catch (error) {
-    console.error('Failed to refresh pump/watering status:', error);
+function matchesSearch(sensor, q){
+  // Same rule as the server-side device_id filter used by loadTable
+  return !q || sensor.device_id === q;
+}
+
+// Events carry everything the table, header and device cards show, so they are drawn without a fetch
+function onSensorData(readings){
+  mergeDeviceLatest(readings.filter(sensor => sensor.device_id));
+  renderDeviceOverview();
+  const q = $('#search').value.trim();
+  const rows = readings.filter(sensor => matchesSearch(sensor, q)).reverse();
+  if (rows.length === 0) return;
+  const tbody = $('#sensor-table tbody');
+  tbody.insertAdjacentHTML('afterbegin', rows.map(rowHtml).join(''));
+  // Keep the table at the same size a full load would return
+  while (tbody.rows.length > 100) tbody.deleteRow(-1);
+  // A reading replayed from a device's buffer can be older than the one shown
+  const newest = rows.reduce((a, b) => new Date(b.created_at) > new Date(a.created_at) ? b : a);
+  if (!latestReading || new Date(newest.created_at) > new Date(latestReading.created_at)) {
+    renderLatestReading(newest);
   }
-}, 5000);
+}
+
+function onWatering(wateringData){
+  // The header card shows the same device as api.getWatering()
+  if (wateringData.device_id === WATERING_DEVICE_ID) {
+    wateringState = wateringData;
+    $('#latest-pump').textContent = formatPumpStatus(null, wateringData);
+    renderDeviceOverview();
+  }
+  refreshWateringTable();
+}
+
+// Live updates over Server-Sent Events; falls back to polling while disconnected
+function connectEvents(){
+  if (!window.EventSource) {
+    startPolling();
+    return;
+  }
+  const source = new EventSource('/api/v1/stream');
+  source.onopen = () => {
+    stopPolling();
+    // Catch up on anything written while we were disconnected
+    reloadAll();
+  };
+  source.onerror = () => startPolling();
+  source.addEventListener('sensor_data', (e) => onSensorData(JSON.parse(e.data)));
+  source.addEventListener('watering', (e) => onWatering(JSON.parse(e.data)));
+  source.addEventListener('resync', () => reloadAll());
+}
 
 (async function init(){
   await refreshHealth();
   await loadTable();
   await loadDeviceOverview();
   await loadWateringTable();
+  connectEvents();
 })();
\ No newline at end of file
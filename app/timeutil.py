@@ -0,0 +1,8 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Normalise a query parameter to the naive UTC datetimes stored in the database"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
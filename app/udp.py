@@ -0,0 +1,135 @@
+"""Fire-and-forget sensor readings over UDP.
+
+Each datagram carries either the binary encoding from binary.py (one or
+more readings) or the same JSON a device would POST, as a single object or
+a list. Readings are validated like the HTTP endpoints do and handed to a
+GroupCommitWriter without waiting, so the event loop never blocks on
+SQLite and readings are committed in groups. Nothing is sent back; a sender
+that needs confirmation should use HTTP.
+
+When the writer falls behind by more than max_queue readings, whole
+datagrams are dropped rather than buffered without bound. A reading that
+was already stored (same device and timestamp, e.g. a resend) is counted as
+a duplicate and not stored again.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+from . import binary
+from .events import broker
+from .ingest import MAX_BATCH_SIZE, sensor_row
+from .models import ArduinoSensorData, SensorData
+from .writebehind import GroupCommitWriter
+
+logger = logging.getLogger(__name__)
+
+def parse_datagram(data: bytes) -> Tuple[List[Dict[str, Any]], int]:
+    """Rows for the valid readings in a datagram, and how many readings were invalid.
+
+    Raises ValueError when the datagram can't be decoded at all.
+    """
+    if data[:2] == binary.MAGIC:
+        header, records = binary.decode_readings(data)
+        if len(records) > MAX_BATCH_SIZE:
+            raise ValueError(f"More than {MAX_BATCH_SIZE} readings")
+        created_at = datetime.utcnow()
+        rows = [binary.record_row(header, r, created_at) for r in records if binary.is_valid_record(r)]
+        return rows, len(records) - len(rows)
+
+    try:
+        payload = json.loads(data)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Neither binary nor JSON: {e}")
+    items = payload if isinstance(payload, list) else [payload]
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValueError(f"More than {MAX_BATCH_SIZE} readings")
+    rows = []
+    for item in items:
+        try:
+            rows.append(sensor_row(ArduinoSensorData(**item)))
+        except (TypeError, ValidationError):
+            continue
+    return rows, len(items) - len(rows)
+
+class TelemetryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, listener: "UDPListener"):
+        self.listener = listener
+
+    def datagram_received(self, data: bytes, addr):
+        self.listener.handle(data)
+
+    def error_received(self, exc: Exception):
+        logger.warning("UDP telemetry socket error: %s", exc)
+
+class UDPListener:
+    def __init__(self, writer: GroupCommitWriter, host: str, port: int, max_queue: int = 10000):
+        self.writer = writer
+        self.host = host
+        self.port = port
+        self.max_queue = max_queue
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        # Counters, only written on the event loop (write_errors and readings_duplicate by the flusher thread)
+        self.packets_received = 0
+        self.packets_dropped = 0
+        self.packets_malformed = 0
+        self.readings_accepted = 0
+        self.readings_invalid = 0
+        self.readings_duplicate = 0
+        self.write_errors = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: TelemetryProtocol(self), local_addr=(self.host, self.port)
+        )
+        logger.info("UDP telemetry listening on %s:%s", self.host, self.port)
+
+    def stop(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def handle(self, data: bytes):
+        self.packets_received += 1
+        try:
+            rows, invalid = parse_datagram(data)
+        except ValueError:
+            self.packets_malformed += 1
+            return
+        self.readings_invalid += invalid
+        if self.writer.queue_depth + len(rows) > self.max_queue:
+            self.packets_dropped += 1
+            return
+        try:
+            for row in rows:
+                self.writer.submit(row).add_done_callback(lambda future, row=row: self._written(future, row))
+        except RuntimeError:
+            # Writer already stopped during shutdown
+            self.packets_dropped += 1
+            return
+        self.readings_accepted += len(rows)
+
+    def _written(self, future, row: Dict[str, Any]):
+        # Runs on the flusher thread once the reading's group has been committed
+        if future.exception() is not None:
+            self.write_errors += 1
+        elif future.result().duplicates:
+            self.readings_duplicate += 1
+        elif broker.has_subscribers:
+            broker.publish("sensor_data", jsonable_encoder([SensorData(id=future.result().ids[0], **row)]))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "address": f"{self.host}:{self.port}",
+            "packets_received": self.packets_received,
+            "packets_dropped": self.packets_dropped,
+            "packets_malformed": self.packets_malformed,
+            "readings_accepted": self.readings_accepted,
+            "readings_invalid": self.readings_invalid,
+            "readings_duplicate": self.readings_duplicate,
+            "write_errors": self.write_errors,
+        }
@@ -0,0 +1,131 @@
+"""Change counters behind the ETags on the read endpoints.
+
+Every write bumps a counter for its table and, when it only touches one
+device, a counter for that device. A read takes its tag from the counters
+before it queries, so a write that lands mid-query just makes the tag stale
+and the client fetches again on its next poll. Writers bump after commit,
+never before, so a tag is never paired with data older than it.
+
+Device counters live in a fixed number of hashed slots. Devices that share a
+slot invalidate each other's tags, which costs a refetch but is never wrong.
+A write that can't name its device (a retention purge, a row without a
+device) moves the table's generation on, which invalidates every device tag
+for that table. The random instance token keeps tags handed out before a
+restart from matching counters that start again at zero.
+
+With several worker processes (PI_SENSOR_RUN_DIR, see serve.py) the counters
+live in a small memory-mapped file that every process shares, and bumps are
+serialised across processes with a POSIX record lock on that file.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Optional
+from .config import settings
+
+TABLES = ("sensordata", "wateringdata", "wateringhistory")
+DEVICE_SLOTS = 256
+
+# Per table: table version, generation, then one counter per device slot
+_TABLE_VERSION = 0
+_GENERATION = 1
+_FIRST_SLOT = 2
+
+# Slot 0 of the buffer holds the instance token; tables start after it
+_HEADER_SLOTS = 1
+
+# Byte ranges of the shared file used as cross-process locks
+_BUMP_LOCK = 0
+_COMMIT_LOCK = 1
+
+class VersionCounters:
+    def __init__(self, tables=TABLES, device_slots: int = DEVICE_SLOTS, path: Optional[str] = None):
+        self.device_slots = device_slots
+        self._offsets = {
+            table: _HEADER_SLOTS + i * (device_slots + _FIRST_SLOT) for i, table in enumerate(tables)
+        }
+        size = 8 * (_HEADER_SLOTS + len(tables) * (device_slots + _FIRST_SLOT))
+        self.path = path
+        self._fd: Optional[int] = None
+        if path:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._buffer = mmap.mmap(self._fd, size)
+        else:
+            self._buffer = bytearray(size)
+        self._counters = memoryview(self._buffer).cast("Q")
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        if not path or not self._counters[0]:
+            self.reset()
+
+    @property
+    def instance(self) -> str:
+        return f"{self._counters[0]:016x}"
+
+    def reset(self):
+        """Zero every counter and pick a new instance token"""
+        with self._locked(self._lock, _BUMP_LOCK):
+            self._counters[1:] = memoryview(bytes(8 * (len(self._counters) - 1))).cast("Q")
+            self._counters[0] = struct.unpack("Q", os.urandom(8))[0] or 1
+
+    @contextmanager
+    def _locked(self, lock: threading.Lock, byte: int):
+        # The thread lock comes first: record locks don't exclude threads of the same process
+        with lock:
+            if self._fd is None:
+                yield
+                return
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, byte)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, byte)
+
+    @contextmanager
+    def commit_lock(self):
+        """Hold across commit, bump and any write-through so they happen in commit order"""
+        with self._locked(self._commit_lock, _COMMIT_LOCK):
+            yield
+
+    def _slot(self, device_id: str) -> int:
+        return _FIRST_SLOT + zlib.crc32(device_id.encode()) % self.device_slots
+
+    def bump(self, table: str, device_id: Optional[str] = None) -> str:
+        """Record a committed change to a table, scoped to one device when known.
+
+        Returns the tag for the same scope as of this bump.
+        """
+        offset = self._offsets[table]
+        with self._locked(self._lock, _BUMP_LOCK):
+            self._counters[offset + _TABLE_VERSION] += 1
+            if device_id is None:
+                self._counters[offset + _GENERATION] += 1
+            else:
+                self._counters[offset + self._slot(device_id)] += 1
+            return self.etag(table, device_id)
+
+    def etag(self, table: str, device_id: Optional[str] = None) -> str:
+        """Weak ETag for a read of the whole table, or of one device's rows"""
+        offset = self._offsets[table]
+        if device_id is None:
+            return f'W/"{self.instance}-{self._counters[offset + _TABLE_VERSION]}"'
+        generation = self._counters[offset + _GENERATION]
+        device = self._counters[offset + self._slot(device_id)]
+        return f'W/"{self.instance}-{generation}.{device}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison against an If-None-Match header"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+versions = VersionCounters(path=os.path.join(settings.run_dir, "versions") if settings.run_dir else None)
@@ -0,0 +1,76 @@
+"""Pump start/stop state machine behind PUT /api/v1/watering.
+
+Switching a pump on opens a WateringHistory record and switching it off
+closes it. The open record's id is kept on the device's WateringData row
+(open_history_id), so closing it is an update by primary key instead of a
+search for the newest unfinished record. Creating the device row, the state
+change and the history record all happen in the caller's transaction, and
+the object is left as committed, so the caller can commit once and return
+it without reading it back.
+"""
+from datetime import datetime
+from typing import Any, Dict
+from sqlalchemy import insert, update
+from sqlmodel import Session, select
+from .models import WateringData, WateringHistory
+from .timeutil import as_utc
+
+def apply_update(session: Session, device_id: str, changes: Dict[str, Any]) -> WateringData:
+    """Apply a WateringDataUpdate's set fields to the device; the caller commits"""
+    watering_data = session.get(WateringData, device_id)
+    if watering_data is None:
+        watering_data = WateringData(device_id=device_id)
+        session.add(watering_data)
+
+    was_active = watering_data.pump_active
+    for k, v in changes.items():
+        if k == "device_id":  # Don't update device_id after creation
+            continue
+        if k == "last_watering":
+            # Stored as naive UTC; normalised here since the object isn't read back
+            v = as_utc(v)
+        setattr(watering_data, k, v)
+    now = datetime.utcnow()
+    watering_data.timestamp = now.timestamp()
+
+    is_active = changes.get("pump_active")
+    if is_active is None or is_active == was_active:
+        return watering_data
+    # Without autoflush the device row goes out as one write at commit, open_history_id included
+    with session.no_autoflush:
+        _record_transition(session, watering_data, is_active, now)
+    return watering_data
+
+def _record_transition(session: Session, watering_data: WateringData, is_active: bool, now: datetime):
+    device_id = watering_data.device_id
+    if is_active:
+        stmt = insert(WateringHistory).values(
+            device_id=device_id,
+            watering_duration=watering_data.watering_duration,
+            auto_watering=watering_data.auto_watering,
+            watering_started=now,
+            watering_ended=None,
+            created_at=now,
+        ).returning(WateringHistory.id)
+        watering_data.open_history_id = session.execute(stmt).scalar_one()
+    else:
+        if watering_data.open_history_id is not None:
+            target = WateringHistory.id == watering_data.open_history_id
+        else:
+            # Sessions opened before open_history_id was tracked, or through POST /api/v1/watering-history
+            target = WateringHistory.id == (
+                select(WateringHistory.id)
+                .where(WateringHistory.device_id == device_id)
+                .where(WateringHistory.watering_ended.is_(None))
+                .order_by(WateringHistory.watering_started.desc())
+                .limit(1)
+                .scalar_subquery()
+            )
+        session.execute(
+            update(WateringHistory)
+            .where(target)
+            .where(WateringHistory.watering_ended.is_(None))
+            .values(watering_ended=now)
+            .execution_options(synchronize_session=False)
+        )
+        watering_data.open_history_id = None
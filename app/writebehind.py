@@ -0,0 +1,167 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .ingest import inserted_rows, insert_sensor_rows, mark_sensor_rows_committed
+
+logger = logging.getLogger(__name__)
+
+class GroupCommitWriter:
+    """Write-behind buffer that commits queued sensor rows in groups.
+
+    Request threads call write(), which blocks until the group containing the
+    row has been committed. A single flusher thread drains the queue and
+    commits whenever flush_size rows are waiting or flush_interval_ms has
+    passed since the first row of the group arrived. Rows handed over together
+    with submit_many() always land in the same group. on_commit, if given, is
+    called on the flusher thread with the rows and ids of every committed group,
+    leaving out duplicates of readings already stored.
+    """
+
+    def __init__(self, session_factory: Callable, flush_size: int = 100, flush_interval_ms: int = 50,
+                 on_commit: Optional[Callable[[List[Dict[str, Any]], List[int]], None]] = None):
+        self.session_factory = session_factory
+        self.on_commit = on_commit
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = max(0, flush_interval_ms) / 1000.0
+        # Items are (rows, future); futures resolve to the InsertResult for their rows
+        self._queue: "queue.Queue[Optional[Tuple[List[Dict[str, Any]], Future]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        # Guards _closed so no row can be queued behind the shutdown sentinel
+        self._lock = threading.Lock()
+        # Metrics, only written by the flusher thread
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.rows_duplicate = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def start(self):
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="sensor-group-commit", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop accepting rows and commit everything still queued"""
+        if self._thread is None:
+            return
+        with self._lock:
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _enqueue(self, rows: List[Dict[str, Any]]) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._closed or self._thread is None:
+                raise RuntimeError("Group commit writer is not running")
+            self._queue.put((rows, future))
+        return future
+
+    def submit(self, row: Dict[str, Any]) -> Future:
+        """Queue one row; the future resolves to its InsertResult"""
+        return self._enqueue([row])
+
+    def submit_many(self, rows: List[Dict[str, Any]]) -> Future:
+        """Queue rows to be committed together; the future resolves to their InsertResult"""
+        return self._enqueue(list(rows))
+
+    def write(self, row: Dict[str, Any], timeout: Optional[float] = None) -> int:
+        """Queue a row and wait until its group is durable; returns its id"""
+        return self.submit(row).result(timeout).ids[0]
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue_depth,
+            "flush_size": self.flush_size,
+            "flush_interval_ms": self.flush_interval * 1000.0,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "rows_duplicate": self.rows_duplicate,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            group = [item]
+            size = len(item[0])
+            deadline = time.monotonic() + self.flush_interval
+            while size < self.flush_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                group.append(item)
+                size += len(item[0])
+            self._flush(group)
+
+        # Drain whatever was queued before stop() was called
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                leftover.append(item)
+        group, size = [], 0
+        for item in leftover:
+            group.append(item)
+            size += len(item[0])
+            if size >= self.flush_size:
+                self._flush(group)
+                group, size = [], 0
+        if group:
+            self._flush(group)
+
+    def _flush(self, group: List[Tuple[List[Dict[str, Any]], Future]]):
+        started = time.perf_counter()
+        rows = [row for item_rows, _ in group for row in item_rows]
+        try:
+            with self.session_factory() as session:
+                result = insert_sensor_rows(session, rows)
+                session.commit()
+            added, added_ids = inserted_rows(rows, result)
+            mark_sensor_rows_committed(added)
+        except Exception as e:
+            self.flush_errors += 1
+            for _, future in group:
+                future.set_exception(e)
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        self.flushes += 1
+        self.rows_flushed += len(rows)
+        self.rows_duplicate += len(result.duplicates)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+        position = 0
+        for item_rows, future in group:
+            future.set_result(result.part(position, position + len(item_rows)))
+            position += len(item_rows)
+        if self.on_commit and added:
+            try:
+                self.on_commit(added, added_ids)
+            except Exception:
+                logger.exception("on_commit callback failed")
@@ -0,0 +1,312 @@
+"""Single writer process for multi-worker deployments.
+
+SQLite allows one writer at a time. With several uvicorn workers each doing
+its own inserts they would queue on the database lock, so instead the
+workers forward sensor readings over a Unix socket to this process, which
+owns the GroupCommitWriter and commits them in groups. It also runs
+everything that should only run once: migrations, the rollup catch-up,
+retention, archive compaction and the UDP listener.
+
+The protocol is one JSON object per line. Workers send
+
+    {"op": "insert", "id": 7, "rows": [...]}      -> {"id": 7, "result": [ids]}
+    {"op": "stats", "id": 8}                      -> {"id": 8, "result": {...}}
+    {"op": "publish", "event": "...", "data": ...}
+
+and the writer pushes {"op": "event", "event": ..., "data": ...} to every
+worker for each committed group of readings, and relays "publish" messages
+to the other workers, so a dashboard sees every change whichever worker its
+event stream is connected to.
+
+Run it with serve.py, which starts this process before the workers.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import signal
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set
+from fastapi.encoders import jsonable_encoder
+from .config import settings
+from .ingest import InsertResult
+from .models import SensorData
+
+logger = logging.getLogger(__name__)
+
+# Bytes a worker may leave unread before the writer stops sending it events
+MAX_CLIENT_BUFFER = 1024 * 1024
+RECONNECT_DELAY_S = 1.0
+
+def socket_path(run_dir: str) -> str:
+    return os.path.join(run_dir, "writer.sock")
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+def _encode_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(row, created_at=row["created_at"].isoformat())
+
+def _decode_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(row, created_at=datetime.fromisoformat(row["created_at"]))
+
+class WriterUnavailable(Exception):
+    pass
+
+class WriterService:
+    """The writer side of the socket: commits forwarded rows and fans events out"""
+
+    def __init__(self, path: str, writer, stats: Optional[Callable[[], Dict[str, Any]]] = None):
+        self.path = path
+        self.writer = writer
+        self.stats = stats or writer.stats
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve_client, path=self.path)
+        os.chmod(self.path, 0o600)
+        logger.info("Writer listening on %s", self.path)
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for client in list(self._clients):
+            client.close()
+        await self._server.wait_closed()
+        self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def committed(self, rows: List[Dict[str, Any]], ids: List[int]):
+        """GroupCommitWriter on_commit hook; runs on the flusher thread"""
+        if not self._clients or self._loop is None:
+            return
+        data = jsonable_encoder([SensorData(id=i, **row) for i, row in zip(ids, rows)])
+        self._loop.call_soon_threadsafe(self.broadcast, {"op": "event", "event": "sensor_data", "data": data})
+
+    def broadcast(self, message: Dict[str, Any], exclude: Optional[asyncio.StreamWriter] = None):
+        line = _encode(message)
+        for client in list(self._clients):
+            # A worker that stops reading loses events rather than growing our memory
+            if client is not exclude and client.transport.get_write_buffer_size() < MAX_CLIENT_BUFFER:
+                client.write(line)
+
+    async def _serve_client(self, reader: asyncio.StreamReader, client: asyncio.StreamWriter):
+        self._clients.add(client)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                op = message.get("op")
+                if op == "insert":
+                    # Don't wait for the commit here; other requests on this connection keep flowing
+                    task = asyncio.create_task(self._insert(client, message))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                elif op == "publish":
+                    self.broadcast({"op": "event", "event": message["event"], "data": message["data"]}, exclude=client)
+                elif op == "stats":
+                    client.write(_encode({"id": message["id"], "result": self.stats()}))
+        except (ConnectionError, json.JSONDecodeError) as e:
+            logger.warning("Dropping worker connection: %s", e)
+        finally:
+            self._clients.discard(client)
+            client.close()
+
+    async def _insert(self, client: asyncio.StreamWriter, message: Dict[str, Any]):
+        try:
+            rows = [_decode_row(row) for row in message["rows"]]
+            result = await asyncio.wrap_future(self.writer.submit_many(rows))
+            reply = {"id": message["id"], "result": {"ids": result.ids, "duplicates": result.duplicates}}
+        except Exception as e:
+            reply = {"id": message["id"], "error": str(e)}
+        if not client.is_closing():
+            client.write(_encode(reply))
+
+class WriterClient:
+    """The worker side of the socket; keeps one connection open and reconnects if it drops"""
+
+    def __init__(self, path: str, on_event: Callable[[str, Any], None]):
+        self.path = path
+        self.on_event = on_event
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._stream: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._connected = asyncio.Event()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def insert(self, rows: List[Dict[str, Any]]) -> InsertResult:
+        """Commit rows through the writer process; returns their ids in order and the duplicates"""
+        result = await self._call({"op": "insert", "rows": [_encode_row(row) for row in rows]})
+        return InsertResult(result["ids"], result["duplicates"])
+
+    async def stats(self) -> Dict[str, Any]:
+        return await self._call({"op": "stats"})
+
+    def publish(self, event: str, data: Any):
+        """Pass an event to the other workers' dashboards; safe to call from any thread"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._send, _encode({"op": "publish", "event": event, "data": data}))
+
+    def _send(self, line: bytes):
+        if self._stream is not None and not self._stream.is_closing():
+            self._stream.write(line)
+
+    async def _call(self, message: Dict[str, Any]) -> Any:
+        if self._stream is None or self._stream.is_closing():
+            raise WriterUnavailable("Not connected to the writer process")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self._stream.write(_encode(dict(message, id=request_id)))
+            await self._stream.drain()
+            return await future
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _run(self):
+        while True:
+            try:
+                reader, self._stream = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                logger.warning("Writer process not reachable at %s: %s", self.path, e)
+                await asyncio.sleep(RECONNECT_DELAY_S)
+                continue
+            self._connected.set()
+            try:
+                await self._read(reader)
+            finally:
+                self._connected.clear()
+                self._stream.close()
+                self._stream = None
+                for future in self._pending.values():
+                    if not future.done():
+                        future.set_exception(WriterUnavailable("Connection to the writer process was lost"))
+            await asyncio.sleep(RECONNECT_DELAY_S)
+
+    async def _read(self, reader: asyncio.StreamReader):
+        while True:
+            try:
+                line = await reader.readline()
+            except ConnectionError:
+                return
+            if not line:
+                return
+            message = json.loads(line)
+            if message.get("op") == "event":
+                self.on_event(message["event"], message["data"])
+                continue
+            future = self._pending.get(message["id"])
+            if future is None or future.done():
+                continue
+            if "error" in message:
+                future.set_exception(RuntimeError(message["error"]))
+            else:
+                future.set_result(message["result"])
+
+    async def wait_connected(self, timeout: float):
+        await asyncio.wait_for(self._connected.wait(), timeout)
+
+def main():
+    """Entry point for the writer process: python -m app.writer_service"""
+    from .background import PeriodicTask
+    from .db import close_db, get_read_session, get_session, init_db
+    from .retention import RetentionEngine, parse_duration, parse_policy
+    from .udp import UDPListener
+    from .versions import versions
+    from .writebehind import GroupCommitWriter
+    from . import archive, rollups, segments
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s writer %(levelname)s %(message)s")
+    if not settings.run_dir:
+        raise SystemExit("PI_SENSOR_RUN_DIR must be set")
+
+    init_db()
+    if segments.ENABLED:
+        segments.warn_unmoved(get_read_session)
+    # Tags from a previous run must not match the fresh counters
+    versions.reset()
+
+    writer = GroupCommitWriter(get_session, settings.flush_size, settings.flush_interval_ms)
+    rollup_task = PeriodicTask(
+        "sensor-rollup-catch-up",
+        settings.rollup_interval_s,
+        lambda: rollups.catch_up(get_session, max_chunks=1),
+    )
+    retention_engine = RetentionEngine(get_session, parse_policy(settings.retention), settings.retention_chunk_size)
+    retention_task = PeriodicTask("retention", settings.retention_interval_s, retention_engine.run)
+    archive_age = parse_duration(settings.archive_age) if settings.archive_age else None
+    archive_task = PeriodicTask(
+        "archive",
+        settings.archive_interval_s,
+        lambda: archive.compact(get_session, get_read_session, datetime.utcnow() - archive_age, archive.CHUNKS_PER_RUN).more,
+    )
+    udp_listener = None
+    if settings.udp_port:
+        udp_listener = UDPListener(writer, settings.udp_host, settings.udp_port, settings.udp_max_queue)
+
+    def stats() -> Dict[str, Any]:
+        result = writer.stats()
+        if udp_listener:
+            result["udp"] = udp_listener.stats()
+        result["retention"] = retention_engine.stats()
+        return result
+
+    service = WriterService(socket_path(settings.run_dir), writer, stats)
+    writer.on_commit = service.committed
+
+    async def run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        writer.start()
+        rollup_task.start()
+        if retention_engine.rules:
+            retention_task.start()
+        if archive_age:
+            archive_task.start()
+        if udp_listener:
+            await udp_listener.start()
+        await service.start()
+        await stop.wait()
+
+        logger.info("Stopping; committing queued readings")
+        if udp_listener:
+            udp_listener.stop()
+        await service.stop()
+        archive_task.stop()
+        retention_task.stop()
+        rollup_task.stop()
+        writer.stop()
+
+    asyncio.run(run())
+    close_db()
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@
 #include <WiFi.h>
 #include <HTTPClient.h>
 #include <ArduinoJson.h>
+#include <time.h>
 
 // WiFi credentials
 const char* ssid = "YOUR_WIFI_SSID";
@@ -16,6 +17,12 @@ const String device_id = "autogrow_esp32";
 const String firmware_version = "1.0.0";
 const String sensor_type = "DHT11_LDR";
 
+// NTP servers for the reading timestamps
+const char* ntp_server = "pool.ntp.org";
+const char* ntp_fallback_server = "time.nist.gov";
+// Any clock reading before this (2020-09-13) means NTP hasn't answered yet
+const time_t CLOCK_VALID_AFTER = 1600000000;
+
 // Sensor pins
 const int DHT_PIN = 2;
 const int LDR_PIN = A0;
@@ -24,7 +31,7 @@ const int PUMP_PIN = 4;
 // Variables
 float temperature = 0.0;
 float humidity = 0.0;
-int lux = 0;
+float lux = 0.0;
 bool pumpActive = false;
 
 void setup() {
@@ -38,6 +45,14 @@ void setup() {
   }
   Serial.println("WiFi connected!");
   
+  // Set the clock from NTP (UTC); see readingTimestamp()
+  configTime(0, 0, ntp_server, ntp_fallback_server);
+  while (time(nullptr) < CLOCK_VALID_AFTER) {
+    delay(500);
+    Serial.println("Waiting for NTP time...");
+  }
+  Serial.println("Clock set!");
+  
   // Initialize pins
   pinMode(PUMP_PIN, OUTPUT);
   
@@ -50,11 +65,21 @@ void loop() {
   
   // Send data to Pi backend
   sendSensorData();
+  // Or, on a weak WiFi link, the compact binary encoding (~50 bytes instead of ~170):
+  // sendSensorDataBinary();
   
   // Wait 30 seconds before next reading
   delay(30000);
 }
 
+// Unix time in seconds. The server identifies a reading by device_id and timestamp and
+// stores a resent one only once, so the timestamp must keep increasing across reboots:
+// millis() starts again at 0 after every reset, and a new reading that happened to get an
+// old value would be taken for a resend and dropped. Send at most one reading per second.
+unsigned long readingTimestamp() {
+  return (unsigned long)time(nullptr);
+}
+
 void readSensors() {
   // Read DHT11 sensor (temperature and humidity)
   // Note: You'll need to implement DHT11 reading based on your library
@@ -88,7 +113,7 @@ void sendSensorData() {
     doc["humidity"] = humidity;
     doc["lux"] = lux;
     doc["pumpActive"] = pumpActive;
-    doc["timestamp"] = millis();  // Use millis() or get actual timestamp
+    doc["timestamp"] = readingTimestamp();
     doc["device_id"] = device_id;
     doc["firmware_version"] = firmware_version;
     doc["sensor_type"] = sensor_type;
@@ -118,3 +143,43 @@ void sendSensorData() {
     Serial.println("❌ WiFi not connected");
   }
 }
+
+// Compact binary alternative to sendSensorData() (see app/binary.py for the layout).
+// Values are fixed-point hundredths, so 25.5°C is sent as 2550.
+void sendSensorDataBinary() {
+  if (WiFi.status() != WL_CONNECTED) {
+    Serial.println("❌ WiFi not connected");
+    return;
+  }
+
+  uint8_t body[128];
+  size_t len = 0;
+  auto put8 = [&](uint8_t v) { body[len++] = v; };
+  auto put16 = [&](uint16_t v) { put8(v & 0xFF); put8(v >> 8); };
+  auto put32 = [&](uint32_t v) { put16(v & 0xFFFF); put16(v >> 16); };
+  auto putString = [&](const String& s) { put8(s.length()); memcpy(body + len, s.c_str(), s.length()); len += s.length(); };
+
+  // Header: magic, version, record count, then the strings shared by every record
+  put8('P'); put8('S'); put8(1); put16(1);
+  putString(device_id);
+  putString(firmware_version);
+  putString(sensor_type);
+
+  // One 13-byte record; buffer several here to send them in one request
+  put16(isnan(temperature) ? (uint16_t)-32768 : (uint16_t)(int16_t)lroundf(temperature * 100));
+  put16(isnan(humidity) ? 0xFFFF : (uint16_t)lroundf(humidity * 100));
+  put32(isnan(lux) ? 0xFFFFFFFF : (uint32_t)lroundf(lux * 100));
+  put8(pumpActive ? 1 : 0);
+  put32(readingTimestamp());
+
+  HTTPClient http;
+  http.begin("http://" + String(server_ip) + ":" + String(server_port) + "/api/v1/sensor-data/binary");
+  http.addHeader("Content-Type", "application/octet-stream");
+  int httpResponseCode = http.POST(body, len);
+  if (httpResponseCode > 0) {
+    Serial.println("✅ HTTP Response: " + String(httpResponseCode) + " (" + String(len) + " bytes sent)");
+  } else {
+    Serial.println("❌ HTTP Error: " + String(httpResponseCode));
+  }
+  http.end();
+}
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Compare the hot endpoints served through the thread pool (PI_SENSOR_ASYNC_DB=off,
+same dispatch as plain `def` handlers) against the aiosqlite path (on).
+
+Starts a uvicorn server per mode on a scratch database, seeds it, then fires
+bursts of concurrent requests and reports throughput and latency percentiles:
+
+    python -m benchmarks.async_path
+    python -m benchmarks.async_path --concurrency 1 64 256 --requests 2000
+
+Needs aiosqlite and httpx (pip install aiosqlite httpx).
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+try:
+    import httpx
+except ImportError:
+    print("Error: 'httpx' module not found!")
+    print("Please install it with: pip install httpx")
+    sys.exit(1)
+
+from populate_dummy_data import generate_realistic_sensor_data
+
+PORT = 8123
+BASE_URL = f"http://127.0.0.1:{PORT}"
+DEVICES = ["arduino_001", "arduino_002", "arduino_003"]
+
+def start_server(mode, db_path):
+    env = dict(os.environ, PI_SENSOR_DB_PATH=db_path, PI_SENSOR_ASYNC_DB=mode)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(PORT), "--log-level", "warning"],
+        env=env,
+    )
+    for _ in range(100):
+        try:
+            httpx.get(f"{BASE_URL}/api/v1/health")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("Server did not start")
+
+def seed(count):
+    random.seed(42)
+    start = datetime.now() - timedelta(days=2)
+    readings = [generate_realistic_sensor_data(random.choice(DEVICES), start + timedelta(minutes=i)) for i in range(count)]
+    for i in range(0, count, 1000):
+        httpx.post(f"{BASE_URL}/api/v1/sensor-data/batch", json=readings[i:i + 1000]).raise_for_status()
+    httpx.get(f"{BASE_URL}/api/v1/watering/autogrow_esp32").raise_for_status()
+
+def request_factory(name):
+    reading = generate_realistic_sensor_data("arduino_001", datetime.now())
+    if name == "POST sensor-data":
+        return lambda client: client.post("/api/v1/sensor-data", json=reading)
+    if name == "GET sensor-data":
+        return lambda client: client.get("/api/v1/sensor-data", params={"device_id": "arduino_002", "limit": 50})
+    return lambda client: client.get("/api/v1/watering/autogrow_esp32")
+
+async def burst(name, concurrency, total):
+    """total requests from `concurrency` clients at once; returns (req/s, sorted latencies in ms, errors)"""
+    send = request_factory(name)
+    latencies = []
+    errors = 0
+    remaining = total
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=BASE_URL, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                try:
+                    response = await send(client)
+                except httpx.TransportError:
+                    # Connection reset or refused under overload
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{name}: HTTP {response.status_code} {response.text}")
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return len(latencies) / elapsed, sorted(latencies), errors
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark thread-pool vs aiosqlite request handling')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 32, 128],
+                        help='Concurrent clients per burst (default: 1 32 128)')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='Requests per burst (default: 1000)')
+    parser.add_argument('--seed-readings', type=int, default=5000,
+                        help='Readings stored before measuring (default: 5000)')
+    args = parser.parse_args()
+
+    endpoints = ["POST sensor-data", "GET sensor-data", "GET watering"]
+    results = {}
+    for mode in ("off", "on"):
+        workdir = tempfile.mkdtemp(prefix="pi-sensor-bench-")
+        server = start_server(mode, os.path.join(workdir, "bench.sqlite"))
+        try:
+            seed(args.seed_readings)
+            for name in endpoints:
+                for concurrency in args.concurrency:
+                    asyncio.run(burst(name, concurrency, min(args.requests, 100)))  # warm up
+                    results[mode, name, concurrency] = asyncio.run(burst(name, concurrency, args.requests))
+        finally:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'endpoint':18}{'clients':>8}  {'mode':10}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>8}")
+    for name in endpoints:
+        for concurrency in args.concurrency:
+            for mode, label in (("off", "threadpool"), ("on", "aiosqlite")):
+                rate, latencies, errors = results[mode, name, concurrency]
+                print(f"{name:18}{concurrency:>8}  {label:10}{rate:>8.0f}"
+                      f"{percentile(latencies, 0.50):>9.1f}{percentile(latencies, 0.95):>9.1f}"
+                      f"{percentile(latencies, 0.99):>9.1f}{latencies[-1]:>9.1f}{errors:>8}")
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
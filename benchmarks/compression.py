@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Measure how much smaller archived chunks (app/archive.py) are than the
+readings they replace, and how fast they encode and decode.
+
+Readings that look like a greenhouse's go into sensordata one batch at a
+time: a reading a minute per device with a few hundred milliseconds of
+jitter, temperature and humidity drifting in 0.1 steps around a daily cycle,
+whole-lux light levels and the pump running a few minutes at a time. Then
+every reading is compacted and the benchmark prints the bytes per reading
+in sensordata (table and indexes), in the segment store's records and in
+reading_chunk, the share of each column, and readings per second for
+encoding, decoding and reading back through archive.read_rows. The readings
+read back must match the ones stored. Runs in-process against a throwaway
+database, so it needs no server:
+
+    python -m benchmarks.compression
+    python -m benchmarks.compression --readings 500000 --devices 20
+"""
+
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Point the app at a scratch database before anything imports it
+_scratch = tempfile.mkdtemp(prefix="pi-sensor-bench-")
+os.environ["PI_SENSOR_DB_PATH"] = os.path.join(_scratch, "bench.sqlite")
+# Compaction reads whole blocks; keep their plans out of the table
+os.environ.setdefault("PI_SENSOR_SLOW_QUERY_MS", "0")
+os.environ["PI_SENSOR_READING_STORE"] = "sqlite"
+
+from sqlmodel import select
+
+from app import archive, columnar, ingest, segments
+from app.db import get_read_session, get_session, init_db
+from app.models import ReadingChunk, SensorData
+from app.queries import SENSOR_DATA_COLUMNS, ReadingFilter
+
+def readings(count, devices, start):
+    random.seed(42)
+    state = [[22.0 + device, 55.0, 0] for device in range(devices)]
+    for i in range(count):
+        device = i % devices
+        minute = i // devices
+        temperature, humidity, pump_left = state[device]
+        daylight = max(0.0, math.sin(2 * math.pi * (minute % 1440) / 1440 - math.pi / 2))
+        # Sensors report in 0.1 steps and mostly repeat themselves minute to minute
+        temperature = round(temperature + random.choice((-0.1, 0, 0, 0, 0.1)) + (0.1 if daylight > 0.5 and random.random() < 0.05 else 0), 1)
+        humidity = round(min(95.0, max(25.0, humidity + random.choice((-0.1, 0, 0, 0.1)))), 1)
+        if pump_left == 0 and random.random() < 0.002:
+            pump_left = random.randint(2, 6)
+        state[device] = [temperature, humidity, max(0, pump_left - 1)]
+        yield {
+            "temperature": temperature,
+            "humidity": humidity,
+            "lux": float(round(daylight * 800 + random.uniform(0, 5))),
+            "pump_active": pump_left > 0,
+            "timestamp": minute * 60000 + random.randint(0, 20),
+            "device_id": f"arduino_{device + 1:03d}",
+            "firmware_version": "2.1.0",
+            "sensor_type": "DHT22",
+            "created_at": start + timedelta(minutes=minute, microseconds=random.randint(0, 500000)),
+        }
+
+def seed(rows, batch):
+    for i in range(0, len(rows), batch):
+        with get_session() as session:
+            ingest.insert_sensor_rows(session, [dict(row) for row in rows[i:i + batch]])
+            session.commit()
+
+def table_bytes(name):
+    with get_session() as session:
+        stats = session.connection().exec_driver_sql(
+            "SELECT tbl_name, sum(pgsize) FROM dbstat JOIN sqlite_schema USING (name) GROUP BY tbl_name"
+        ).all()
+    return sum(size for table, size in stats if table == name)
+
+def column_bytes(chunks):
+    """Encoded bytes per column over all chunks, in columnar.COLUMNS order"""
+    return [sum(sizes) for sizes in zip(*(columnar.column_sizes(data) for data in chunks))]
+
+def per_second(func, readings, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return readings / statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark compression of archived readings')
+    parser.add_argument('--readings', type=int, default=200000,
+                        help='Readings seeded and then compacted (default: 200000)')
+    parser.add_argument('--devices', type=int, default=10,
+                        help='Devices the readings are spread over, one a minute each (default: 10)')
+    parser.add_argument('--batch', type=int, default=1000,
+                        help='Readings per seeding transaction (default: 1000)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per throughput measurement; the median is reported (default: 3)')
+    args = parser.parse_args()
+
+    init_db()
+    start = datetime.utcnow() - timedelta(minutes=args.readings // args.devices + 1)
+    seed(list(readings(args.readings, args.devices, start)), args.batch)
+    with get_read_session() as session:
+        stored = [tuple(row) for row in session.execute(
+            select(*SENSOR_DATA_COLUMNS).order_by(SensorData.created_at, SensorData.id)
+        )]
+    sqlite_bytes = table_bytes("sensordata")
+
+    # A cutoff past every block
+    report = archive.compact(get_session, get_read_session, datetime.utcnow() + timedelta(microseconds=archive.BLOCK_US))
+    if report.readings != len(stored):
+        print(f"[ERROR] Compacted {report.readings} readings, expected {len(stored)}")
+        return False
+    chunk_bytes = table_bytes("reading_chunk")
+
+    with get_read_session() as session:
+        chunks = session.execute(select(ReadingChunk.data)).scalars().all()
+        archived = list(archive.read_rows(session, ReadingFilter()))
+    if archived != stored:
+        print("[ERROR] Archived readings don't match the stored ones")
+        return False
+    print(f"[OK] {report.readings} readings in {report.chunks} chunks read back unchanged")
+    print()
+
+    decoded = [columnar.decode_chunk(data) for data in chunks]
+    encode_rate = per_second(lambda: [columnar.encode_chunk(columns) for columns in decoded], report.readings, args.repeat)
+    decode_rate = per_second(lambda: [columnar.decode_chunk(data) for data in chunks], report.readings, args.repeat)
+
+    def read_back():
+        with get_read_session() as session:
+            # Decode every chunk, as a process that hasn't read them yet would
+            archive._decoded.clear()
+            for _ in archive.read_rows(session, ReadingFilter()):
+                pass
+    read_rate = per_second(read_back, report.readings, args.repeat)
+
+    count = report.readings
+    print(f"{'bytes per reading':44}")
+    print(f"{'  sensordata, table and indexes':44}{sqlite_bytes / len(stored):>12.1f}")
+    print(f"{'  segment store records':44}{segments.SIZE:>12.1f}")
+    print(f"{'  reading_chunk, table and indexes':44}{chunk_bytes / count:>12.2f}")
+    print(f"{'  encoded columns only':44}{report.chunk_bytes / count:>12.2f}")
+    for name, size in zip(columnar.COLUMNS, column_bytes(chunks)):
+        print(f"{'    ' + name:44}{size / count:>12.2f}")
+    print(f"{'compression vs sensordata':44}{sqlite_bytes / len(stored) / (chunk_bytes / count):>11.1f}x")
+    print(f"{'compression vs segment records':44}{segments.SIZE / (chunk_bytes / count):>11.1f}x")
+    print(f"{'encode (readings/s)':44}{encode_rate:>12.0f}")
+    print(f"{'decode (readings/s)':44}{decode_rate:>12.0f}")
+    print(f"{'read_rows, decode and merge (readings/s)':44}{read_rate:>12.0f}")
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
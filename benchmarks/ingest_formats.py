@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Compare the JSON and binary ingest encodings: bytes on the wire and server
+CPU per reading.
+
+Runs entirely in-process against a throwaway database, so it needs no server:
+
+    python -m benchmarks.ingest_formats
+    python -m benchmarks.ingest_formats --batch-size 50 --repeat 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Point the app at a scratch database before anything imports it
+_scratch = tempfile.mkdtemp(prefix="pi-sensor-bench-")
+os.environ["PI_SENSOR_DB_PATH"] = os.path.join(_scratch, "bench.sqlite")
+
+from app import binary
+from app.ingest import sensor_row
+from app.models import ArduinoSensorData
+from populate_dummy_data import generate_realistic_sensor_data
+
+DEVICE_ID = "arduino_001"
+
+def make_readings(count):
+    random.seed(42)
+    start = datetime.now() - timedelta(days=1)
+    return [generate_realistic_sensor_data(DEVICE_ID, start + timedelta(minutes=i)) for i in range(count)]
+
+def json_body(readings):
+    # ArduinoJson's serializeJson writes compact JSON
+    payload = readings[0] if len(readings) == 1 else readings
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+def binary_body(readings):
+    first = readings[0]
+    return binary.encode_readings(readings, first["device_id"], first["firmware_version"], first["sensor_type"])
+
+def parse_json(body):
+    payload = json.loads(body)
+    items = payload if isinstance(payload, list) else [payload]
+    return [sensor_row(ArduinoSensorData(**item)) for item in items]
+
+def parse_binary(body):
+    header, records = binary.decode_readings(body)
+    created_at = datetime.utcnow()
+    return [binary.record_row(header, record, created_at) for record in records if binary.is_valid_record(record)]
+
+def cpu_us_per_reading(func, body, readings, repeat):
+    func(body)  # warm up
+    started = time.process_time()
+    for _ in range(repeat):
+        func(body)
+    return (time.process_time() - started) / (repeat * readings) * 1e6
+
+def end_to_end_us_per_reading(readings, repeat):
+    """CPU per reading for a full POST through the app, including the INSERT"""
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    bodies = {
+        "json": ("/api/v1/sensor-data/batch", "application/json", json_body(readings) if len(readings) > 1 else json_body(readings * 2)),
+        "binary": ("/api/v1/sensor-data/binary", binary.CONTENT_TYPE, binary_body(readings if len(readings) > 1 else readings * 2)),
+    }
+    per_body = max(2, len(readings))
+    results = {}
+    with TestClient(app) as client:
+        for name, (url, content_type, body) in bodies.items():
+            client.post(url, content=body, headers={"Content-Type": content_type})
+            started = time.process_time()
+            for _ in range(repeat):
+                response = client.post(url, content=body, headers={"Content-Type": content_type})
+                if response.status_code != 201:
+                    print(f"[ERROR] {name} POST failed: {response.status_code} {response.text}")
+                    sys.exit(1)
+            results[name] = (time.process_time() - started) / (repeat * per_body) * 1e6
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark JSON vs binary sensor ingest')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='Readings per batched body (default: 100)')
+    parser.add_argument('--repeat', type=int, default=1000,
+                        help='Parse iterations per measurement (default: 1000)')
+    parser.add_argument('--http-repeat', type=int, default=50,
+                        help='POSTs per end-to-end measurement (default: 50)')
+    args = parser.parse_args()
+
+    readings = make_readings(args.batch_size)
+    single = readings[:1]
+
+    print("Bytes on the wire per reading (HTTP headers excluded)")
+    print(f"{'':24}{'JSON':>10}{'binary':>10}{'ratio':>8}")
+    for label, batch in (("single reading", single), (f"batch of {len(readings)}", readings)):
+        j, b = len(json_body(batch)) / len(batch), len(binary_body(batch)) / len(batch)
+        print(f"{label:24}{j:>10.1f}{b:>10.1f}{j / b:>7.1f}x")
+
+    print()
+    print("Server CPU per reading, decode + validate + row mapping (us)")
+    print(f"{'':24}{'JSON':>10}{'binary':>10}{'ratio':>8}")
+    for label, batch in (("single reading", single), (f"batch of {len(readings)}", readings)):
+        repeat = args.repeat if len(batch) > 1 else args.repeat * 10
+        j = cpu_us_per_reading(parse_json, json_body(batch), len(batch), repeat)
+        b = cpu_us_per_reading(parse_binary, binary_body(batch), len(batch), repeat)
+        print(f"{label:24}{j:>10.2f}{b:>10.2f}{j / b:>7.1f}x")
+
+    print()
+    print(f"End-to-end CPU per reading, batched POST incl. INSERT (in-process, includes test client) (us)")
+    results = end_to_end_us_per_reading(readings, args.http_repeat)
+    print(f"{'':24}{'JSON':>10}{'binary':>10}{'ratio':>8}")
+    print(f"{f'batch of {len(readings)}':24}{results['json']:>10.2f}{results['binary']:>10.2f}{results['json'] / results['binary']:>7.1f}x")
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Compare the two ways of turning a page of readings into a JSON body:
+
+  model   select SensorData objects and let FastAPI validate and encode them
+          against response_model=List[SensorData] (the old list path)
+  rows    select plain row tuples and encode them directly (app/serialize.py)
+
+Both bodies are checked to decode to the same JSON before timing. Runs
+in-process against a throwaway database, so it needs no server:
+
+    python -m benchmarks.list_serialization
+    python -m benchmarks.list_serialization --rows 20000 --repeat 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+# Point the app at a scratch database before anything imports it
+_scratch = tempfile.mkdtemp(prefix="pi-sensor-bench-")
+os.environ["PI_SENSOR_DB_PATH"] = os.path.join(_scratch, "bench.sqlite")
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from sqlmodel import select
+
+from app import serialize
+from app.db import get_read_session, get_session, init_db
+from app.ingest import insert_sensor_rows
+from app.models import SensorData
+from app.queries import SENSOR_DATA_FIELDS, list_sensor_data_page
+from populate_dummy_data import generate_realistic_sensor_data
+
+DEVICES = ["arduino_001", "arduino_002", "arduino_003"]
+RESPONSE_FIELD = create_model_field(name="Response_list_sensor_data", type_=List[SensorData], mode="serialization")
+
+def seed(count):
+    random.seed(42)
+    start = datetime.utcnow() - timedelta(minutes=count)
+    rows = []
+    for i in range(count):
+        device_id = DEVICES[i % len(DEVICES)]
+        reading = generate_realistic_sensor_data(device_id, start + timedelta(minutes=i))
+        rows.append({
+            "temperature": reading["temperature"],
+            "humidity": reading["humidity"],
+            "lux": reading["lux"],
+            "pump_active": reading["pumpActive"],
+            "timestamp": reading["timestamp"],
+            "device_id": device_id,
+            "firmware_version": reading["firmware_version"],
+            "sensor_type": reading["sensor_type"],
+            "created_at": start + timedelta(minutes=i, microseconds=i),
+        })
+    init_db()
+    with get_session() as session:
+        insert_sensor_rows(session, rows)
+        session.commit()
+
+def model_body(limit):
+    # What FastAPI does with ORM objects returned from a handler with a response_model
+    with get_read_session() as session:
+        stmt = select(SensorData).order_by(SensorData.created_at.desc(), SensorData.id.desc()).limit(limit + 1)
+        objects = session.exec(stmt).all()[:limit]
+        content = asyncio.run(serialize_response(field=RESPONSE_FIELD, response_content=objects))
+    return JSONResponse(content).body
+
+def rows_body(limit):
+    with get_read_session() as session:
+        rows, _ = list_sensor_data_page(session, [], limit)
+    return serialize.rows_json(SENSOR_DATA_FIELDS, rows)
+
+def ms_per_page(func, limit, repeat):
+    func(limit)  # warm up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(limit)
+    return (time.perf_counter() - started) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark list response serialization')
+    parser.add_argument('--rows', type=int, default=5000,
+                        help='Readings to seed (default: 5000)')
+    parser.add_argument('--repeat', type=int, default=30,
+                        help='Pages per measurement (default: 30)')
+    args = parser.parse_args()
+
+    seed(args.rows)
+    orjson = serialize.orjson
+    for limit in (100, 1000):
+        expected = json.loads(model_body(limit))
+        for encoder in (orjson, None):
+            serialize.orjson = encoder
+            if json.loads(rows_body(limit)) != expected:
+                print(f"[ERROR] Bodies differ for a page of {limit} ({'orjson' if encoder else 'json'})")
+                return False
+    serialize.orjson = orjson
+    print("[OK] Both paths produce the same JSON")
+    print()
+
+    print("Query + encode per page, newest readings first (ms)")
+    print(f"{'page size':>10}{'model':>10}{'rows/json':>11}{'rows/orjson':>13}{'speedup':>9}")
+    for limit in (100, 1000):
+        model = ms_per_page(model_body, limit, args.repeat)
+        serialize.orjson = None
+        rows_json = ms_per_page(rows_body, limit, args.repeat)
+        serialize.orjson = orjson
+        rows_orjson = ms_per_page(rows_body, limit, args.repeat) if orjson else float("nan")
+        best = rows_orjson if orjson else rows_json
+        print(f"{limit:>10}{model:>10.2f}{rows_json:>11.2f}{rows_orjson:>13.2f}{model / best:>8.1f}x")
+    if not orjson:
+        print("orjson is not installed; pip install orjson for the last column")
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
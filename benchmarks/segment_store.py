@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Compare the two stores for raw readings (PI_SENSOR_READING_STORE):
+
+  sqlite    the sensordata table and its indexes
+  segments  append-only segment files indexed by reading_segment
+            (app/segments.py)
+
+The same readings go into both stores through ingest.insert_sensor_rows,
+seeded in batches and then written one committed reading at a time. It
+prints the bytes each store uses per reading and milliseconds for the
+reads the endpoints make. Runs in-process against a throwaway database, so
+it needs no server:
+
+    python -m benchmarks.segment_store
+    python -m benchmarks.segment_store --readings 500000 --devices 20
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Point the app at a scratch database before anything imports it
+_scratch = tempfile.mkdtemp(prefix="pi-sensor-bench-")
+os.environ["PI_SENSOR_DB_PATH"] = os.path.join(_scratch, "bench.sqlite")
+# Full exports are slow queries by design; keep their plans out of the table
+os.environ.setdefault("PI_SENSOR_SLOW_QUERY_MS", "0")
+
+from sqlmodel import select
+
+from app import export, ingest, segments
+from app.db import get_read_session, get_session, init_db
+from app.models import SensorData
+from app.queries import SENSOR_DATA_COLUMNS, SENSOR_DATA_FIELDS, ReadingFilter, list_sensor_data_page, sensor_data_filters
+
+# Segments first: their ids then start at 1 like sensordata's, so the stores hold the same readings
+STORES = ("segments", "sqlite")
+SQLITE_TABLES = ("sensordata",)
+SEGMENT_TABLES = ("reading_segment", "reading_tag")
+
+def readings(count, devices, start, interval):
+    random.seed(42)
+    for i in range(count):
+        device = i % devices
+        yield {
+            "temperature": round(20 + random.uniform(-5, 5), 2),
+            "humidity": round(50 + random.uniform(-20, 20), 2),
+            "lux": round(random.uniform(0, 1000), 1),
+            "pump_active": random.random() < 0.1,
+            "timestamp": i // devices * 60000,
+            "device_id": f"arduino_{device + 1:03d}",
+            "firmware_version": "2.1.0",
+            "sensor_type": "DHT22",
+            "created_at": start + i * interval,
+        }
+
+def use(store):
+    # ingest and the read helpers below check the flag on every call
+    segments.ENABLED = store == "segments"
+
+def seed(store, rows, batch):
+    use(store)
+    started = time.perf_counter()
+    for i in range(0, len(rows), batch):
+        with get_session() as session:
+            ingest.insert_sensor_rows(session, [dict(row) for row in rows[i:i + batch]])
+            session.commit()
+    return len(rows) / (time.perf_counter() - started)
+
+def append_one(store, rows):
+    """Milliseconds per reading committed on its own, like a single POST"""
+    use(store)
+    started = time.perf_counter()
+    for row in rows:
+        with get_session() as session:
+            ingest.insert_sensor_rows(session, [dict(row)])
+            session.commit()
+    return (time.perf_counter() - started) / len(rows) * 1000
+
+def table_bytes(names):
+    with get_session() as session:
+        stats = session.connection().exec_driver_sql(
+            "SELECT tbl_name, sum(pgsize) FROM dbstat JOIN sqlite_schema USING (name) GROUP BY tbl_name"
+        ).all()
+    return sum(size for table, size in stats if table in names)
+
+def segment_file_bytes():
+    # Segment files are sparse; count the blocks actually allocated
+    return sum(os.stat(entry.path).st_blocks * 512 for entry in os.scandir(segments.SEGMENT_DIR))
+
+def time_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+def latest_page(store, reading_filter):
+    with get_read_session() as session:
+        if store == "segments":
+            return segments.list_page(session, reading_filter, 100)[0]
+        return list_sensor_data_page(session, sensor_data_filters(*reading_filter), 100)[0]
+
+def deep_page(store, reading_filter, pages):
+    cursor = None
+    for _ in range(pages):
+        with get_read_session() as session:
+            if store == "segments":
+                rows, cursor = segments.list_page(session, reading_filter, 100, cursor)
+            else:
+                rows, cursor = list_sensor_data_page(session, sensor_data_filters(*reading_filter), 100, cursor)
+    return rows
+
+def range_rows(store, reading_filter):
+    with get_read_session() as session:
+        if store == "segments":
+            return list(segments.read_rows(session, reading_filter))
+        stmt = (
+            select(*SENSOR_DATA_COLUMNS)
+            .where(*sensor_data_filters(*reading_filter))
+            .order_by(SensorData.created_at, SensorData.id)
+        )
+        return session.execute(stmt).all()
+
+def by_id(store, ids):
+    with get_read_session() as session:
+        if store == "segments":
+            readings = [segments.get_reading(session, sensor_id) for sensor_id in ids]
+        else:
+            readings = [session.get(SensorData, sensor_id) for sensor_id in ids]
+        return [tuple(getattr(reading, field) for field in SENSOR_DATA_FIELDS) for reading in readings]
+
+def export_rows(store):
+    chunks = export.iter_segment_rows(ReadingFilter()) if store == "segments" else export.iter_sensor_rows([])
+    return [row for rows in chunks for row in rows]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the sqlite and segment reading stores')
+    parser.add_argument('--readings', type=int, default=200000,
+                        help='Readings seeded into each store (default: 200000)')
+    parser.add_argument('--devices', type=int, default=10,
+                        help='Devices the readings are spread over (default: 10)')
+    parser.add_argument('--days', type=int, default=30,
+                        help='Days the readings cover (default: 30)')
+    parser.add_argument('--batch', type=int, default=1000,
+                        help='Readings per seeding transaction (default: 1000)')
+    parser.add_argument('--singles', type=int, default=500,
+                        help='Readings then written one per transaction (default: 500)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per read measurement; the median is reported (default: 5)')
+    args = parser.parse_args()
+
+    init_db()
+    start = datetime.utcnow() - timedelta(days=args.days)
+    interval = timedelta(days=args.days) / (args.readings + args.singles)
+    all_rows = list(readings(args.readings + args.singles, args.devices, start, interval))
+    seeded, singles = all_rows[:args.readings], all_rows[args.readings:]
+
+    results = {}
+    for store in STORES:
+        results[store] = {"batch seeding (readings/s)": seed(store, seeded, args.batch)}
+        results[store]["single reading (ms)"] = append_one(store, singles)
+    stored = {
+        "sqlite": table_bytes(SQLITE_TABLES),
+        "segments": table_bytes(SEGMENT_TABLES) + segment_file_bytes(),
+    }
+
+    device = ReadingFilter(device_id="arduino_001")
+    day = ReadingFilter(device_id="arduino_001", start=start + timedelta(days=args.days // 2),
+                        end=start + timedelta(days=args.days // 2 + 1))
+    with get_read_session() as session:
+        ids = random.sample(session.execute(select(SensorData.id)).scalars().all(), 1000)
+    reads = {
+        "latest page, all devices": lambda store: latest_page(store, ReadingFilter()),
+        "latest page, one device": lambda store: latest_page(store, device),
+        "50th page, one device": lambda store: deep_page(store, device, 50),
+        "one device, one day": lambda store: range_rows(store, day),
+        "1000 readings by id": lambda store: by_id(store, ids),
+        "full export": export_rows,
+    }
+
+    expected = len(all_rows)
+    for store in STORES:
+        use(store)
+        exported = export_rows(store)
+        if len(exported) != expected:
+            print(f"[ERROR] {store}: exported {len(exported)} readings, expected {expected}")
+            return False
+        for name, func in reads.items():
+            results[store][f"{name} (ms)"] = time_ms(lambda: func(store), args.repeat)
+    for name, func in reads.items():
+        returned = []
+        for store in STORES:
+            use(store)
+            returned.append([tuple(row) for row in func(store)])
+        if returned[0] != returned[1]:
+            print(f"[ERROR] {name}: the stores returned different readings")
+            return False
+    print(f"[OK] Both stores return the same {expected} readings")
+    print()
+
+    print(f"{'':32}" + "".join(f"{store:>14}" for store in STORES))
+    print(f"{'bytes per reading':32}" + "".join(f"{stored[store] / expected:>14.1f}" for store in STORES))
+    for name in results[STORES[0]]:
+        print(f"{name:32}" + "".join(f"{results[store][name]:>14.2f}" for store in STORES))
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Load and latency benchmark for the whole app, run in-process.
+
+Simulated devices post readings and poll their watering state, now and then
+toggling the pump; simulated dashboards poll the list, device overview and
+history endpoints with If-None-Match, as the browser does. Requests go
+through httpx's ASGI transport to the app on a throwaway database, so no
+server or network is involved and the numbers measure the app itself.
+Client and app share one event loop and one core, so absolute latencies
+include the client's own overhead; compare runs made the same way.
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite --devices 50 --dashboards 5 --duration 30
+    python -m benchmarks.suite --save benchmarks/baseline.json
+    python -m benchmarks.suite --compare benchmarks/baseline.json
+
+--compare exits non-zero when an endpoint's p95 latency or throughput is
+worse than the baseline by more than --threshold percent.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+try:
+    import httpx
+except ImportError:
+    print("Error: 'httpx' module not found!")
+    print("Please install it with: pip install httpx")
+    sys.exit(1)
+
+# Point the app at a scratch database before anything imports it
+_scratch = tempfile.mkdtemp(prefix="pi-sensor-bench-")
+os.environ["PI_SENSOR_DB_PATH"] = os.path.join(_scratch, "bench.sqlite")
+
+from app.main import app
+from populate_dummy_data import generate_realistic_sensor_data
+
+BASE_URL = "http://bench"
+# Endpoints with fewer requests than this in either run are too noisy to call a regression
+MIN_SAMPLES = 50
+
+class Recorder:
+    """Latencies and failures per endpoint"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.not_modified = defaultdict(int)
+
+    async def request(self, client, name, method, url, etags=None, **kwargs):
+        headers = kwargs.pop("headers", {})
+        if etags is not None and url in etags:
+            headers["If-None-Match"] = etags[url]
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, headers=headers, **kwargs)
+        except httpx.HTTPError:
+            self.errors[name] += 1
+            return None
+        self.latencies[name].append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            self.errors[name] += 1
+        elif response.status_code == 304:
+            self.not_modified[name] += 1
+        elif etags is not None and "etag" in response.headers:
+            etags[url] = response.headers["etag"]
+        return response
+
+def device_ids(count):
+    return [f"arduino_{i + 1:03d}" for i in range(count)]
+
+async def seed(client, devices, readings_per_device):
+    random.seed(42)
+    start = datetime.now() - timedelta(days=1)
+    for device_id in devices:
+        readings = [generate_realistic_sensor_data(device_id, start + timedelta(minutes=i)) for i in range(readings_per_device)]
+        for i in range(0, len(readings), 1000):
+            (await client.post("/api/v1/sensor-data/batch", json=readings[i:i + 1000])).raise_for_status()
+        (await client.get(f"/api/v1/watering/{device_id}")).raise_for_status()
+
+async def device(client, recorder, device_id, stop_at, think, watering_rate):
+    # Like an ESP32: post a reading, check whether the pump should run, repeat
+    etags = {}
+    pump_active = False
+    # Rounds come faster than one a second, and a repeated device timestamp would be dropped as a resend
+    device_timestamp = int(time.time())
+    while time.perf_counter() < stop_at:
+        reading = generate_realistic_sensor_data(device_id, datetime.now())
+        reading["timestamp"] = device_timestamp
+        device_timestamp += 1
+        await recorder.request(client, "POST /api/v1/sensor-data", "POST", "/api/v1/sensor-data", json=reading)
+        await recorder.request(client, "GET /api/v1/watering/{device_id}", "GET", f"/api/v1/watering/{device_id}", etags)
+        if random.random() < watering_rate:
+            pump_active = not pump_active
+            await recorder.request(client, "PUT /api/v1/watering", "PUT", "/api/v1/watering",
+                                   json={"device_id": device_id, "pump_active": pump_active})
+        await asyncio.sleep(think)
+
+async def dashboard(client, recorder, devices, stop_at, think):
+    # Like an open dashboard tab polling the overview, one device's readings and its history
+    etags = {}
+    while time.perf_counter() < stop_at:
+        device_id = random.choice(devices)
+        await recorder.request(client, "GET /api/v1/devices/latest", "GET", "/api/v1/devices/latest", etags)
+        await recorder.request(client, "GET /api/v1/sensor-data", "GET",
+                               f"/api/v1/sensor-data?device_id={device_id}&limit=100", etags)
+        await recorder.request(client, "GET /api/v1/watering-history", "GET",
+                               f"/api/v1/watering-history?device_id={device_id}&limit=50", etags)
+        await recorder.request(client, "GET /api/v1/sensor-data/aggregate", "GET",
+                               f"/api/v1/sensor-data/aggregate?device_id={device_id}&bucket=1h")
+        await asyncio.sleep(think)
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def summarize(recorder, elapsed):
+    results = {}
+    for name in sorted(set(recorder.latencies) | set(recorder.errors)):
+        latencies = sorted(recorder.latencies[name])
+        results[name] = {
+            "requests": len(latencies),
+            "errors": recorder.errors[name],
+            "not_modified": recorder.not_modified[name],
+            "rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.50), 2) if latencies else None,
+            "p95_ms": round(percentile(latencies, 0.95), 2) if latencies else None,
+            "p99_ms": round(percentile(latencies, 0.99), 2) if latencies else None,
+        }
+    return results
+
+async def run(args):
+    devices = device_ids(args.devices)
+    transport = httpx.ASGITransport(app=app)
+    # ASGITransport doesn't send lifespan events, so run startup and shutdown here
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url=BASE_URL, timeout=60) as client:
+            await seed(client, devices, args.seed_readings)
+            recorder = Recorder()
+            started = time.perf_counter()
+            stop_at = started + args.duration
+            think = args.think_ms / 1000
+            await asyncio.gather(
+                *(device(client, recorder, d, stop_at, think, args.watering_rate) for d in devices),
+                *(dashboard(client, recorder, devices, stop_at, think) for _ in range(args.dashboards)),
+            )
+            elapsed = time.perf_counter() - started
+    return summarize(recorder, elapsed)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results):
+    print(f"{'endpoint':36}{'requests':>9}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'304s':>7}{'errors':>8}")
+    for name, r in results.items():
+        if not r["requests"]:
+            print(f"{name:36}{0:>9}{'-':>8}{'-':>9}{'-':>9}{'-':>9}{'-':>7}{r['errors']:>8}")
+            continue
+        print(f"{name:36}{r['requests']:>9}{r['rps']:>8.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+              f"{r['p99_ms']:>9.1f}{r['not_modified']:>7}{r['errors']:>8}")
+
+def run_options(args):
+    return {k: v for k, v in vars(args).items() if k not in ("save", "compare", "threshold")}
+
+def compare(results, baseline, options, threshold):
+    """Print changes against a saved run; returns False if anything regressed past the threshold"""
+    ok = True
+    print(f"Compared with {baseline['meta'].get('commit') or 'baseline'} ({baseline['meta']['date']}), threshold {threshold:.0f}%")
+    changed = {k: (baseline["meta"]["args"].get(k), v) for k, v in options.items() if baseline["meta"]["args"].get(k) != v}
+    if changed:
+        print("Warning: the baseline ran with different options: "
+              + ", ".join(f"{k} {old} -> {new}" for k, (old, new) in changed.items()))
+    print(f"{'endpoint':36}{'req/s':>18}{'p95 ms':>20}")
+    for name, r in results.items():
+        base = baseline["results"].get(name)
+        if not base or not base["requests"] or not r["requests"]:
+            continue
+        rps_change = (r["rps"] - base["rps"]) / base["rps"] * 100
+        p95_change = (r["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100
+        if min(r["requests"], base["requests"]) < MIN_SAMPLES:
+            note = "  (too few requests to judge)"
+        elif rps_change < -threshold or p95_change > threshold:
+            note = "  [REGRESSION]"
+            ok = False
+        else:
+            note = ""
+        print(f"{name:36}{base['rps']:>8.1f} -> {r['rps']:<8.1f}{base['p95_ms']:>9.1f} -> {r['p95_ms']:<9.1f}{note}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description='Load and latency benchmark for Pi Sensor Backend')
+    parser.add_argument('--devices', type=int, default=10,
+                        help='Simulated devices posting readings and polling watering state (default: 10)')
+    parser.add_argument('--dashboards', type=int, default=2,
+                        help='Simulated dashboard tabs polling the read endpoints (default: 2)')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Seconds to run the load for (default: 10)')
+    parser.add_argument('--think-ms', type=float, default=0,
+                        help='Pause between each client\'s rounds; 0 is as fast as possible (default: 0)')
+    parser.add_argument('--watering-rate', type=float, default=0.05,
+                        help='Chance per device round of toggling the pump (default: 0.05)')
+    parser.add_argument('--seed-readings', type=int, default=1000,
+                        help='Readings stored per device before measuring (default: 1000)')
+    parser.add_argument('--save', metavar='PATH', help='Write the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='PATH', help='Compare with a saved JSON baseline')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='Percent change in req/s or p95 counted as a regression (default: 10)')
+    args = parser.parse_args()
+
+    print(f"Running {args.devices} devices and {args.dashboards} dashboards for {args.duration:.0f}s...")
+    results = asyncio.run(run(args))
+    print()
+    print_results(results)
+
+    ok = True
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        ok = compare(results, baseline, run_options(args), args.threshold)
+    if args.save:
+        meta = {
+            "commit": git_commit(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "args": run_options(args),
+        }
+        with open(args.save, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+        print(f"\n[OK] Results saved to {args.save}")
+    if any(r["errors"] for r in results.values()):
+        print("\n[ERROR] Some requests failed")
+        return False
+    if not ok:
+        print("\n[ERROR] Performance regressed past the threshold")
+    return ok
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Compare the two ways PUT /api/v1/watering applies a pump change:
+
+  legacy  commit the new device row on its own, search for the newest open
+          history record on pump-off, and read the row back after commit
+          (the old update_watering_data)
+  single  one transaction, closing the open record by the id kept on the
+          device row (app/watering.py)
+
+For each kind of update -- a device's first, pump on, pump off -- it prints
+the SQL statements, commits and milliseconds per update, counted with
+app/querystats.py. Runs in-process against a throwaway database, so it
+needs no server:
+
+    python -m benchmarks.watering_updates
+    python -m benchmarks.watering_updates --devices 200 --history 50000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Point the app at a scratch database before anything imports it
+_scratch = tempfile.mkdtemp(prefix="pi-sensor-bench-")
+os.environ["PI_SENSOR_DB_PATH"] = os.path.join(_scratch, "bench.sqlite")
+
+from sqlalchemy import insert
+from sqlmodel import select
+
+from app import metrics, querystats, watering
+from app.db import get_session, init_db
+from app.models import WateringData, WateringHistory
+
+def seed_history(count, devices):
+    # Finished sessions, so the open-record search has an index to walk past
+    random.seed(42)
+    start = datetime.utcnow() - timedelta(days=365)
+    rows = []
+    for i in range(count):
+        started = start + timedelta(minutes=i * 10)
+        rows.append({
+            "device_id": random.choice(devices),
+            "watering_duration": 30,
+            "auto_watering": True,
+            "watering_started": started,
+            "watering_ended": started + timedelta(seconds=30),
+            "created_at": started,
+        })
+    with get_session() as session:
+        for i in range(0, len(rows), 1000):
+            session.execute(insert(WateringHistory), rows[i:i + 1000])
+        session.commit()
+
+def legacy_update(device_id, changes):
+    # update_watering_data before app/watering.py, without the cache and version bookkeeping
+    with get_session() as session:
+        watering_data = session.get(WateringData, device_id)
+        if not watering_data:
+            watering_data = WateringData(device_id=device_id)
+            session.add(watering_data)
+            session.commit()
+            session.refresh(watering_data)
+        old_pump_active = watering_data.pump_active
+        new_pump_active = changes.get("pump_active")
+        for k, v in changes.items():
+            if k != "device_id":
+                setattr(watering_data, k, v)
+        watering_data.timestamp = datetime.utcnow().timestamp()
+        if old_pump_active != new_pump_active and new_pump_active is not None:
+            current_time = datetime.utcnow()
+            if new_pump_active and not old_pump_active:
+                session.add(WateringHistory(
+                    device_id=device_id,
+                    watering_duration=watering_data.watering_duration,
+                    auto_watering=watering_data.auto_watering,
+                    watering_started=current_time,
+                    watering_ended=None,
+                ))
+            elif not new_pump_active and old_pump_active:
+                latest_history = session.exec(
+                    select(WateringHistory)
+                    .where(WateringHistory.device_id == device_id)
+                    .where(WateringHistory.watering_ended.is_(None))
+                    .order_by(WateringHistory.watering_started.desc())
+                ).first()
+                if latest_history:
+                    latest_history.watering_ended = current_time
+                    session.add(latest_history)
+        session.add(watering_data)
+        session.commit()
+        session.refresh(watering_data)
+        return watering_data
+
+def single_update(device_id, changes):
+    with get_session() as session:
+        watering_data = watering.apply_update(session, device_id, changes)
+        session.expire_on_commit = False
+        session.commit()
+        return watering_data
+
+def commit_count():
+    return sum(sum(child.counts) for child in metrics.db_commits.children.values())
+
+def measure(func, devices, pump_active):
+    querystats.reset()
+    commits = commit_count()
+    started = time.perf_counter()
+    for device_id in devices:
+        func(device_id, {"device_id": device_id, "pump_active": pump_active})
+    elapsed = time.perf_counter() - started
+    statements = sum(s["count"] for s in querystats.top(querystats.MAX_STATEMENTS))
+    n = len(devices)
+    return statements / n, (commit_count() - commits) / n, elapsed / n * 1000
+
+def check(devices):
+    """Every device's pump is off and none of its history records is left open"""
+    with get_session() as session:
+        states = session.exec(select(WateringData).where(WateringData.device_id.in_(devices))).all()
+        open_records = session.exec(
+            select(WateringHistory.id)
+            .where(WateringHistory.device_id.in_(devices))
+            .where(WateringHistory.watering_ended.is_(None))
+        ).all()
+    return len(states) == len(devices) and not any(s.pump_active for s in states) and not open_records
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark watering state updates')
+    parser.add_argument('--devices', type=int, default=100,
+                        help='Devices updated per measurement (default: 100)')
+    parser.add_argument('--history', type=int, default=20000,
+                        help='Finished watering records to seed (default: 20000)')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='Pump on/off rounds per device (default: 5)')
+    args = parser.parse_args()
+
+    init_db()
+    paths = {"legacy": legacy_update, "single": single_update}
+    fleets = {name: [f"{name}_{i + 1:03d}" for i in range(args.devices)] for name in paths}
+    seed_history(args.history, fleets["legacy"] + fleets["single"])
+
+    results = {}
+    for name, func in paths.items():
+        devices = fleets[name]
+        # The first update creates the device row and starts its pump
+        rows = {"first update (pump on)": [measure(func, devices, True)]}
+        measure(func, devices, False)
+        for _ in range(args.rounds):
+            rows.setdefault("pump on", []).append(measure(func, devices, True))
+            rows.setdefault("pump off", []).append(measure(func, devices, False))
+        if not check(devices):
+            print(f"[ERROR] {name}: pumps left running or history records left open")
+            return False
+        results[name] = {kind: min(samples, key=lambda s: s[2]) for kind, samples in rows.items()}
+    print("[OK] Both paths leave every pump off and every history record closed")
+    print()
+
+    print("Per update: SQL statements (incl. BEGIN), commits, ms (best round)")
+    print(f"{'update':24}{'legacy':>20}{'single':>20}")
+    for kind in results["legacy"]:
+        cells = []
+        for name in paths:
+            statements, commits, ms = results[name][kind]
+            cells.append(f"{statements:>5.1f} / {commits:.0f} / {ms:>5.2f}")
+        print(f"{kind:24}{cells[0]:>20}{cells[1]:>20}")
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
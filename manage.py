@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Maintenance commands that work directly on the local database.
+Uses the same PI_SENSOR_* settings as the server (e.g. PI_SENSOR_DB_PATH).
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+
+from app.config import settings
+from app.db import engine, init_db, get_read_session, get_session
+from app import archive, dedup, rollups, segments
+from app.retention import RetentionEngine, incremental_vacuum, parse_duration, parse_policy
+
+def rebuild_rollups(args):
+    """Recompute the 1m/1h/1d rollups from the raw sensor readings"""
+    print("Rebuilding sensor rollups...")
+    started = time.perf_counter()
+    high_water_mark = rollups.rebuild(get_session, args.chunk_size)
+    print(f"[OK] Rollups rebuilt up to reading #{high_water_mark} in {time.perf_counter() - started:.1f}s")
+    return True
+
+def run_retention(args):
+    """Apply the retention policy once and report what was purged"""
+    rules = parse_policy(args.policy if args.policy is not None else settings.retention)
+    if not rules:
+        print("[ERROR] No retention policy. Set PI_SENSOR_RETENTION or pass --policy")
+        return False
+    print("Applying retention policy:", ", ".join(str(rule) for rule in rules))
+    report = RetentionEngine(get_session, rules, args.chunk_size).run()
+    for table, count in report.rows_purged.items():
+        print(f"   {table}: {count} rows purged")
+    print(f"[OK] Reclaimed {report.pages_reclaimed} pages in {report.duration_s:.1f}s")
+    return True
+
+def dedup_readings(args):
+    """Delete repeated readings (same device and timestamp) and add the unique key that stops them"""
+    if dedup.index_exists(get_session):
+        print("[OK] Readings are already unique per device and timestamp")
+        return True
+    print("Removing duplicate readings...")
+    report = dedup.dedup(get_session, get_read_session, args.chunk_size)
+    print(f"   {report.rows_deleted} extra copies of {report.duplicate_readings} readings deleted")
+    if not report.index_created:
+        print(f"[ERROR] New duplicates kept arriving; unique key not created after {dedup.MAX_ATTEMPTS} passes")
+        return False
+    print(f"[OK] Unique key created in {report.duration_s:.1f}s; the server picks it up within a minute")
+    if report.rows_deleted:
+        print("   Rollups still count the deleted copies: python manage.py rebuild-rollups")
+    return True
+
+def move_to_segments(args):
+    """Move the readings in sensordata to the segment store, keeping their ids"""
+    if not segments.ENABLED:
+        print("[ERROR] Set PI_SENSOR_READING_STORE=segments first; the server wouldn't read the moved readings")
+        return False
+    print(f"Moving readings to {segments.SEGMENT_DIR}; stop the server first...")
+    started = time.perf_counter()
+    moved = segments.move_from_sqlite(get_session, args.chunk_size)
+    pages = incremental_vacuum(get_session)
+    print(f"[OK] Moved {moved} readings and reclaimed {pages} pages in {time.perf_counter() - started:.1f}s")
+    if moved and not pages:
+        print("   To shrink the database file: python manage.py enable-incremental-vacuum")
+    return True
+
+def compact_readings(args):
+    """Compress readings older than the archive age into chunks now"""
+    age = args.age if args.age is not None else settings.archive_age
+    if not age:
+        print("[ERROR] No archive age. Set PI_SENSOR_ARCHIVE_AGE or pass --age")
+        return False
+    print(f"Compacting readings older than {age}...")
+    report = archive.compact(get_session, get_read_session, datetime.utcnow() - parse_duration(age))
+    pages = incremental_vacuum(get_session)
+    print(f"   {report.readings} readings in {report.chunks} chunks of {report.chunk_bytes} bytes")
+    if report.more:
+        print("[ERROR] Readings kept changing while they were compacted; run it again")
+        return False
+    print(f"[OK] Compacted and reclaimed {pages} pages in {report.duration_s:.1f}s")
+    if report.readings and not pages:
+        print("   To shrink the database file: python manage.py enable-incremental-vacuum")
+    return True
+
+def enable_incremental_vacuum(args):
+    """Switch an existing database to auto_vacuum=INCREMENTAL (rewrites the whole file)"""
+    with get_session() as session:
+        mode = session.connection().exec_driver_sql("PRAGMA auto_vacuum").scalar()
+    if mode == 2:
+        print("[OK] Incremental vacuum is already enabled")
+        return True
+    print("Rewriting the database with VACUUM; stop the server first and expect this to take a while...")
+    # VACUUM cannot run inside a transaction, so bypass the session's BEGIN
+    raw = engine.raw_connection()
+    try:
+        raw.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        raw.execute("VACUUM")
+    finally:
+        raw.close()
+    print("[OK] Incremental vacuum enabled")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description='Pi Sensor Backend maintenance commands')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    rebuild = subparsers.add_parser('rebuild-rollups', help='Recompute rollup tables from raw readings')
+    rebuild.add_argument('--chunk-size', type=int, default=rollups.CATCH_UP_CHUNK,
+                         help=f'Readings per transaction (default: {rollups.CATCH_UP_CHUNK})')
+    rebuild.set_defaults(func=rebuild_rollups)
+
+    retention = subparsers.add_parser('retention', help='Apply the retention policy now')
+    retention.add_argument('--policy', default=None,
+                           help='Policy to apply instead of PI_SENSOR_RETENTION, e.g. "sensordata=30d"')
+    retention.add_argument('--chunk-size', type=int, default=settings.retention_chunk_size,
+                           help=f'Rows deleted per transaction (default: {settings.retention_chunk_size})')
+    retention.set_defaults(func=run_retention)
+
+    dedup_parser = subparsers.add_parser('dedup', help='Delete duplicate readings and enforce one per device and timestamp')
+    dedup_parser.add_argument('--chunk-size', type=int, default=settings.retention_chunk_size,
+                              help=f'Readings cleaned up per transaction (default: {settings.retention_chunk_size})')
+    dedup_parser.set_defaults(func=dedup_readings)
+
+    move = subparsers.add_parser('move-to-segments',
+                                 help='Move readings from sensordata to the segment store (PI_SENSOR_READING_STORE=segments)')
+    move.add_argument('--chunk-size', type=int, default=rollups.CATCH_UP_CHUNK,
+                      help=f'Readings moved per transaction (default: {rollups.CATCH_UP_CHUNK})')
+    move.set_defaults(func=move_to_segments)
+
+    compact = subparsers.add_parser('compact', help='Compress old readings into archive chunks now')
+    compact.add_argument('--age', default=None,
+                         help='Compact readings older than this instead of PI_SENSOR_ARCHIVE_AGE, e.g. "30d"')
+    compact.set_defaults(func=compact_readings)
+
+    vacuum = subparsers.add_parser('enable-incremental-vacuum',
+                                   help='Convert an existing database so retention can shrink the file')
+    vacuum.set_defaults(func=enable_incremental_vacuum)
+
+    args = parser.parse_args()
+
+    # Make sure the schema is current before touching it
+    init_db()
+    return args.func(args)
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
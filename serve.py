@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Run the backend with several uvicorn workers and a single writer process.
+
+The writer (python -m app.writer_service) is started first and owns every
+sensor insert, migrations, rollups, retention and the UDP listener. The
+workers answer requests and forward readings to it over a Unix socket in
+--run-dir, so only one process ever commits ingest traffic.
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import uvicorn
+
+def wait_for_socket(path, writer, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            return True
+        if writer.poll() is not None:
+            return False
+        time.sleep(0.1)
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(description='Run Pi Sensor Backend with multiple workers')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of uvicorn worker processes (default: CPU count)')
+    parser.add_argument('--host', default='0.0.0.0', help='Address to bind (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=8000, help='Port to bind (default: 8000)')
+    parser.add_argument('--run-dir', default=os.environ.get('PI_SENSOR_RUN_DIR', '/tmp/pi-sensor'),
+                        help='Directory for the writer socket and shared state (default: /tmp/pi-sensor)')
+    parser.add_argument('--timeout-graceful-shutdown', type=int, default=5,
+                        help='Seconds to wait for open event streams on shutdown (default: 5)')
+    args = parser.parse_args()
+
+    os.makedirs(args.run_dir, mode=0o700, exist_ok=True)
+    os.environ['PI_SENSOR_RUN_DIR'] = os.path.abspath(args.run_dir)
+    socket_path = os.path.join(os.environ['PI_SENSOR_RUN_DIR'], 'writer.sock')
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    writer = subprocess.Popen([sys.executable, '-m', 'app.writer_service'])
+    if not wait_for_socket(socket_path, writer, timeout=30):
+        print("[ERROR] Writer process did not start")
+        writer.kill()
+        return False
+    print(f"[OK] Writer process {writer.pid} listening on {socket_path}")
+
+    try:
+        uvicorn.run(
+            'app.main:app',
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            timeout_graceful_shutdown=args.timeout_graceful_shutdown,
+        )
+    finally:
+        # Workers are gone, so nothing new can reach the writer; let it commit what it holds
+        writer.send_signal(signal.SIGTERM)
+        try:
+            writer.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            print("[ERROR] Writer process did not stop; killing it")
+            writer.kill()
+            return False
+    return writer.returncode == 0
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
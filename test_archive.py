@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Test script for archived readings.
+Stores readings through the HTTP API, waits until the server has compacted
+them into compressed chunks, and checks that listing, paging, lookups by id
+and export return exactly what they returned before, that edits are refused,
+and that new readings never get an archived reading's id.
+
+Start the server with an archive age of a second first, e.g.:
+    PI_SENSOR_ARCHIVE_AGE=1s PI_SENSOR_ARCHIVE_BLOCK_S=1 PI_SENSOR_ARCHIVE_INTERVAL_S=1 uvicorn app.main:app --host 0.0.0.0 --port 8000
+"""
+
+import sys
+import time
+import argparse
+
+try:
+    import requests
+except ImportError:
+    print("Error: 'requests' module not found!")
+    print("Please install it with: pip install requests")
+    print("   Or install all requirements: pip install -r requirements.txt")
+    sys.exit(1)
+
+# Seconds to wait for the server to archive the readings
+ARCHIVE_TIMEOUT_S = 30
+
+def get_args():
+    """Get the server address from command line arguments or use defaults"""
+    parser = argparse.ArgumentParser(description='Test the Pi Sensor Backend archive')
+    parser.add_argument('--url', default='http://192.168.68.78:8000',
+                       help='Base URL of the API server (default: http://192.168.68.78:8000)')
+    parser.add_argument('--local', action='store_true',
+                       help='Use localhost instead of Pi IP')
+
+    args = parser.parse_args()
+
+    if args.local:
+        args.url = 'http://127.0.0.1:8000'
+    return args
+
+def reading(device_id, timestamp, temperature):
+    return {"temperature": temperature, "humidity": 50.0, "lux": 300.0, "pumpActive": timestamp % 3 == 0,
+            "timestamp": timestamp, "device_id": device_id, "firmware_version": "1.0.0", "sensor_type": "DHT22"}
+
+def list_all(api, params):
+    rows, cursor = [], None
+    while True:
+        page = dict(params, limit=3)
+        if cursor:
+            page["cursor"] = cursor
+        response = requests.get(f"{api}/sensor-data", params=page)
+        if response.status_code != 200:
+            return None
+        rows += response.json()
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return rows
+
+def snapshot(api, device_id, ids):
+    return {
+        "pages": list_all(api, {"device_id": device_id}),
+        "pumping": list_all(api, {"device_id": device_id, "pump_active": "true"}),
+        "readings": [requests.get(f"{api}/sensor-data/{sensor_id}").json() for sensor_id in ids],
+        "export": requests.get(f"{api}/sensor-data/export", params={"device_id": device_id, "format": "ndjson"}).text,
+    }
+
+def test_archive(base_url):
+    """Test the archive"""
+
+    api = f"{base_url}/api/v1"
+    # A device of its own, so earlier runs never look like duplicates
+    device_id = f"archive_test_{int(time.time())}"
+    now = int(time.time())
+    print(f"Testing the archive at {base_url}")
+    print("=" * 50)
+
+    # Test 1: Readings are stored
+    print("1. Creating readings...")
+    try:
+        response = requests.post(f"{api}/sensor-data/batch", json=[reading(device_id, now + i, 20.0 + i / 10) for i in range(10)])
+    except requests.exceptions.ConnectionError:
+        print("[ERROR] Cannot connect to server. Make sure it's running!")
+        return False
+    if response.status_code != 201 or response.json()["created"] != 10:
+        print("[ERROR] Failed to create readings:", response.status_code, response.text)
+        return False
+    ids = [item["id"] for item in response.json()["items"]]
+    before = snapshot(api, device_id, ids)
+    print("[OK] Created readings", ids[0], "to", ids[-1])
+
+    # Test 2: The server archives them
+    print("2. Waiting for the readings to be archived...")
+    started = time.time()
+    # An empty update changes nothing while the reading is live and is refused once it's archived
+    while requests.put(f"{api}/sensor-data/{ids[0]}", json={}).status_code != 405:
+        if time.time() - started > ARCHIVE_TIMEOUT_S:
+            print("[ERROR] Readings weren't archived. Set PI_SENSOR_ARCHIVE_AGE=1s PI_SENSOR_ARCHIVE_BLOCK_S=1 PI_SENSOR_ARCHIVE_INTERVAL_S=1 when starting the server")
+            return False
+        time.sleep(1)
+    if requests.delete(f"{api}/sensor-data/{ids[-1]}").status_code != 405:
+        print("[ERROR] An archived reading could be deleted")
+        return False
+    print(f"[OK] Archived after {time.time() - started:.0f}s and edits are refused")
+
+    # Test 3: Reads return what they did before
+    print("3. Reading the archived readings back...")
+    after = snapshot(api, device_id, ids)
+    for name in before:
+        if after[name] != before[name]:
+            print(f"[ERROR] {name} changed after archiving:", before[name], after[name])
+            return False
+    if [row["id"] for row in after["pages"]] != ids[::-1]:
+        print("[ERROR] Unexpected pages:", after["pages"])
+        return False
+    if requests.get(f"{api}/sensor-data/{max(ids) + 1000000}").status_code != 404:
+        print("[ERROR] Missing reading wasn't a 404")
+        return False
+    print("[OK] Pages, lookups and export unchanged")
+
+    # Test 4: Ids aren't handed out again
+    print("4. Creating a reading once every live reading is gone...")
+    # Wait until nothing is live, then delete whatever a concurrent writer adds meanwhile
+    while True:
+        live = requests.get(f"{api}/sensor-data", params={"limit": 100}).json()
+        deletable = [row["id"] for row in live if requests.delete(f"{api}/sensor-data/{row['id']}").status_code == 204]
+        if not deletable:
+            break
+    response = requests.post(f"{api}/sensor-data", json=reading(device_id, now + 100, 30.0))
+    if response.status_code != 201:
+        print("[ERROR] Failed to create reading:", response.status_code, response.text)
+        return False
+    new_id = response.json()["id"]
+    requests.delete(f"{api}/sensor-data/{new_id}")
+    if new_id <= max(ids):
+        print(f"[ERROR] New reading got id {new_id}, not above the archived {max(ids)}")
+        return False
+    print("[OK] New reading got id", new_id)
+
+    print("\nAll tests passed! The archive is working correctly.")
+    return True
+
+if __name__ == "__main__":
+    args = get_args()
+    success = test_archive(args.url)
+    if not success:
+        print("\nMake sure to:")
+        print("   1. Install dependencies: pip install -r requirements.txt")
+        print("   2. Start the server with a short archive age: PI_SENSOR_ARCHIVE_AGE=1s PI_SENSOR_ARCHIVE_BLOCK_S=1 PI_SENSOR_ARCHIVE_INTERVAL_S=1 uvicorn app.main:app --host 0.0.0.0 --port 8000")
+        print("   3. Update the IP address in this script or use --local flag")
+        print("\nUsage examples:")
+        print("   python test_archive.py --local                    # Test localhost")
+        print("   python test_archive.py --url http://192.168.1.100:8000")
+        exit(1)
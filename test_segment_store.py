@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Test script for the segment store.
+Stores readings through the HTTP API and checks that listing, paging, lookups
+by id, export and duplicate detection behave as they do with sqlite, and that
+edits are refused.
+
+Start the server in segment mode first, e.g.:
+    PI_SENSOR_READING_STORE=segments uvicorn app.main:app --host 0.0.0.0 --port 8000
+"""
+
+import sys
+import json
+import time
+import argparse
+
+try:
+    import requests
+except ImportError:
+    print("Error: 'requests' module not found!")
+    print("Please install it with: pip install requests")
+    print("   Or install all requirements: pip install -r requirements.txt")
+    sys.exit(1)
+
+def get_args():
+    """Get the server address from command line arguments or use defaults"""
+    parser = argparse.ArgumentParser(description='Test the Pi Sensor Backend segment store')
+    parser.add_argument('--url', default='http://192.168.68.78:8000',
+                       help='Base URL of the API server (default: http://192.168.68.78:8000)')
+    parser.add_argument('--local', action='store_true',
+                       help='Use localhost instead of Pi IP')
+
+    args = parser.parse_args()
+
+    if args.local:
+        args.url = 'http://127.0.0.1:8000'
+    return args
+
+def reading(device_id, timestamp, temperature):
+    return {"temperature": temperature, "humidity": 50.0, "lux": 300.0, "pumpActive": timestamp % 2 == 0,
+            "timestamp": timestamp, "device_id": device_id, "firmware_version": "1.0.0", "sensor_type": "DHT22"}
+
+def test_segment_store(base_url):
+    """Test the segment store"""
+
+    api = f"{base_url}/api/v1"
+    # A device of its own, so earlier runs never look like duplicates
+    device_id = f"segment_test_{int(time.time())}"
+    now = int(time.time())
+    print(f"Testing the segment store at {base_url}")
+    print("=" * 50)
+
+    # Test 1: Readings are stored and can't be changed
+    print("1. Creating a reading...")
+    try:
+        response = requests.post(f"{api}/sensor-data", json=reading(device_id, now, 20.0))
+    except requests.exceptions.ConnectionError:
+        print("[ERROR] Cannot connect to server. Make sure it's running!")
+        return False
+    if response.status_code != 201:
+        print("[ERROR] Failed to create reading:", response.status_code, response.text)
+        return False
+    first = response.json()
+    if requests.put(f"{api}/sensor-data/{first['id']}", json={"temperature": 1.0}).status_code != 405:
+        print("[ERROR] The reading could be edited. Set PI_SENSOR_READING_STORE=segments when starting the server")
+        return False
+    if requests.delete(f"{api}/sensor-data/{first['id']}").status_code != 405:
+        print("[ERROR] The reading could be deleted")
+        return False
+    print("[OK] Created reading", first["id"], "and edits are refused")
+
+    # Test 2: Duplicates get the stored reading's id
+    print("2. Sending duplicates...")
+    response = requests.post(f"{api}/sensor-data", json=reading(device_id, now, 99.0))
+    if response.status_code != 200 or response.json()["id"] != first["id"] or response.json()["temperature"] != 20.0:
+        print("[ERROR] Resent reading wasn't recognised:", response.status_code, response.text)
+        return False
+    batch = [reading(device_id, now + i, 20.0 + i) for i in (1, 2, 2, 3, 0)]
+    response = requests.post(f"{api}/sensor-data/batch", json=batch)
+    result = response.json()
+    if response.status_code != 201 or (result["created"], result["duplicates"]) != (3, 2):
+        print("[ERROR] Unexpected batch result:", response.status_code, response.text)
+        return False
+    statuses = [item["status"] for item in result["items"]]
+    if statuses != ["created", "created", "duplicate", "created", "duplicate"] or result["items"][4]["id"] != first["id"]:
+        print("[ERROR] Unexpected batch items:", result["items"])
+        return False
+    print("[OK] Duplicates detected")
+
+    # Test 3: Paging newest first
+    print("3. Paging through the device's readings...")
+    rows, cursor = [], None
+    while True:
+        params = {"device_id": device_id, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = requests.get(f"{api}/sensor-data", params=params)
+        if response.status_code != 200:
+            print("[ERROR] Failed to list readings:", response.status_code, response.text)
+            return False
+        rows += response.json()
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    if [row["timestamp"] for row in rows] != [now + 3, now + 2, now + 1, now]:
+        print("[ERROR] Unexpected pages:", rows)
+        return False
+    pumping = requests.get(f"{api}/sensor-data", params={"device_id": device_id, "pump_active": "true"}).json()
+    if sorted(row["timestamp"] for row in pumping) != sorted(t for t in (now, now + 1, now + 2, now + 3) if t % 2 == 0):
+        print("[ERROR] pump_active filter returned:", pumping)
+        return False
+    print("[OK] Pages in order")
+
+    # Test 4: Lookups by id
+    print("4. Fetching readings by id...")
+    for row in rows:
+        response = requests.get(f"{api}/sensor-data/{row['id']}")
+        if response.status_code != 200 or response.json() != row:
+            print("[ERROR] Reading doesn't match its list entry:", response.status_code, response.text)
+            return False
+    if requests.get(f"{api}/sensor-data/{max(row['id'] for row in rows) + 1000000}").status_code != 404:
+        print("[ERROR] Missing reading wasn't a 404")
+        return False
+    print("[OK] Lookups match")
+
+    # Test 5: Export, oldest first
+    print("5. Exporting...")
+    response = requests.get(f"{api}/sensor-data/export", params={"device_id": device_id, "format": "ndjson"})
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    if [row["id"] for row in exported] != [row["id"] for row in reversed(rows)]:
+        print("[ERROR] Unexpected export:", response.text)
+        return False
+    print("[OK] Export matches")
+
+    print("\nAll tests passed! The segment store is working correctly.")
+    return True
+
+if __name__ == "__main__":
+    args = get_args()
+    success = test_segment_store(args.url)
+    if not success:
+        print("\nMake sure to:")
+        print("   1. Install dependencies: pip install -r requirements.txt")
+        print("   2. Start the server in segment mode: PI_SENSOR_READING_STORE=segments uvicorn app.main:app --host 0.0.0.0 --port 8000")
+        print("   3. Update the IP address in this script or use --local flag")
+        print("\nUsage examples:")
+        print("   python test_segment_store.py --local                    # Test localhost")
+        print("   python test_segment_store.py --url http://192.168.1.100:8000")
+        exit(1)
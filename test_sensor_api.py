@@ -7,6 +7,7 @@ This simulates the Arduino POST request.
 import sys
 import json
 import time
+import struct
 import argparse
 
 try:
@@ -143,6 +144,97 @@ def test_sensor_api(base_url):
         print("[ERROR] Error deleting sensor data:", str(e))
         return False
     
+    # Test 6: Batch ingest
+    print("6. Testing batch sensor data POST...")
+    batch = [dict(sensor_data, timestamp=sensor_data["timestamp"] + i) for i in range(5)]
+    batch.append({"temperature": "not a number", "device_id": "autogrow_esp32"})
+    batch.append(5)
+    
+    try:
+        response = requests.post(f"{api_endpoint}/batch", json=batch, headers=headers)
+        if response.status_code == 201:
+            result = response.json()
+            print("[OK] Batch accepted!")
+            print("   Created:", result["created"], "Failed:", result["failed"])
+            if result["created"] != 5 or result["failed"] != 2 or [item["status"] for item in result["items"][5:]] != ["error", "error"]:
+                print("[ERROR] Unexpected per-item status:", result["items"])
+                return False
+            for item in result["items"][:5]:
+                requests.delete(f"{base_url}/api/v1/sensor-data/{item['id']}")
+        else:
+            print("[ERROR] Failed to post batch:", response.status_code)
+            print("   Response:", response.text)
+            return False
+    except Exception as e:
+        print("[ERROR] Error posting batch:", str(e))
+        return False
+    
+    # Test 7: Binary ingest, encoded the way the firmware packs it
+    print("7. Testing binary sensor data POST...")
+    body = struct.pack("<2sBH", b"PS", 1, 3)
+    for text in (b"autogrow_esp32", b"1.0.0", b"DHT11_LDR"):
+        body += bytes([len(text)]) + text
+    body += struct.pack("<hHIBI", 2550, 6020, 15000, 0, sensor_data["timestamp"])
+    body += struct.pack("<hHIBI", -32768, 6020, 15000, 0, sensor_data["timestamp"] + 1)  # failed sensor read
+    body += struct.pack("<hHIBI", -125, 6020, 15000, 1, sensor_data["timestamp"] + 2)
+    
+    try:
+        response = requests.post(f"{api_endpoint}/binary", data=body,
+                                 headers={"Content-Type": "application/octet-stream"})
+        if response.status_code == 201:
+            result = response.json()
+            print("[OK] Binary body accepted!")
+            print("   Bytes:", len(body), "Created:", result["created"], "Failed:", result["failed"])
+            if result["created"] != 2 or result["items"][1]["status"] != "error":
+                print("[ERROR] Unexpected per-item status:", result["items"])
+                return False
+            stored = requests.get(f"{base_url}/api/v1/sensor-data/{result['items'][2]['id']}").json()
+            if stored["temperature"] != -1.25 or stored["humidity"] != 60.2 or not stored["pump_active"]:
+                print("[ERROR] Decoded reading doesn't match:", stored)
+                return False
+            for item in result["items"]:
+                if item["id"]:
+                    requests.delete(f"{base_url}/api/v1/sensor-data/{item['id']}")
+        else:
+            print("[ERROR] Failed to post binary body:", response.status_code)
+            print("   Response:", response.text)
+            return False
+    except Exception as e:
+        print("[ERROR] Error posting binary body:", str(e))
+        return False
+    
+    # Test 8: A resent reading (same device and timestamp) is stored once
+    print("8. Testing duplicate readings...")
+    resent = dict(sensor_data, timestamp=sensor_data["timestamp"] + 100)
+    
+    try:
+        first = requests.post(api_endpoint, json=resent, headers=headers)
+        retry = requests.post(api_endpoint, json=resent, headers=headers)
+        if first.status_code != 201 or retry.status_code != 200 or retry.json()["id"] != first.json()["id"]:
+            print("[ERROR] Resent reading wasn't recognised:", first.status_code, retry.status_code, retry.text)
+            return False
+        print("[OK] Resent reading returned the stored one, ID:", retry.json()["id"])
+        batch = [resent, dict(resent, timestamp=resent["timestamp"] + 1), dict(resent, timestamp=resent["timestamp"] + 1)]
+        result = requests.post(f"{api_endpoint}/batch", json=batch, headers=headers).json()
+        print("   Batch created:", result["created"], "Duplicates:", result["duplicates"])
+        statuses = [item["status"] for item in result["items"]]
+        if result["created"] != 1 or result["duplicates"] != 2 or statuses != ["duplicate", "created", "duplicate"]:
+            print("[ERROR] Unexpected per-item status:", result["items"])
+            return False
+        if result["items"][0]["id"] != first.json()["id"] or result["items"][1]["id"] != result["items"][2]["id"]:
+            print("[ERROR] Duplicates don't point at the stored readings:", result["items"])
+            return False
+        clash = requests.put(f"{api_endpoint}/{result['items'][1]['id']}", json={"timestamp": resent["timestamp"]})
+        if clash.status_code != 409 or str(first.json()["id"]) not in clash.json()["detail"]:
+            print("[ERROR] Update onto a stored reading's timestamp wasn't refused:", clash.status_code, clash.text)
+            return False
+        print("[OK] Update onto a stored reading's timestamp refused:", clash.json()["detail"])
+        for sensor_id in {item["id"] for item in result["items"]}:
+            requests.delete(f"{base_url}/api/v1/sensor-data/{sensor_id}")
+    except Exception as e:
+        print("[ERROR] Error posting duplicate readings:", str(e))
+        return False
+    
     print("\nAll tests passed! The API is working correctly.")
     return True
 
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Test script for the UDP telemetry listener.
+Sends readings over UDP the way a device would, then checks through the
+HTTP API that they were stored and counted.
+
+Start the server with the listener enabled first, e.g.:
+    PI_SENSOR_UDP_PORT=8001 uvicorn app.main:app --host 0.0.0.0 --port 8000
+"""
+
+import sys
+import json
+import time
+import socket
+import struct
+import argparse
+
+try:
+    import requests
+except ImportError:
+    print("Error: 'requests' module not found!")
+    print("Please install it with: pip install requests")
+    print("   Or install all requirements: pip install -r requirements.txt")
+    sys.exit(1)
+
+DEVICE_ID = "udp_test_device"
+
+def get_args():
+    """Get the server address from command line arguments or use defaults"""
+    parser = argparse.ArgumentParser(description='Test the Pi Sensor Backend UDP telemetry listener')
+    parser.add_argument('--url', default='http://192.168.68.78:8000',
+                       help='Base URL of the API server (default: http://192.168.68.78:8000)')
+    parser.add_argument('--local', action='store_true',
+                       help='Use localhost instead of Pi IP')
+    parser.add_argument('--udp-port', type=int, default=8001,
+                       help='UDP port the listener is bound to (default: 8001)')
+
+    args = parser.parse_args()
+
+    if args.local:
+        args.url = 'http://127.0.0.1:8000'
+    return args
+
+def binary_datagram(readings):
+    """Encode (temperature, humidity, lux, pump, timestamp) tuples in the binary format"""
+    body = struct.pack("<2sBH", b"PS", 1, len(readings))
+    for text in (DEVICE_ID.encode(), b"1.0.0", b"DHT11_LDR"):
+        body += bytes([len(text)]) + text
+    for temperature, humidity, lux, pump, timestamp in readings:
+        body += struct.pack("<hHIBI", round(temperature * 100), round(humidity * 100), round(lux * 100), pump, timestamp)
+    return body
+
+def udp_stats(base_url):
+    stats = requests.get(f"{base_url}/api/v1/ingest/stats").json()
+    return stats.get("udp")
+
+def test_udp_telemetry(base_url, udp_port):
+    """Test the UDP telemetry listener"""
+
+    host = base_url.split("//", 1)[1].split(":")[0]
+    print(f"Testing UDP telemetry on {host}:{udp_port}")
+    print("=" * 50)
+
+    # Test 1: Listener is enabled
+    print("1. Checking listener stats...")
+    try:
+        before = udp_stats(base_url)
+        if before is None:
+            print("[ERROR] UDP listener is not enabled. Set PI_SENSOR_UDP_PORT when starting the server")
+            return False
+        print("[OK] Listener running:", before["address"])
+    except requests.exceptions.ConnectionError:
+        print("[ERROR] Cannot connect to server. Make sure it's running!")
+        return False
+
+    existing = len(requests.get(f"{base_url}/api/v1/sensor-data", params={"device_id": DEVICE_ID, "limit": 1000}).json())
+    now = int(time.time())
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    # Test 2: Binary datagrams, one of them with a failed sensor read
+    print("2. Sending binary datagrams...")
+    sock.sendto(binary_datagram([(21.5, 55.0, 320.0, 0, now), (21.6, 55.1, 321.0, 0, now + 1)]), (host, udp_port))
+    sock.sendto(binary_datagram([(-327.68, 55.0, 320.0, 0, now + 2)]), (host, udp_port))
+
+    # Test 3: JSON datagram, validated like POST /api/v1/sensor-data
+    print("3. Sending JSON datagrams...")
+    reading = {"temperature": 22.0, "humidity": 50.0, "lux": 300.0, "pumpActive": True,
+               "timestamp": now + 3, "device_id": DEVICE_ID}
+    sock.sendto(json.dumps(reading).encode(), (host, udp_port))
+    sock.sendto(json.dumps([reading, {"temperature": "hot"}]).encode(), (host, udp_port))
+
+    # Test 4: Garbage
+    print("4. Sending malformed datagrams...")
+    sock.sendto(b"\x00\x01garbage", (host, udp_port))
+    sock.sendto(b"PS\x01\x05\x00", (host, udp_port))
+    sock.close()
+
+    # Readings are committed in groups, so give the writer a moment
+    time.sleep(1)
+
+    print("5. Checking counters and stored readings...")
+    after = udp_stats(base_url)
+    received = after["packets_received"] - before["packets_received"]
+    malformed = after["packets_malformed"] - before["packets_malformed"]
+    accepted = after["readings_accepted"] - before["readings_accepted"]
+    invalid = after["readings_invalid"] - before["readings_invalid"]
+    duplicate = after["readings_duplicate"] - before["readings_duplicate"]
+    print(f"   Received: {received} Malformed: {malformed} Accepted: {accepted} Invalid: {invalid} Duplicate: {duplicate}")
+    # The JSON reading was sent twice and is stored once
+    if (received, malformed, accepted, invalid, duplicate) != (6, 2, 4, 2, 1):
+        print("[ERROR] Unexpected counters:", after)
+        return False
+
+    stored = requests.get(f"{base_url}/api/v1/sensor-data", params={"device_id": DEVICE_ID, "limit": 1000}).json()
+    new_rows = stored[:len(stored) - existing]
+    if len(new_rows) != 3:
+        print("[ERROR] Expected 3 stored readings, found", len(new_rows))
+        return False
+    if sorted(row["temperature"] for row in new_rows) != [21.5, 21.6, 22.0]:
+        print("[ERROR] Stored readings don't match:", new_rows)
+        return False
+    print("[OK] Readings stored and counted")
+
+    for row in new_rows:
+        requests.delete(f"{base_url}/api/v1/sensor-data/{row['id']}")
+
+    print("\nAll tests passed! UDP telemetry is working correctly.")
+    return True
+
+if __name__ == "__main__":
+    args = get_args()
+    success = test_udp_telemetry(args.url, args.udp_port)
+    if not success:
+        print("\nMake sure to:")
+        print("   1. Install dependencies: pip install -r requirements.txt")
+        print("   2. Start the server with the listener: PI_SENSOR_UDP_PORT=8001 uvicorn app.main:app --host 0.0.0.0 --port 8000")
+        print("   3. Update the IP address in this script or use --local flag")
+        print("\nUsage examples:")
+        print("   python test_udp_telemetry.py --local                    # Test localhost")
+        print("   python test_udp_telemetry.py --url http://192.168.1.100:8000 --udp-port 8001")
+        exit(1)